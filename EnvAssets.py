@@ -0,0 +1,138 @@
+'''
+Environment Generator Project
+Asset cache: OBJ meshes parsed once, in parallel, and kept as arrays keyed by file path, time and contents
+'''
+
+from __future__ import division
+import hashlib
+import os
+from collections import OrderedDict
+import numpy as np
+import EnvCache
+import EnvCity
+import EnvParallel
+
+# where parsed assets go and how much room they get
+ASSET_DIR = os.path.join(os.path.expanduser("~"), ".envGenerator", "assets")
+ASSET_LIMIT = 1024 * 1024 * 1024
+
+
+# key of an asset file: where it is, when it last changed and what is in it
+def assetKey(path):
+    path = os.path.abspath(path)
+    digest = hashlib.sha1()
+    with open(path, "rb") as handle:
+        for block in iter(lambda: handle.read(1 << 20), b""):
+            digest.update(block)
+    return EnvCache.stageKey("asset", path, os.path.getmtime(path), digest.hexdigest())
+
+
+# ids of face corners as written in an OBJ: 1 based, or negative counting back from the last one so far
+def cornerIds(tokens, defined):
+    ids = np.where(tokens == "", "0", tokens).astype(np.int64)
+    return np.where(ids < 0, defined + ids, ids - 1)
+
+
+# meshes of an OBJ file as (name, mesh), one per object or group like maya's multiple objects import
+# positions, faces and uvs are kept, normals and materials left out
+def parseObj(path):
+    points, uvs, faces, pointsBefore, uvsBefore = [], [], [], [], []
+    objects = []
+    with open(path) as handle:
+        for line in handle:
+            if line.startswith("v "):
+                points.append(line.split()[1:4])
+            elif line.startswith("vt "):
+                uvs.append(line.split()[1:3])
+            elif line.startswith("f "):
+                faces.append(line.split()[1:])
+                pointsBefore.append(len(points))
+                uvsBefore.append(len(uvs))
+            elif line.startswith(("o ", "g ")):
+                objects.append((line[2:].strip(), len(faces)))
+    if not faces:
+        return []
+    points = np.array(points, dtype=np.float64).reshape(-1, 3)
+    uvs = np.array(uvs, dtype=np.float64).reshape(-1, 2)
+    faceCounts = np.array([len(face) for face in faces], dtype=np.int32)
+    corners = np.array([corner for face in faces for corner in face], dtype=np.str_)
+    # v, v/vt, v//vn or v/vt/vn
+    vertex, slash, rest = np.char.partition(corners, "/").T
+    uvToken = np.char.partition(rest, "/")[:, 0]
+    faceConnects = cornerIds(vertex, np.repeat(pointsBefore, faceCounts))
+    uvIds = cornerIds(uvToken, np.repeat(uvsBefore, faceCounts))
+    hasUVs = uvToken != ""
+    # faces before the first object or group belong to the file
+    name = os.path.splitext(os.path.basename(path))[0]
+    starts = [(name, 0)] + objects + [(None, len(faces))]
+    faceStart = np.concatenate([[0], np.cumsum(faceCounts)])
+    meshes = []
+    for (name, first), (following, last) in zip(starts[:-1], starts[1:]):
+        if last <= first:
+            continue
+        begin, end = faceStart[first], faceStart[last]
+        # only the vertices the object's faces use, renumbered from 0
+        used, connects = np.unique(faceConnects[begin:end], return_inverse=True)
+        mesh = EnvCity.Mesh(points[used], faceCounts[first:last], connects.ravel())
+        if hasUVs[begin:end].all():
+            usedUVs, uvConnects = np.unique(uvIds[begin:end], return_inverse=True)
+            mesh.uvs, mesh.uvIds = uvs[usedUVs], uvConnects.ravel()
+        meshes.append((name, mesh))
+    return meshes
+
+
+# meshes as arrays for one cache entry: all buffers end to end, with the sizes of every mesh
+def packMeshes(meshes):
+    arrays = dict(names=np.array([name for name, mesh in meshes], dtype=np.str_))
+    for array, dtype in (("points", np.float32), ("faceCounts", np.int32), ("faceConnects", np.int32),
+                         ("uvs", np.float32), ("uvIds", np.int32)):
+        parts = [getattr(mesh, array) for name, mesh in meshes]
+        arrays[array + "Sizes"] = np.array([len(part) if part is not None else 0 for part in parts])
+        width = 3 if array == "points" else 2 if array == "uvs" else None
+        parts = [part for part in parts if part is not None]
+        empty = np.zeros((0, width) if width else 0)
+        arrays[array] = np.concatenate(parts).astype(dtype) if parts else empty.astype(dtype)
+    return arrays
+
+
+def unpackMeshes(arrays):
+    meshes = []
+    split = {}
+    for array in ("points", "faceCounts", "faceConnects", "uvs", "uvIds"):
+        split[array] = np.split(arrays[array], np.cumsum(arrays[array + "Sizes"])[:-1])
+    for i, name in enumerate(arrays["names"]):
+        mesh = EnvCity.Mesh(split["points"][i], split["faceCounts"][i], split["faceConnects"][i])
+        if arrays["uvsSizes"][i]:
+            mesh.uvs, mesh.uvIds = split["uvs"][i].astype(np.float64), split["uvIds"][i]
+        meshes.append((str(name), mesh))
+    return meshes
+
+
+# parsed in a worker process, handed back packed
+def parseJob(path):
+    return packMeshes(parseObj(path))
+
+
+class AssetCache(object):
+    # parsed OBJ files on disk, only the files not seen before parsed, those across a process pool
+    def __init__(self, folder=ASSET_DIR, limit=ASSET_LIMIT):
+        self.cache = EnvCache.StageCache(folder, limit)
+
+    # meshes of every file as a list of (name, mesh) lists, in the order of the paths
+    # returns the meshes and how many files came from the cache
+    def load(self, paths, workers=None):
+        keys = [assetKey(path) for path in paths]
+        stored = dict((key, self.cache.load(key)) for key in set(keys))
+        # a file picked twice is parsed once
+        missing = OrderedDict((key, path) for key, path in zip(keys, paths) if stored[key] is None)
+        for key, arrays in zip(missing, EnvParallel.mapJobs(parseJob, list(missing.values()), workers)):
+            self.cache.save(key, **arrays)
+            stored[key] = arrays
+        cached = sum(key not in missing for key in keys)
+        return [unpackMeshes(stored[key]) for key in keys], cached
+
+    def size(self):
+        return self.cache.size()
+
+    def clear(self):
+        self.cache.clear()
@@ -0,0 +1,258 @@
+'''
+Environment Generator Project
+Batch generation: cities from json or yaml configs, made in a process pool without maya and written to disk
+'''
+
+from __future__ import division, print_function
+import argparse
+import collections
+import json
+import multiprocessing
+import os
+import sys
+import time
+import traceback
+import numpy as np
+import EnvCity
+import EnvCurve
+import EnvExport
+import EnvHeightfield
+import EnvParallel
+import EnvRandom
+
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+# every setting a city can have, named like the attributes of the generator's UI
+DEFAULTS = dict(
+    # terrain, left out when DimVal is 0
+    DimVal=20, DivVal=20, HeightVal=1.0, DepthVal=-1.0, terrainSeed=1,
+    # roads along roadCurves, each a dict of cvs, optional knots and degree, and any road setting of its own
+    roadCurves=[], widthValRoad=1, divValRoad=15, tessellationRoad=1, toleranceRoad=0.05, terrainRoad=True,
+    clearanceRoad=0.05, flattenValRoad=True, shoulderRoad=1.0, depthRiver=1.0, bankRiver=2.0, heightValRoad=0,
+    riverValRoad=False,
+    # buildings along the road curves picked by buildingCurves (all of them when None), from buildingSources
+    # each source a dict of name, object space bounds, rotate and scale
+    buildingSources=[dict(name="building")], buildingCurves=None, copiesBuilding=10, offsetValBuilding=0,
+    randRotateBuilding=0, rotAlongCRVBuilding=False, randScaleBuilding=0.0, overlapBuilding=1,
+    spacingBuilding=0.0, buildingSeed=1, terrainBuilding=True,
+    # buildings filling the blocks between the road curves
+    blockCity=False, blockRoadWidth=1.0, blockLotArea=50.0, blockLotWidth=3.0, blockFill=0.8,
+    # sun, left out when userNorth is 0, and weather over the terrain when the scene is dynamic
+    userNorth=0, userTime=0, userWeather=1, dynamicScene=False, userFrameStart=0, userFrameEnd=200,
+    userTimeStart=6, userTimeEnd=18, changeIntensity=1.0, userLightColor=(1.0, 1.0, 1.0),
+    # seed of every stage when given, count cities with seeds counting up from it
+    # without one every city gets a fresh seed, kept in the manifest so it can be made again
+    # an .obj or .gltf output is exported, anything else written as an .npz of the model's arrays
+    seed=None, count=1, output="city_{seed}.npz")
+# a source the size of a unit cube standing on the ground
+SOURCE_BOUNDS = (-0.5, 0.0, -0.5, 0.5, 1.0, 0.5)
+
+
+class ArchiveBackend(EnvCity.SceneBackend):
+    # every part of the city as arrays in one .npz, named kind/name/array
+    def __init__(self):
+        self.arrays = {}
+
+    def writeMesh(self, name, mesh):
+        for array in ("points", "faceCounts", "faceConnects"):
+            self.arrays["mesh/%s/%s" % (name, array)] = getattr(mesh, array)
+        return name
+
+    def writePlacements(self, name, placements):
+        self.arrays["placements/%s/sources" % name] = np.array(placements.sources, dtype=np.str_)
+        for array in ("sourceIndex", "translates", "rotates", "scales"):
+            self.arrays["placements/%s/%s" % (name, array)] = getattr(placements, array)
+        return name
+
+    def writeSun(self, name, sun):
+        self.arrays["sun/%s/rotation" % name] = np.array(sun.rotation)
+        self.arrays["sun/%s/color" % name] = np.array(sun.color)
+        self.arrays["sun/%s/intensity" % name] = np.array(sun.intensity)
+        self.arrays["sun/%s/keys" % name] = np.array(sun.keys, dtype=np.float64).reshape(-1, 2)
+        self.arrays["sun/%s/axis" % name] = np.array(sun.axis or "")
+        return name
+
+    def writeWeather(self, name, weather):
+        self.arrays["weather/%s/kind" % name] = np.array(weather.kind)
+        self.arrays["weather/%s/settings" % name] = np.array(json.dumps(weather.settings))
+        return name
+
+    def save(self, path):
+        np.savez_compressed(path, **self.arrays)
+
+
+# settings of every city a config file asks for, each with its own seed and output path
+# a file holds one config or a list of them; yaml needs PyYAML
+def readConfigs(path):
+    with open(path) as handle:
+        if os.path.splitext(path)[1].lower() in (".yaml", ".yml"):
+            if yaml is None:
+                raise ImportError("PyYAML is needed to read %s" % path)
+            configs = yaml.safe_load(handle)
+        else:
+            configs = json.load(handle)
+    if isinstance(configs, dict):
+        configs = [configs]
+    cities = []
+    for number, config in enumerate(configs):
+        unknown = set(config) - set(DEFAULTS)
+        if unknown:
+            raise ValueError("%s: unknown settings %s" % (path, ", ".join(sorted(unknown))))
+        settings = dict(DEFAULTS, **config)
+        for index in range(settings["count"]):
+            city = dict(settings)
+            if settings["seed"] is not None:
+                city["seed"] = city["terrainSeed"] = city["buildingSeed"] = settings["seed"] + index
+            else:
+                # stage seeds the config gives are kept, the others come from the city's own seed
+                city["seed"] = EnvRandom.newSeed()
+                for stage in ("terrainSeed", "buildingSeed"):
+                    if stage not in config:
+                        city[stage] = city["seed"]
+            # relative outputs go next to the config
+            name = settings["output"].format(seed=city["seed"], index=index, config=number)
+            city["output"] = os.path.join(os.path.dirname(os.path.abspath(path)), name)
+            cities.append(city)
+    return cities
+
+
+# clamped uniform knots the way maya lays them out, for curves given by their cvs only
+def mayaKnots(count, degree):
+    return [0] * degree + list(range(1, count - degree)) + [count - degree] * degree
+
+
+def curveSampler(road):
+    cvs = np.asarray(road["cvs"], dtype=np.float64)
+    degree = road.get("degree", 3 if len(cvs) > 3 else 1)
+    knots = road.get("knots") or mayaKnots(len(cvs), degree)
+    return EnvCurve.getSampler(cvs, knots, degree, road.get("periodic", False))
+
+
+# rotation, scale and bounds arrays of the building sources
+def sourceArrays(sources):
+    rotates = np.array([source.get("rotate", (0, 0, 0)) for source in sources], dtype=np.float64)
+    scales = np.array([source.get("scale", (1, 1, 1)) for source in sources], dtype=np.float64)
+    bounds = np.array([source.get("bounds", SOURCE_BOUNDS) for source in sources], dtype=np.float64)
+    return rotates, scales, bounds
+
+
+# the whole city of one settings dict, stage after stage the way the generator's tabs make it
+def cityModel(settings):
+    city = EnvCity.CityModel()
+    s = settings
+    terrain = ground = None
+    if s["DimVal"]:
+        terrain = EnvCity.terrainPoints(s["DimVal"], s["DivVal"], s["HeightVal"], s["DepthVal"], s["terrainSeed"])
+        ground = EnvHeightfield.HeightGrid(terrain, s["DivVal"] + 1, s["DivVal"] + 1)
+    samplers = []
+    roads = []
+    for number, curve in enumerate(s["roadCurves"]):
+        road = dict(s, **curve)
+        sampler = curveSampler(road)
+        samplers.append(sampler)
+        onGround = ground if road["terrainRoad"] else None
+        mesh, heights = EnvCity.roadModel(sampler, road["widthValRoad"], road["divValRoad"], road["heightValRoad"],
+                                          road["tessellationRoad"], road["toleranceRoad"], onGround,
+                                          road["riverValRoad"], road["clearanceRoad"], road["flattenValRoad"],
+                                          road["shoulderRoad"], road["depthRiver"], road["bankRiver"])
+        roads.append((road.get("name", "road%d" % number), mesh))
+        if heights is not None:
+            # later roads and the buildings stand on the changed ground
+            terrain = terrain.copy()
+            terrain[:, 1] = heights
+            ground = EnvHeightfield.HeightGrid(terrain, s["DivVal"] + 1, s["DivVal"] + 1)
+    if terrain is not None:
+        city.meshes["terrain"] = EnvCity.planeMesh(terrain, s["DivVal"])
+    for name, mesh in roads:
+        city.meshes[name] = mesh
+    sources = [source["name"] for source in s["buildingSources"]]
+    srcRotates, srcScales, bounds = sourceArrays(s["buildingSources"])
+    if s["copiesBuilding"] and sources:
+        picked = range(len(samplers)) if s["buildingCurves"] is None else s["buildingCurves"]
+        for number in picked:
+            curve = s["roadCurves"][number].get("name", "road%d" % number)
+            city.placements["buildings%d" % number] = EnvCity.curvePlacements(
+                samplers[number], curve, sources, srcRotates, srcScales, bounds, s["copiesBuilding"],
+                s["offsetValBuilding"], s["randRotateBuilding"], s["rotAlongCRVBuilding"], s["randScaleBuilding"],
+                s["overlapBuilding"], s["spacingBuilding"], s["buildingSeed"],
+                ground if s["terrainBuilding"] else None)
+    if s["blockCity"] and samplers and sources:
+        polylines = [sampler.polyline(s["blockLotWidth"] * 0.5) for sampler in samplers]
+        city.placements["blocks"] = EnvCity.blockPlacements(polylines, sources, srcRotates, srcScales, bounds,
+                                                            s["blockRoadWidth"], s["blockLotArea"],
+                                                            s["blockLotWidth"], s["blockFill"], s["buildingSeed"])
+    if s["userNorth"]:
+        city.suns["sun"] = EnvCity.sunModel(s["userNorth"], s["userTime"], s["userLightColor"],
+                                            s["changeIntensity"], s["dynamicScene"], s["userFrameStart"],
+                                            s["userFrameEnd"], s["userTimeStart"], s["userTimeEnd"])
+        if s["dynamicScene"] and terrain is not None:
+            weather = EnvCity.weatherModel(s["userWeather"], "terrain",
+                                           np.concatenate([terrain.min(axis=0), terrain.max(axis=0)]),
+                                           s["userFrameStart"], s["userFrameEnd"])
+            if weather.kind in EnvCity.WEATHER_NAMES:
+                city.weather[EnvCity.WEATHER_NAMES[weather.kind]] = weather
+    return city
+
+
+# make and write one city, a failure reported in the result so the rest of the batch goes on
+def generateJob(settings):
+    start = time.time()
+    result = dict(output=settings["output"], seed=settings["seed"])
+    try:
+        city = cityModel(settings)
+        folder = os.path.dirname(settings["output"])
+        if folder and not os.path.isdir(folder):
+            os.makedirs(folder)
+        if os.path.splitext(settings["output"])[1].lower() in EnvExport.BACKENDS:
+            # the sources have no meshes here, they go out as boxes of their bounds
+            sources = settings["buildingSources"]
+            boxes = dict((source["name"], EnvExport.boxMesh(bounds)) for source, bounds in 
+                         zip(sources, sourceArrays(sources)[2]))
+            EnvExport.exportCity(settings["output"], city, boxes)
+        else:
+            backend = ArchiveBackend()
+            backend.write(city)
+            backend.save(settings["output"])
+        result.update(meshes=len(city.meshes), copies=sum(len(item) for item in city.placements.values()))
+    except Exception:
+        result["error"] = traceback.format_exc()
+    result["seconds"] = time.time() - start
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate cities from json or yaml config files.")
+    parser.add_argument("configs", nargs="+", help="config files, each holding one config or a list")
+    parser.add_argument("--workers", type=int, default=None, help="processes to use, one per core by default")
+    parser.add_argument("--manifest", default="batch.json", help="where the list of made cities goes")
+    args = parser.parse_args(argv)
+    cities = []
+    for path in args.configs:
+        cities.extend(readConfigs(path))
+    # every city needs a file of its own, or the workers write over each other
+    repeated = [output for output, count in collections.Counter(city["output"] for city in cities).items()
+                if count > 1]
+    if repeated:
+        parser.error("more than one city would be written to %s, put {seed} or {index} in the output"
+                     % ", ".join(sorted(repeated)))
+    # no maya to leave a core for
+    workers = args.workers or multiprocessing.cpu_count()
+    results = []
+    for result in EnvParallel.mapJobs(generateJob, cities, workers):
+        results.append(result)
+        if "error" in result:
+            print("failed   %s\n%s" % (result["output"], result["error"]))
+        else:
+            print("%6.2f s  %s" % (result["seconds"], result["output"]))
+    with open(args.manifest, "w") as handle:
+        json.dump(results, handle, indent=2)
+    failed = sum("error" in result for result in results)
+    print("%d of %d cities made." % (len(results) - failed, len(results)))
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,161 @@
+'''
+Environment Generator Project
+Benchmarks: the generators run on the maya stand-in over parameter sweeps, results written as json
+'''
+
+from __future__ import division, print_function
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import numpy as np
+import EnvMayaStub
+
+# the generator imports maya, so the stand-in has to be in place first
+EnvMayaStub.install()
+import EnvGenerator_v18 as generator
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# parameter sweeps, the quick ones for a check before committing
+SWEEPS = dict(terrain=(10, 25, 50, 100, 200), buildings=(10, 100, 1000), roads=(10, 100, 500), 
+              lights=(1, 2, 3, 4))
+QUICK_SWEEPS = dict(terrain=(10, 50), buildings=(10, 100), roads=(10, 100), lights=(1, 3))
+
+
+# a winding curve across the middle of the terrain
+def benchCurve(length=80.0, cvs=12):
+    x = np.linspace(-0.5, 0.5, cvs) * length
+    z = np.sin(np.linspace(0.0, 3.0 * np.pi, cvs)) * length * 0.15
+    return generator.cmds.curve(p=np.column_stack([x, np.zeros(cvs), z]).tolist(), d=3, name="benchCurve")
+
+
+def benchTerrain(divisions=50):
+    return generator.Terrain(100, divisions, 2.0, -2.0, seed=1, name="terrain").nameTR
+
+
+# every case prepares its scene untimed and returns the timed run, which gives the amount of work done
+def terrainCase(divisions):
+    def run():
+        benchTerrain(divisions)
+        return (divisions + 1) ** 2
+    return run, "terrain divisions", "vertices"
+
+
+def buildingCase(copies, mode=1):
+    source = generator.cmds.polyCube(name="house", width=1.0, height=2.0, depth=1.0)[0]
+    curve = benchCurve()
+    terrain = benchTerrain()
+    def run():
+        generator.Building(copies, 0, 30, False, 0.5, [source], curve, mode=mode, overlap=2, seed=1, 
+                           terrain=terrain, name="buildingGrp")
+        return copies
+    return run, "building copies", "copies"
+
+
+def roadCase(divisions):
+    curve = benchCurve()
+    terrain = benchTerrain()
+    def run():
+        generator.Road(2.0, divisions, 0.0, False, 1, curve, 0, True, terrain=terrain, name="road")
+        return divisions
+    return run, "road divisions", "divisions"
+
+
+def lightCase(weather):
+    terrain = benchTerrain()
+    def run():
+        generator.Light(1, 12, weather, True, 1, 200, 6, 18, 1.0, (1.0, 1.0, 1.0), terrain, name="sun")
+        return 1
+    return run, "weather", "lights"
+
+
+CASES = dict(terrain=terrainCase, buildings=buildingCase, roads=roadCase, lights=lightCase)
+
+
+# one case on a fresh scene: wall time, maya calls, nodes left in the scene and peak memory of the run
+# tracing memory slows every allocation down, so it only runs when asked for
+def measure(stage, value, devnull, traceMemory=False):
+    EnvMayaStub.reset()
+    generator._heightIndexes.clear()
+    run, parameter, unit = CASES[stage](value)
+    EnvMayaStub.scene.calls = {}
+    nodesBefore = len(EnvMayaStub.scene.nodes)
+    if traceMemory:
+        tracemalloc.start()
+    stdout, sys.stdout = sys.stdout, devnull
+    started = time.time()
+    try:
+        work = run()
+    finally:
+        seconds = time.time() - started
+        sys.stdout = stdout
+    peak = None
+    if traceMemory:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    calls = EnvMayaStub.scene.calls
+    return dict(seconds=seconds, work=work, parameter=parameter, unit=unit, calls=calls, 
+                nodes=len(EnvMayaStub.scene.nodes) - nodesBefore, peak=peak)
+
+
+# the best of the timed repeats and the peak memory of one more traced run, as one result row
+def benchmark(stage, value, repeat, devnull):
+    runs = [measure(stage, value, devnull) for i in range(repeat)]
+    best = min(runs, key=lambda run: run["seconds"])
+    calls = sorted(best["calls"].items(), key=lambda item: -item[1])
+    peaks = [measure(stage, value, devnull, traceMemory=True)["peak"]] if tracemalloc else []
+    return dict(stage=stage, parameter=best["parameter"], value=value, repeat=repeat, 
+                seconds=best["seconds"], medianSeconds=float(np.median([run["seconds"] for run in runs])), 
+                throughput=best["work"] / max(best["seconds"], 1e-9), unit="%s per second" % best["unit"], 
+                mayaCalls=sum(best["calls"].values()), calls=dict(calls), nodesCreated=best["nodes"], 
+                peakMemory=max(peaks) if peaks else None)
+
+
+def environment(quick):
+    info = dict(time=time.strftime("%Y-%m-%dT%H:%M:%S"), python=platform.python_version(), 
+                platform=platform.platform(), numpy=np.__version__, quick=quick)
+    # without tracemalloc the peak resident size of the whole process is the best there is
+    if not tracemalloc and resource:
+        info["peakProcessMemory"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return info
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the generators on the maya stand-in.")
+    parser.add_argument("--stages", nargs="+", choices=sorted(CASES), default=sorted(CASES))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--quick", action="store_true", help="short sweeps")
+    parser.add_argument("--output", default="benchmark.json", help="json report")
+    parser.add_argument("--history", help="json lines file every run is added to")
+    args = parser.parse_args(argv)
+    sweeps = QUICK_SWEEPS if args.quick else SWEEPS
+    devnull = open(os.devnull, "w")
+    results = []
+    for stage in args.stages:
+        for value in sweeps[stage]:
+            result = benchmark(stage, value, args.repeat, devnull)
+            results.append(result)
+            print("%-10s %-18s %6s  %8.4f s  %12.1f %-20s %6d calls  %5d nodes" % (
+                stage, result["parameter"], value, result["seconds"], result["throughput"], result["unit"], 
+                result["mayaCalls"], result["nodesCreated"]))
+    report = dict(environment=environment(args.quick), results=results)
+    with open(args.output, "w") as handle:
+        json.dump(report, handle, indent=2)
+    if args.history:
+        with open(args.history, "a") as handle:
+            handle.write(json.dumps(report) + "\n")
+    return report
+
+
+if __name__ == "__main__":
+    main()
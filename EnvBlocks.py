@@ -0,0 +1,176 @@
+'''
+Environment Generator Project
+City blocks: closed regions between road curves split into building lots
+'''
+
+from __future__ import division
+import numpy as np
+import EnvRandom
+import EnvRoadNetwork
+
+
+def polygonArea(poly):
+    x = poly[:, 0]
+    z = poly[:, 1]
+    return 0.5 * (x.dot(np.roll(z, -1)) - z.dot(np.roll(x, -1)))
+
+
+# closed regions of a planar graph, each as a list of node ids going counter clockwise
+def graphFaces(nodes, edges):
+    if len(edges) == 0:
+        return []
+    # half edges both ways, sorted around their start node by angle
+    origin = np.concatenate([edges[:, 0], edges[:, 1]])
+    target = np.concatenate([edges[:, 1], edges[:, 0]])
+    count = len(edges)
+    twin = np.concatenate([np.arange(count, 2 * count), np.arange(count)])
+    delta = nodes[target][:, [0, 2]] - nodes[origin][:, [0, 2]]
+    angle = np.arctan2(delta[:, 1], delta[:, 0])
+    order = np.lexsort((angle, origin))
+    rank = np.empty_like(order)
+    rank[order] = np.arange(len(order))
+    first = np.searchsorted(origin[order], np.arange(len(nodes)))
+    degree = np.bincount(origin, minlength=len(nodes))
+    # after arriving at a node, leave by the edge just clockwise of the way back
+    back = twin
+    node = origin[back]
+    nextEdge = order[first[node] + (rank[back] - first[node] - 1) % degree[node]]
+    # follow the next links to collect every cycle once
+    faces = []
+    seen = np.zeros(len(origin), dtype=bool)
+    nextList = nextEdge.tolist()
+    originList = origin.tolist()
+    for startEdge in range(len(origin)):
+        if seen[startEdge]:
+            continue
+        face = []
+        edge = startEdge
+        while not seen[edge]:
+            seen[edge] = True
+            face.append(originList[edge])
+            edge = nextList[edge]
+        faces.append(face)
+    flat = nodes[:, [0, 2]]
+    return [face for face in faces if len(face) > 2 and polygonArea(flat[face]) > 0]
+
+
+# shrink a counter clockwise polygon by a distance, mitred corners with a length limit
+def insetPolygon(poly, distance, miterLimit=4.0):
+    if distance <= 0:
+        return poly
+    edgeDir = np.roll(poly, -1, axis=0) - poly
+    edgeDir /= np.maximum(np.sqrt((edgeDir ** 2).sum(axis=1)), 1e-12)[:, None]
+    inward = np.column_stack([-edgeDir[:, 1], edgeDir[:, 0]])
+    before = np.roll(inward, 1, axis=0)
+    bisector = before + inward
+    scale = 1.0 / np.maximum(1.0 + (before * inward).sum(axis=1), 2.0 / miterLimit ** 2)
+    shrunk = poly + distance * bisector * scale[:, None]
+    # a region smaller than the road has nothing left
+    if polygonArea(shrunk) <= 0:
+        return None
+    return shrunk
+
+
+# smallest area boxes around many polygons at once, each with a side along one of its edges
+# returns centres (p, 2), long axis directions (p, 2) and half sizes (p, 2) along and across the axis
+def orientedBoxes(polys):
+    # pad every polygon to the same length by repeating its first point
+    size = max(len(poly) for poly in polys)
+    padded = np.array([np.concatenate([poly, np.repeat(poly[:1], size - len(poly), axis=0)]) for poly in polys])
+    edgeDir = np.roll(padded, -1, axis=1) - padded
+    length = np.sqrt((edgeDir ** 2).sum(axis=2))
+    edgeDir = edgeDir / np.maximum(length, 1e-12)[:, :, None]
+    normal = np.stack([-edgeDir[:, :, 1], edgeDir[:, :, 0]], axis=2)
+    # extents of every polygon along every one of its edge directions
+    alongU = np.einsum("pec,pvc->pev", edgeDir, padded)
+    alongV = np.einsum("pec,pvc->pev", normal, padded)
+    lowU, highU = alongU.min(axis=2), alongU.max(axis=2)
+    lowV, highV = alongV.min(axis=2), alongV.max(axis=2)
+    area = np.where(length > 1e-12, (highU - lowU) * (highV - lowV), np.inf)
+    best = np.argmin(area, axis=1)
+    rows = np.arange(len(polys))
+    axisU = edgeDir[rows, best]
+    axisV = normal[rows, best]
+    half = np.column_stack([highU[rows, best] - lowU[rows, best], highV[rows, best] - lowV[rows, best]]) * 0.5
+    centre = (axisU * (lowU[rows, best] + half[:, 0])[:, None] + axisV * (lowV[rows, best] + half[:, 1])[:, None])
+    # report the long side first
+    swap = half[:, 1] > half[:, 0]
+    axisU[swap] = axisV[swap]
+    half[swap] = half[swap][:, ::-1]
+    return centre, axisU, half
+
+
+# cut a polygon in two with the line through a point, normal pointing to the first half
+def splitPolygon(poly, point, normal):
+    side = (poly - point).dot(normal)
+    halves = ([], [])
+    count = len(poly)
+    for i in range(count):
+        j = (i + 1) % count
+        if side[i] >= 0:
+            halves[0].append(poly[i])
+        if side[i] <= 0:
+            halves[1].append(poly[i])
+        # the edge crosses the line
+        if (side[i] > 0 and side[j] < 0) or (side[i] < 0 and side[j] > 0):
+            cut = poly[i] + (poly[j] - poly[i]) * (side[i] / (side[i] - side[j]))
+            halves[0].append(cut)
+            halves[1].append(cut)
+    return [np.array(half) for half in halves if len(half) > 2]
+
+
+# split blocks into lots, cutting each piece's oriented box across its long side until small enough
+# all pieces of one round of cuts are measured together, each block draws its cuts from its own generator
+def subdivideBlocks(blocks, lotArea, lotWidth, jitter=0.1, rngs=None):
+    lots = []
+    pieces = [(poly, block) for block, poly in enumerate(blocks)]
+    while pieces:
+        centre, axis, half = orientedBoxes([poly for poly, block in pieces])
+        # stop once the lot is small enough or cannot be split without getting too narrow
+        done = (half[:, 0] * half[:, 1] * 4.0 <= lotArea) | (half[:, 0] < lotWidth)
+        offset = np.zeros(len(pieces))
+        if jitter > 0:
+            offset = np.array([(rngs[block] if rngs else np.random).uniform(-jitter, jitter) 
+                               for poly, block in pieces]) * half[:, 0]
+        cutPoint = centre + axis * offset[:, None]
+        nextPieces = []
+        for i, (poly, block) in enumerate(pieces):
+            halves = [] if done[i] else splitPolygon(poly, cutPoint[i], axis[i])
+            if len(halves) < 2:
+                lots.append((block, poly, centre[i], axis[i], half[i]))
+                continue
+            nextPieces.extend((piece, block) for piece in halves)
+        pieces = nextPieces
+    return lots
+
+
+# every lot of every block between the road polylines
+# returns lot centres (n, 3), yaw in degrees (n,), half sizes (n, 2) and the lot polygons
+def cityLots(polylines, roadWidth=1.0, lotArea=50.0, lotWidth=3.0, minBlockArea=1.0,
+             jitter=0.1, seed=0):
+    nodes, edges = EnvRoadNetwork.planarGraph(polylines)
+    edges = EnvRoadNetwork.pruneDangling(len(nodes), edges)
+    blocks = []
+    blockHeights = []
+    for face in graphFaces(nodes, edges):
+        block = insetPolygon(nodes[face][:, [0, 2]], roadWidth * 0.5)
+        if block is None or polygonArea(block) < minBlockArea:
+            continue
+        blocks.append(block)
+        blockHeights.append(nodes[face][:, 1].mean())
+    # a block's stream is named after where it is, not the order it was found in
+    rngs = [EnvRandom.stream(seed, "block", "%.3f %.3f" % tuple(block.mean(axis=0))) for block in blocks]
+    lots = subdivideBlocks(blocks, lotArea, lotWidth, jitter, rngs) if blocks else []
+    centres = [lot[2] for lot in lots]
+    axes = [lot[3] for lot in lots]
+    halves = [lot[4] for lot in lots]
+    heights = [blockHeights[lot[0]] for lot in lots]
+    polygons = [lot[1] for lot in lots]
+    if not centres:
+        return np.zeros((0, 3)), np.zeros(0), np.zeros((0, 2)), []
+    centres = np.array(centres)
+    axes = np.array(axes)
+    lotCentres = np.column_stack([centres[:, 0], heights, centres[:, 1]])
+    # the lot's long side is the local x axis of the building
+    yaw = np.degrees(np.arctan2(-axes[:, 1], axes[:, 0]))
+    return lotCentres, yaw, np.array(halves), polygons
@@ -0,0 +1,109 @@
+'''
+Environment Generator Project
+Generation cache: stage results on disk, keyed by a hash of everything that went into them
+'''
+
+from __future__ import division
+import hashlib
+import os
+import tempfile
+import numpy as np
+
+# bumped whenever a stage starts computing different results from the same inputs
+VERSION = 1
+# where results go and how much room they get
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".envGenerator", "cache")
+CACHE_LIMIT = 512 * 1024 * 1024
+
+
+# hash of a stage name and its inputs: numbers, strings, arrays, or lists and tuples of those
+def stageKey(stage, *inputs):
+    digest = hashlib.sha1()
+    digest.update(("%s %d" % (stage, VERSION)).encode("utf-8"))
+
+    def add(value):
+        if isinstance(value, np.ndarray):
+            digest.update(("array %s %s|" % (value.dtype.str, value.shape)).encode("ascii"))
+            digest.update(np.ascontiguousarray(value).tobytes())
+        elif isinstance(value, (list, tuple)):
+            digest.update(("list %d|" % len(value)).encode("ascii"))
+            for item in value:
+                add(item)
+        elif isinstance(value, float):
+            # repr keeps every bit of the float
+            digest.update(("float %r|" % value).encode("ascii"))
+        else:
+            digest.update(("%s %s|" % (type(value).__name__, value)).encode("utf-8"))
+    for value in inputs:
+        add(value)
+    return digest.hexdigest()
+
+
+class StageCache(object):
+    # one uncompressed .npz per result, least recently used dropped once the folder is over the limit
+    def __init__(self, folder=CACHE_DIR, limit=CACHE_LIMIT):
+        self.folder = folder
+        self.limit = limit
+
+    def path(self, key):
+        return os.path.join(self.folder, key + ".npz")
+
+    # the arrays stored under a key, or None
+    def load(self, key):
+        path = self.path(key)
+        if not os.path.exists(path):
+            return None
+        try:
+            with np.load(path, allow_pickle=False) as stored:
+                arrays = dict((name, stored[name]) for name in stored.files)
+        except (IOError, OSError, ValueError):
+            # a broken file is as good as a missing one
+            return None
+        # the modification time doubles as the last use
+        os.utime(path, None)
+        return arrays
+
+    # store named arrays under a key, written to a temporary file first so readers never see half of it
+    def save(self, key, **arrays):
+        if not os.path.isdir(self.folder):
+            os.makedirs(self.folder)
+        handle, temporary = tempfile.mkstemp(suffix=".npz", dir=self.folder)
+        try:
+            with os.fdopen(handle, "wb") as stream:
+                np.savez(stream, **arrays)
+            if os.path.exists(self.path(key)):
+                os.remove(self.path(key))
+            os.rename(temporary, self.path(key))
+        finally:
+            if os.path.exists(temporary):
+                os.remove(temporary)
+        self.evict()
+
+    # files of the cache as (last use, size, path), oldest first
+    def entries(self):
+        if not os.path.isdir(self.folder):
+            return []
+        found = []
+        for name in os.listdir(self.folder):
+            path = os.path.join(self.folder, name)
+            if name.endswith(".npz") and os.path.isfile(path):
+                info = os.stat(path)
+                found.append((info.st_mtime, info.st_size, path))
+        return sorted(found)
+
+    def size(self):
+        return sum(entry[1] for entry in self.entries())
+
+    # drop the least recently used results until the cache fits its limit
+    def evict(self):
+        entries = self.entries()
+        total = sum(entry[1] for entry in entries)
+        for used, size, path in entries:
+            if total <= self.limit:
+                break
+            os.remove(path)
+            total -= size
+
+    def clear(self):
+        for used, size, path in self.entries():
+            os.remove(path)
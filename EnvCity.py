@@ -0,0 +1,316 @@
+'''
+Environment Generator Project
+City model: terrain, roads, placements, sun and weather computed as arrays, written out by a scene backend
+'''
+
+from __future__ import division
+from collections import OrderedDict
+import numpy as np
+import EnvBlocks
+import EnvHeightfield
+import EnvPlacement
+import EnvRandom
+import EnvRoadNetwork
+
+# sun rotation per hour of the day, by north direction: rotated axis and degrees
+SUN_STEPS = {1: ("rotateX", -15), 2: ("rotateX", 15), 3: ("rotateZ", -15), 4: ("rotateZ", 15)}
+# rotation of the sun before the hour of the day is added
+SUN_ROTATION = (90.0, 0.0, 0.0)
+# weather kinds by the weather radio button
+WEATHER_KINDS = {1: "sunny", 2: "cloudy", 3: "rainy", 4: "snowy"}
+# name of the effect every kind of weather makes
+WEATHER_NAMES = {"cloudy": "cloud", "rainy": "rain", "snowy": "snow"}
+
+
+class Mesh(object):
+    # vertex and face buffers, ready for one mesh create
+    # uvs: (u, v) rows with uvIds giving one per face corner, when the mesh has them
+    def __init__(self, points, faceCounts, faceConnects, uvs=None, uvIds=None):
+        self.points = np.asarray(points, dtype=np.float64)
+        self.faceCounts = np.asarray(faceCounts, dtype=np.int32)
+        self.faceConnects = np.asarray(faceConnects, dtype=np.int32)
+        self.uvs = uvs
+        self.uvIds = uvIds
+
+
+class Placements(object):
+    # copies of source meshes, one transform per copy
+    # kept: copies left after dropping overlaps, snapped: copies standing on the ground
+    def __init__(self, sources, sourceIndex, translates, rotates, scales, kept=None, snapped=None):
+        self.sources = list(sources)
+        self.sourceIndex = np.asarray(sourceIndex, dtype=np.int32)
+        self.translates = np.asarray(translates, dtype=np.float64)
+        self.rotates = np.asarray(rotates, dtype=np.float64)
+        self.scales = np.asarray(scales, dtype=np.float64)
+        self.kept = kept
+        self.snapped = snapped
+
+    def __len__(self):
+        return len(self.translates)
+
+
+class Sun(object):
+    # a directional light, with keys (frame, value) on one rotation axis when it moves through the day
+    def __init__(self, color, intensity, rotation=SUN_ROTATION, axis=None, keys=()):
+        self.color = tuple(color)
+        self.intensity = intensity
+        self.rotation = tuple(rotation)
+        self.axis = axis
+        self.keys = list(keys)
+
+
+class Weather(object):
+    # kind of weather, the terrain it happens over and the numbers of its effect
+    def __init__(self, kind, terrain, frameStart, frameEnd, settings):
+        self.kind = kind
+        self.terrain = terrain
+        self.frameStart = frameStart
+        self.frameEnd = frameEnd
+        self.settings = settings
+
+
+class CityModel(object):
+    # everything a city is made of, by the name it gets in the scene
+    def __init__(self):
+        self.meshes = OrderedDict()
+        self.placements = OrderedDict()
+        self.suns = OrderedDict()
+        self.weather = OrderedDict()
+
+
+class SceneBackend(object):
+    # writes a city model into a scene or any other sink, every write returns the name it was given
+    def writeMesh(self, name, mesh):
+        raise NotImplementedError
+
+    def writePlacements(self, name, placements):
+        raise NotImplementedError
+
+    def writeSun(self, name, sun):
+        raise NotImplementedError
+
+    # sinks without effects leave the weather out
+    def writeWeather(self, name, weather):
+        return None
+
+    def write(self, city):
+        return dict(meshes=[self.writeMesh(name, mesh) for name, mesh in city.meshes.items()],
+                    placements=[self.writePlacements(name, placements) for name, placements in city.placements.items()],
+                    suns=[self.writeSun(name, sun) for name, sun in city.suns.items()],
+                    weather=[self.writeWeather(name, weather) for name, weather in city.weather.items()])
+
+
+class MemoryBackend(SceneBackend):
+    # keeps what is written, e.g. to look at a city without a scene
+    def __init__(self):
+        self.city = CityModel()
+
+    def writeMesh(self, name, mesh):
+        self.city.meshes[name] = mesh
+        return name
+
+    def writePlacements(self, name, placements):
+        self.city.placements[name] = placements
+        return name
+
+    def writeSun(self, name, sun):
+        self.city.suns[name] = sun
+        return name
+
+    def writeWeather(self, name, weather):
+        self.city.weather[name] = weather
+        return name
+
+
+######### terrain ###########
+# vertices of a plane like maya's polyPlane: rows from +z to -z, x growing along a row
+def planeGrid(dimension, divisions):
+    x, z = np.meshgrid(np.linspace(-0.5, 0.5, divisions + 1) * dimension,
+                       np.linspace(0.5, -0.5, divisions + 1) * dimension)
+    return np.column_stack([x.ravel(), np.zeros(x.size), z.ravel()])
+
+
+# the terrain's vertices: soft select moves of every 5th vertex added to the plane
+# base: the plane's own vertices when there is one already
+def terrainPoints(dimension, divisions, height, depth, seed=1, base=None):
+    offsets = EnvHeightfield.morphGrid(divisions, dimension, height, depth, step=5, radius=5.0,
+                                       rng=EnvRandom.stream(seed, "terrain"))
+    return (planeGrid(dimension, divisions) if base is None else base) + offsets
+
+
+# mesh of plane vertices laid out like planeGrid, keeping every stride-th row and column
+def planeMesh(points, divisions, stride=1):
+    side = divisions + 1
+    # turned round so the rows run along +z and the faces point up
+    points = np.asarray(points, dtype=np.float64).reshape(side, side, 3)[::-1]
+    keep = np.union1d(np.arange(0, side, stride), [side - 1])
+    quads = EnvHeightfield.gridQuads(len(keep), len(keep))
+    return Mesh(points[keep][:, keep].reshape(-1, 3), np.full(len(quads), 4), quads.ravel())
+
+
+# the terrain as a mesh, keeping every stride-th row and column
+def terrainMesh(dimension, divisions, height, depth, seed=1, stride=1):
+    return planeMesh(terrainPoints(dimension, divisions, height, depth, seed), divisions, stride)
+
+
+######### roads ###########
+# centre line of a road: evenly spaced divisions, or samples placed by curvature for tessellation 2
+def roadLine(sampler, width, divisions, tessellation=1, tolerance=0.05, maxLength=None):
+    if tessellation == 2:
+        return sampler.adaptivePolyline(tolerance, width * 0.5, maxLength)
+    return sampler.sampleFractions(np.linspace(0.0, 1.0, max(divisions, 1) + 1))[0]
+
+
+# a road strip along a line, one quad per piece of the line
+def stripMesh(line, width):
+    points, quads = EnvRoadNetwork.stripMesh(line, width * 0.5)
+    points, faceCounts, faceConnects = EnvRoadNetwork.weldVertices(points, np.full(len(quads), 4), quads.ravel())
+    return Mesh(points, faceCounts, faceConnects)
+
+
+# centre line about a terrain cell apart, on the ground where there is ground under it
+def groundLine(sampler, ground):
+    line = sampler.polyline(ground.spacing)
+    heights = ground.heights(line[:, [0, 2]])
+    line[:, 1] = np.where(np.isnan(heights), line[:, 1], heights)
+    return line
+
+
+# every road vertex takes the centre line height beside it, so the road stays level across
+def levelRoad(points, line, lift):
+    distance, segment, along = EnvHeightfield.polylineDistance(points, line)
+    points = points.copy()
+    points[:, 1] = EnvHeightfield.heightAlong(line, segment, along) + lift
+    return points
+
+
+# a road or river along a curve, and the new terrain heights when it changes the ground
+# ground: height index of the terrain, or None for a road on its own
+def roadModel(sampler, width, divisions, height=0.0, tessellation=1, tolerance=0.05, ground=None, river=False,
+              clearance=0.05, flatten=True, shoulder=1.0, riverDepth=1.0, riverBank=2.0):
+    # on a terrain no piece may be longer than a terrain cell, or it would cut through bumps
+    maxLength = ground.spacing if ground is not None else None
+    road = stripMesh(roadLine(sampler, width, divisions, tessellation, tolerance, maxLength), width)
+    road.points[:, 1] += height
+    if ground is None:
+        if river:
+            # the water surface is flat
+            road.points[:, 1] = road.points[:, 1].min()
+        return road, None
+    terrain = ground.points.reshape(-1, 3)
+    if river:
+        # the water runs downhill along the curve, channel and banks carved from the distance to it
+        line = EnvHeightfield.waterLevel(groundLine(sampler, ground))
+        road.points = levelRoad(road.points, line, 0.0)
+        return road, EnvHeightfield.carveChannel(terrain, line, width * 0.5, riverDepth, riverBank)
+    line = groundLine(sampler, ground)
+    road.points = levelRoad(road.points, line, clearance)
+    if not flatten:
+        return road, None
+    # level the ground under the road and blend back across the shoulders
+    return road, EnvHeightfield.flattenUnder(terrain, line, width * 0.5, shoulder)
+
+
+######### placements ###########
+# copies of the sources evenly spaced along a curve, with their random choices from the curve's own stream
+# srcRotates, srcScales, bounds: rotation, scale and object space bounding box of every source
+# stride keeps every stride-th copy for a preview, with the same draws the full result gets
+def curvePlacements(sampler, curve, sources, srcRotates, srcScales, bounds, copies, offset=0, randRotate=0,
+                    curveRotate=False, randScale=0.0, overlap=EnvPlacement.OVERLAP_ALLOW, spacing=0.0, seed=1,
+                    ground=None, stride=1):
+    positions, headings = sampler.sample(copies)
+    rng = EnvRandom.stream(seed, "building", curve)
+    sourceIndex = rng.randint(0, len(sources), copies)
+    newRotation = rng.uniform(-randRotate, randRotate, copies)
+    newOffsetX = rng.uniform(0, offset, copies)
+    newScale = rng.uniform(1, randScale, copies)
+    if stride > 1:
+        positions, headings, sourceIndex = positions[::stride], headings[::stride], sourceIndex[::stride]
+        newRotation, newOffsetX, newScale = newRotation[::stride], newOffsetX[::stride], newScale[::stride]
+    # the modifications go on top of the source transform
+    rotates = srcRotates[sourceIndex]
+    if curveRotate:
+        rotates[:, 1] = headings
+    else:
+        rotates[:, 1] += newRotation
+    translates = np.array(positions)
+    translates[:, 0] += newOffsetX
+    scales = srcScales[sourceIndex]
+    if randScale > 0:
+        scales *= newScale[:, None]
+    kept = None
+    if overlap != EnvPlacement.OVERLAP_ALLOW:
+        # drop or push aside copies whose footprints overlap, footprints from the source bounding boxes
+        box = bounds[sourceIndex]
+        offsets = (box[:, [0, 2]] + box[:, [3, 5]]) * 0.5 * scales[:, [0, 2]]
+        halfSizes = (box[:, [3, 5]] - box[:, [0, 2]]) * 0.5 * abs(scales[:, [0, 2]])
+        keep, pivots = EnvPlacement.placeWithoutOverlap(translates[:, [0, 2]], offsets, halfSizes, rotates[:, 1],
+                                                        mode=overlap, spacing=spacing)
+        translates[:, [0, 2]] = pivots
+        sourceIndex, translates, rotates, scales = sourceIndex[keep], translates[keep], rotates[keep], scales[keep]
+        kept = int(keep.sum())
+    snapped = None
+    if ground is not None:
+        heights = ground.heights(translates[:, [0, 2]])
+        onGround = ~np.isnan(heights)
+        translates[onGround, 1] = heights[onGround]
+        snapped = int(onGround.sum())
+    return Placements(sources, sourceIndex, translates, rotates, scales, kept, snapped)
+
+
+# one random source per lot of the blocks between road polylines, stretched to fill the lot
+def blockPlacements(polylines, sources, srcRotates, srcScales, bounds, roadWidth=1.0, lotArea=50.0, lotWidth=3.0,
+                    fill=0.8, seed=1):
+    centres, yaw, halfSizes, lots = EnvBlocks.cityLots(polylines, roadWidth=roadWidth, lotArea=lotArea,
+                                                       lotWidth=lotWidth, seed=seed)
+    count = len(centres)
+    sourceIndex = EnvRandom.stream(seed, "blocks", "building").randint(0, len(sources), count)
+    box = bounds[sourceIndex]
+    srcHalf = np.maximum((box[:, [3, 5]] - box[:, [0, 2]]) * 0.5, 1e-6)
+    scales = np.ones((count, 3))
+    scales[:, [0, 2]] = halfSizes * fill / srcHalf
+    scales[:, 1] = scales[:, [0, 2]].mean(axis=1)
+    rotates = srcRotates[sourceIndex]
+    rotates[:, 1] = yaw
+    # move the pivot so the footprint sits in the middle of the lot
+    angle = np.radians(yaw)
+    offsets = (box[:, [0, 2]] + box[:, [3, 5]]) * 0.5 * scales[:, [0, 2]]
+    translates = centres.copy()
+    translates[:, 0] -= offsets[:, 0] * np.cos(angle) + offsets[:, 1] * np.sin(angle)
+    translates[:, 2] -= -offsets[:, 0] * np.sin(angle) + offsets[:, 1] * np.cos(angle)
+    return Placements(sources, sourceIndex, translates, rotates, scales)
+
+
+######### sun and weather ###########
+# the sun at an hour of the day, or keyed from the start to the end of the day when the scene is dynamic
+def sunModel(north, time, color, intensity, dynamic=False, frameStart=0, frameEnd=200, timeStart=6, timeEnd=18):
+    axis, step = SUN_STEPS[north]
+    angle = 0 if axis == "rotateX" else 2
+    if not dynamic:
+        rotation = list(SUN_ROTATION)
+        rotation[angle] += time * step
+        return Sun(color, intensity, rotation)
+    if frameEnd <= frameStart:
+        raise ValueError("Start frame is greater than end frame!")
+    if timeEnd <= timeStart:
+        raise ValueError("Start time is greater than end time!")
+    startRotation = SUN_ROTATION[angle] + timeStart * step
+    endRotation = startRotation + timeEnd * step
+    return Sun(color, intensity, axis=axis, keys=[(frameStart, startRotation), (frameEnd, endRotation)])
+
+
+# numbers of the weather effect over a terrain with bounding box (min xyz, max xyz)
+def weatherModel(weather, terrain, bounds, frameStart=0, frameEnd=200):
+    kind = WEATHER_KINDS[weather]
+    settings = {}
+    if kind != "sunny":
+        # the effect floats twice the terrain's reach above it
+        size = abs(bounds[0])
+    if kind == "cloudy":
+        settings = dict(lift=size * 2, dimensions=(size * 2, size * 0.1, size * 2),
+                        resolution=(size * 5, size, size * 5), textureKeys=[(frameStart, 1), (frameEnd, 4)])
+    if kind == "rainy":
+        settings = dict(lift=size * 2, rate=1000, speed=1, renderType=6, lifespan=size * 0.5)
+    if kind == "snowy":
+        settings = dict(lift=size * 2, rate=150, speed=0.25, renderType=8, lifespan=size * 0.25, opacity=0.3)
+    return Weather(kind, terrain, frameStart, frameEnd, settings)
@@ -0,0 +1,180 @@
+'''
+Environment Generator Project
+Curve sampler: NURBS evaluation and arc-length lookup tables
+'''
+
+from __future__ import division
+import hashlib
+from collections import OrderedDict
+import numpy as np
+
+# number of arc-length table entries per curve span
+LUT_PER_SPAN = 32
+# number of curve samplers kept around
+CACHE_SIZE = 256
+
+
+# evaluate a b-spline at many parameters at once (vectorized de Boor)
+# knots is the full knot vector: maya's knot list plus one extra knot at each end
+def evalBSpline(cvs, knots, degree, params):
+    params = np.asarray(params, dtype=np.float64)
+    count = len(cvs)
+    # span of every parameter, clamped to the valid domain
+    span = np.searchsorted(knots, params, side="right") - 1
+    span = np.clip(span, degree, count - 1)
+    # the degree + 1 control points that affect each parameter
+    points = cvs[span[:, None] - degree + np.arange(degree + 1)[None, :]]
+    for r in range(1, degree + 1):
+        for j in range(degree, r - 1, -1):
+            i = span - degree + j
+            left = knots[i]
+            width = knots[i + degree + 1 - r] - left
+            alpha = np.where(width > 0, (params - left) / np.where(width > 0, width, 1.0), 0.0)
+            points[:, j] = (1.0 - alpha)[:, None] * points[:, j - 1] + alpha[:, None] * points[:, j]
+    return points[:, degree]
+
+
+# control points and knots of the first derivative of a b-spline
+def derivBSpline(cvs, knots, degree):
+    width = knots[degree + 1:degree + len(cvs)] - knots[1:len(cvs)]
+    safe = np.where(width > 0, width, 1.0)
+    deriv = degree * (cvs[1:] - cvs[:-1]) / safe[:, None]
+    deriv[width <= 0] = 0.0
+    return deriv, knots[1:-1], degree - 1
+
+
+# hash of everything that defines the shape of a curve
+def curveHash(cvs, knots, degree, periodic=False):
+    digest = hashlib.sha1()
+    digest.update(np.ascontiguousarray(cvs, dtype=np.float64).tobytes())
+    digest.update(np.ascontiguousarray(knots, dtype=np.float64).tobytes())
+    digest.update(("%d %d" % (degree, bool(periodic))).encode("ascii"))
+    return digest.hexdigest()
+
+
+class CurveSampler(object):
+    def __init__(self, cvs, knots, degree, periodic=False):
+        # maya curves are non-rational, so only the xyz of the cvs matter
+        self.cvs = np.asarray(cvs, dtype=np.float64)[:, :3].copy()
+        self.degree = int(degree)
+        self.periodic = periodic
+        # identifies the shape of the curve, e.g. in cache keys
+        self.key = curveHash(cvs, knots, degree, periodic)
+        # maya leaves out the first and last knot of the full knot vector
+        mayaKnots = np.asarray(knots, dtype=np.float64)
+        self.knots = np.concatenate([mayaKnots[:1], mayaKnots, mayaKnots[-1:]])
+        self.domain = (self.knots[self.degree], self.knots[len(self.cvs)])
+        self.deriv = derivBSpline(self.cvs, self.knots, self.degree)
+        self.buildTable()
+
+    # build the parameter -> arc length lookup table
+    def buildTable(self):
+        spans = len(self.cvs) - self.degree
+        self.tableParams = np.linspace(self.domain[0], self.domain[1], max(spans, 1) * LUT_PER_SPAN + 1)
+        points = self.position(self.tableParams)
+        self.tablePoints = points
+        chords = np.sqrt(((points[1:] - points[:-1]) ** 2).sum(axis=1))
+        self.tableLengths = np.concatenate([[0.0], np.cumsum(chords)])
+        self.length = self.tableLengths[-1]
+
+    def position(self, params):
+        return evalBSpline(self.cvs, self.knots, self.degree, params)
+
+    def tangent(self, params):
+        cvs, knots, degree = self.deriv
+        if len(cvs) == 0:
+            return np.zeros((len(params), 3))
+        return evalBSpline(cvs, knots, degree, params)
+
+    # curve parameters at fractions of the total arc length
+    def paramsAtFractions(self, fractions):
+        lengths = np.clip(np.asarray(fractions, dtype=np.float64), 0.0, 1.0) * self.length
+        return np.interp(lengths, self.tableLengths, self.tableParams)
+
+    # positions and yaw (degrees, x axis following the curve) at fractions of the arc length
+    def sampleFractions(self, fractions):
+        params = self.paramsAtFractions(fractions)
+        tangents = self.tangent(params)
+        yaw = np.degrees(np.arctan2(-tangents[:, 2], tangents[:, 0]))
+        return self.position(params), yaw
+
+    # points along the curve no further apart than spacing, keeping the corners of linear curves
+    def polyline(self, spacing):
+        if self.degree == 1:
+            points = self.cvs
+            if self.periodic and not np.allclose(points[0], points[-1]):
+                points = np.vstack([points, points[:1]])
+            # every straight piece cut evenly into as few steps as keep to the spacing
+            steps = points[1:] - points[:-1]
+            pieces = np.maximum(np.ceil(np.sqrt((steps ** 2).sum(axis=1)) / spacing), 1).astype(int)
+            step = np.repeat(np.arange(len(steps)), pieces)
+            along = (np.arange(len(step)) - np.repeat(np.cumsum(pieces) - pieces, pieces)) / pieces[step]
+            return np.vstack([points[step] + steps[step] * along[:, None], points[-1:]])
+        count = max(int(np.ceil(self.length / spacing)), 8) + 1
+        return self.sampleFractions(np.linspace(0.0, 1.0, count))[0]
+
+    # points placed by curvature: douglas-peucker on the lookup table, one level of splits at a time
+    # a piece is split while the curve strays from its chord by more than tolerance,
+    # counting the extra sag of the road edges halfWidth out on the outside of the bend
+    # pieces longer than maxLength are halved as well, for roads that have to follow the ground
+    def adaptivePolyline(self, tolerance, halfWidth=0.0, maxLength=None):
+        if self.degree == 1:
+            return self.polyline(np.inf)
+        points = self.tablePoints
+        tangents = self.tangent(self.tableParams)
+        tangents /= np.maximum(np.sqrt((tangents ** 2).sum(axis=1)), 1e-12)[:, None]
+        count = len(points)
+        keep = np.zeros(count, dtype=bool)
+        keep[[0, -1]] = True
+        while True:
+            ends = np.flatnonzero(keep)
+            piece = np.minimum(np.searchsorted(ends, np.arange(count), side="right") - 1, len(ends) - 2)
+            start = points[ends[piece]]
+            chord = points[ends[piece + 1]] - start
+            along = np.clip((((points - start) * chord).sum(axis=1) / 
+                             np.maximum((chord ** 2).sum(axis=1), 1e-12)), 0.0, 1.0)
+            stray = np.sqrt(((points - start - chord * along[:, None]) ** 2).sum(axis=1))
+            # sagitta of an edge offset from an arc turning by the angle between the end tangents
+            turn = np.clip((tangents[ends[:-1]] * tangents[ends[1:]]).sum(axis=1), -1.0, 1.0)
+            sag = halfWidth * (1.0 - np.sqrt((1.0 + turn) * 0.5))
+            error = stray + sag[piece]
+            error[keep] = 0.0
+            # worst table point of every piece, split there if it is bad enough
+            order = np.lexsort((-error, piece))
+            worst = order[np.searchsorted(piece[order], np.arange(len(ends) - 1))]
+            split = worst[error[worst] > tolerance]
+            if maxLength:
+                long = np.sqrt(((points[ends[1:]] - points[ends[:-1]]) ** 2).sum(axis=1)) > maxLength
+                middle = (ends[:-1] + ends[1:]) // 2
+                split = np.union1d(split, middle[long & (ends[1:] - ends[:-1] > 1)])
+            if len(split) == 0:
+                return points[keep]
+            keep[split] = True
+
+    # count evenly spaced samples along the whole curve
+    def sample(self, count):
+        if self.periodic:
+            # first and last point of a closed curve are the same place
+            fractions = np.arange(count) / count
+        else:
+            fractions = np.linspace(0.0, 1.0, count)
+        return self.sampleFractions(fractions)
+
+
+# curve samplers keyed by curve hash, least recently used dropped first
+_samplers = OrderedDict()
+
+
+def getSampler(cvs, knots, degree, periodic=False):
+    key = curveHash(cvs, knots, degree, periodic)
+    sampler = _samplers.pop(key, None)
+    if sampler is None:
+        sampler = CurveSampler(cvs, knots, degree, periodic)
+    _samplers[key] = sampler
+    while len(_samplers) > CACHE_SIZE:
+        _samplers.popitem(last=False)
+    return sampler
+
+
+def clearSamplers():
+    _samplers.clear()
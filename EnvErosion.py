@@ -0,0 +1,131 @@
+'''
+Environment Generator Project
+Erosion: thermal and hydraulic erosion of a heightfield as whole grid array steps
+'''
+
+from __future__ import division
+import time
+import numpy as np
+import EnvParallel
+
+# the four neighbours of a cell as (row, column) steps
+NEIGHBOURS = ((-1, 0), (1, 0), (0, -1), (0, 1))
+
+
+# a grid moved one step, the cells coming in from outside the grid filled with fill
+def shifted(grid, step, fill):
+    dr, dc = step
+    rows, cols = grid.shape
+    result = np.full(grid.shape, fill, dtype=grid.dtype)
+    result[max(dr, 0):rows + min(dr, 0), max(dc, 0):cols + min(dc, 0)] = \
+        grid[max(-dr, 0):rows + min(-dr, 0), max(-dc, 0):cols + min(-dc, 0)]
+    return result
+
+
+# hand out amounts leaving every cell to its neighbours, shares: one (rows, cols) grid per neighbour
+def spread(amounts, shares):
+    arrived = np.zeros(amounts.shape)
+    for step, share in zip(NEIGHBOURS, shares):
+        # what a cell sends towards step lands in the cell at that step
+        arrived += shifted(amounts * share, step, 0.0)
+    return arrived
+
+
+# slope relaxation: ground steeper than the talus slope slides to the lower neighbours
+def thermalStep(heights, spacing, talus=1.0, rate=0.5):
+    limit = talus * spacing
+    # how far above each neighbour a cell is, beyond what the talus slope allows
+    excess = [np.maximum(heights - shifted(heights, (-dr, -dc), np.inf) - limit, 0.0) for dr, dc in NEIGHBOURS]
+    total = sum(excess)
+    steepest = np.maximum.reduce(excess)
+    # move half the steepest drop so a cell never ends up below the neighbour it feeds
+    moved = rate * 0.5 * steepest
+    shares = [np.where(total > 0, drop / np.where(total > 0, total, 1.0), 0.0) for drop in excess]
+    return heights - moved + spread(moved, shares)
+
+
+# one step of grid hydraulic erosion: rain, water running downhill carrying sediment, evaporation
+# state is (3, rows, cols): ground, water and sediment
+def hydraulicStep(state, rain=0.01, capacity=1.0, erosion=0.3, deposition=0.3, evaporation=0.05):
+    ground, water, sediment = state
+    water = water + rain
+    surface = ground + water
+    drops = [np.maximum(surface - shifted(surface, (-dr, -dc), np.inf), 0.0) for dr, dc in NEIGHBOURS]
+    total = sum(drops)
+    # water leaving a cell: at most all of it, at most enough to level it with its neighbours
+    outflow = np.minimum(water, 0.5 * np.maximum.reduce(drops))
+    shares = [np.where(total > 0, drop / np.where(total > 0, total, 1.0), 0.0) for drop in drops]
+    # sediment goes along in proportion
+    carried = np.where(water > 0, sediment * outflow / np.where(water > 0, water, 1.0), 0.0)
+    water = water - outflow + spread(outflow, shares)
+    sediment = sediment - carried + spread(carried, shares)
+    # fast water can hold more: dig up ground below capacity, never deeper than the way down,
+    # and drop sediment above it
+    hold = capacity * outflow
+    downhill = 0.5 * np.maximum.reduce([np.maximum(ground - shifted(ground, (-dr, -dc), np.inf), 0.0) 
+                                        for dr, dc in NEIGHBOURS])
+    dig = np.minimum(erosion * np.maximum(hold - sediment, 0.0), downhill)
+    drop = deposition * np.maximum(sediment - hold, 0.0)
+    ground = ground - dig + drop
+    sediment = sediment + dig - drop
+    water = water * (1.0 - evaporation)
+    return np.array([ground, water, sediment])
+
+
+# erosion settings in the order the steps take them
+def erosionSettings(talus=1.0, thermalRate=0.5, rain=0.01, capacity=1.0, erosion=0.3, deposition=0.3, 
+                    evaporation=0.05):
+    return (talus, thermalRate, rain, capacity, erosion, deposition, evaporation)
+
+
+# iterations of thermal then hydraulic erosion on a state, stopping early once past the deadline
+# returns the state and the number of iterations done
+def erodeState(state, spacing, iterations, settings, deadline=None):
+    talus, thermalRate = settings[:2]
+    for done in range(iterations):
+        if deadline is not None and time.time() > deadline:
+            return state, done
+        state[0] = thermalStep(state[0], spacing, talus, thermalRate)
+        state = hydraulicStep(state, *settings[2:])
+    return state, iterations
+
+
+# a tile with its halo in a worker process
+def _tileJob(job):
+    state, spacing, iterations, settings = job
+    return erodeState(state, spacing, iterations, settings)[0]
+
+
+# erode a heightfield for a number of iterations or until the time budget (seconds) runs out
+# big grids go in rounds of tiles over the worker processes; each tile brings a halo of cells around it
+# as wide as the cells a round can reach, so its inside comes out exactly as on the whole grid
+# returns the new heights and the number of iterations done
+def erode(heights, spacing=1.0, iterations=50, timeBudget=None, settings=None, tileSize=256, workers=None):
+    settings = settings or erosionSettings()
+    heights = np.asarray(heights, dtype=np.float64)
+    state = np.array([heights, np.zeros(heights.shape), np.zeros(heights.shape)])
+    deadline = time.time() + timeBudget if timeBudget else None
+    rows, cols = heights.shape
+    workers = EnvParallel.defaultWorkers() if workers is None else workers
+    if workers <= 1 or (rows <= tileSize and cols <= tileSize):
+        state, done = erodeState(state, spacing, iterations, settings, deadline)
+        return state[0] + state[2], done
+    done = 0
+    # every iteration reaches four cells: two each for the thermal and the hydraulic step
+    chunk = max(tileSize // 32, 1)
+    halo = 4 * chunk
+    starts = [(r, c) for r in range(0, rows, tileSize) for c in range(0, cols, tileSize)]
+    while done < iterations and (deadline is None or time.time() < deadline):
+        steps = min(chunk, iterations - done)
+        jobs = []
+        for r, c in starts:
+            r0, c0 = max(r - halo, 0), max(c - halo, 0)
+            jobs.append((state[:, r0:r + tileSize + halo, c0:c + tileSize + halo].copy(), spacing, steps, settings))
+        result = np.empty_like(state)
+        for (r, c), tile in zip(starts, EnvParallel.mapJobs(_tileJob, jobs, workers)):
+            r0, c0 = r - max(r - halo, 0), c - max(c - halo, 0)
+            result[:, r:r + tileSize, c:c + tileSize] = tile[:, r0:r0 + tileSize, c0:c0 + tileSize]
+        state = result
+        done += steps
+    # sediment still carried settles where it is
+    return state[0] + state[2], done
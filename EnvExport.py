@@ -0,0 +1,259 @@
+'''
+Environment Generator Project
+Export: OBJ and glTF written straight from the city model arrays, a chunk at a time
+'''
+
+from __future__ import division
+import json
+import os
+import numpy as np
+import EnvCity
+import EnvPreview
+
+# vertices, faces or copies handled per chunk, which bounds the memory an export needs
+CHUNK_SIZE = 65536
+# glTF component types and buffer view targets
+FLOAT = 5126
+UNSIGNED_INT = 5125
+ARRAY_BUFFER = 34962
+ELEMENT_ARRAY_BUFFER = 34963
+# object space bounds of the box written for a source without a mesh
+SOURCE_BOUNDS = (-0.5, 0.0, -0.5, 0.5, 1.0, 0.5)
+
+
+# a box mesh filling object space bounds (xmin, ymin, zmin, xmax, ymax, zmax)
+def boxMesh(bounds=SOURCE_BOUNDS):
+    points, faceCounts, faceConnects = EnvPreview.boxMesh([bounds], np.zeros((1, 3)), np.zeros((1, 3)),
+                                                          np.ones((1, 3)))
+    return EnvCity.Mesh(points, faceCounts, faceConnects)
+
+
+# face ranges of at most size face corners, the last face of a range is never cut
+def faceChunks(faceCounts, size=CHUNK_SIZE):
+    ends = np.cumsum(faceCounts)
+    face = 0
+    while face < len(faceCounts):
+        start = ends[face - 1] if face else 0
+        last = max(np.searchsorted(ends, start + size, side="right"), face + 1)
+        yield face, last, start, ends[last - 1]
+        face = last
+
+
+# fan triangles of polygons, as vertex ids (t, 3)
+def triangulate(faceCounts, faceConnects):
+    faceCounts = np.asarray(faceCounts)
+    faceStart = np.concatenate([[0], np.cumsum(faceCounts)[:-1]])
+    # triangle i of a face is its first corner and corners i + 1 and i + 2
+    triangles = np.maximum(faceCounts - 2, 0)
+    face = np.repeat(np.arange(len(faceCounts)), triangles)
+    fan = np.arange(len(face)) - np.repeat(np.cumsum(triangles) - triangles, triangles)
+    first = faceStart[face]
+    return np.column_stack([faceConnects[first], faceConnects[first + fan + 1], faceConnects[first + fan + 2]])
+
+
+# maya's xyz euler rotations in degrees as (x, y, z, w) quaternions
+def eulerQuaternions(rotates):
+    halves = np.radians(np.asarray(rotates, dtype=np.float64)) * 0.5
+    cos, sin = np.cos(halves), np.sin(halves)
+    cx, cy, cz = cos.T
+    sx, sy, sz = sin.T
+    # x turns first, then y, then z
+    return np.column_stack([sx * cy * cz - cx * sy * sz,
+                            cx * sy * cz + sx * cy * sz,
+                            cx * cy * sz - sx * sy * cz,
+                            cx * cy * cz + sx * sy * sz])
+
+
+class ObjBackend(EnvCity.SceneBackend):
+    # one OBJ file, every mesh and every group of copies an object of its own
+    # copies are written out in full, OBJ has no instancing; lights and weather are left out
+    # sourceMeshes: mesh of every copied source by name, a box for the ones missing
+    def __init__(self, path, sourceMeshes=None, chunkSize=CHUNK_SIZE):
+        self.handle = open(path, "w")
+        self.sourceMeshes = sourceMeshes or {}
+        self.chunkSize = chunkSize
+        self.vertexCount = 0
+        self.handle.write("# Environment Generator city\n")
+
+    def writePoints(self, points):
+        for start in range(0, len(points), self.chunkSize):
+            chunk = points[start:start + self.chunkSize]
+            self.handle.write(("v %.6f %.6f %.6f\n" * len(chunk)) % tuple(chunk.ravel()))
+
+    # faces with vertex ids counted from first, a face per line
+    def writeFaces(self, faceCounts, faceConnects, first):
+        for face, last, start, end in faceChunks(faceCounts, self.chunkSize):
+            ids = (faceConnects[start:end] + first).astype(str)
+            # every face starts on a new line
+            faceStart = np.zeros(len(ids), dtype=bool)
+            faceStart[np.cumsum(faceCounts[face:last]) - faceCounts[face:last]] = True
+            lead = np.where(faceStart, "\nf ", " ")
+            self.handle.write("".join(np.char.add(lead, ids).tolist())[1:] + "\n")
+
+    def writeMesh(self, name, mesh):
+        self.handle.write("o %s\n" % name)
+        self.writePoints(mesh.points)
+        self.writeFaces(mesh.faceCounts, mesh.faceConnects, self.vertexCount + 1)
+        self.vertexCount += len(mesh.points)
+        return name
+
+    def writePlacements(self, name, placements):
+        self.handle.write("o %s\n" % name)
+        for source in np.unique(placements.sourceIndex):
+            mesh = self.sourceMeshes.get(placements.sources[source]) or boxMesh()
+            copies = np.flatnonzero(placements.sourceIndex == source)
+            size = len(mesh.points)
+            # as many copies per chunk as fit in the chunk size
+            step = max(self.chunkSize // max(size, 1), 1)
+            for start in range(0, len(copies), step):
+                chunk = copies[start:start + step]
+                points = mesh.points[None] * placements.scales[chunk][:, None]
+                points = np.einsum("nci,nij->ncj", points, EnvPreview.eulerMatrices(placements.rotates[chunk]))
+                points += placements.translates[chunk][:, None]
+                self.writePoints(points.reshape(-1, 3))
+                # the source's faces once per copy, each copy's vertices after the one before
+                count = len(chunk)
+                faceConnects = (mesh.faceConnects[None] + size * np.arange(count)[:, None]).ravel()
+                self.writeFaces(np.tile(mesh.faceCounts, count), faceConnects, self.vertexCount + 1)
+                self.vertexCount += size * count
+        return name
+
+    def writeSun(self, name, sun):
+        return None
+
+    def close(self):
+        self.handle.close()
+
+
+class GltfBackend(EnvCity.SceneBackend):
+    # a .gltf with its arrays streamed into a .bin next to it
+    # copies of a source share its mesh through EXT_mesh_gpu_instancing, the sun is a KHR_lights_punctual light
+    def __init__(self, path, sourceMeshes=None, chunkSize=CHUNK_SIZE):
+        self.path = path
+        self.binPath = os.path.splitext(path)[0] + ".bin"
+        self.buffer = open(self.binPath, "wb")
+        self.offset = 0
+        self.sourceMeshes = sourceMeshes or {}
+        self.chunkSize = chunkSize
+        self.sourceIndex = {}
+        self.gltf = dict(asset=dict(version="2.0", generator="Environment Generator"), scene=0, nodes=[],
+                         meshes=[], accessors=[], bufferViews=[], extensionsUsed=[])
+
+    def use(self, extension):
+        if extension not in self.gltf["extensionsUsed"]:
+            self.gltf["extensionsUsed"].append(extension)
+
+    # write chunks of a (n, width) array into one buffer view and make an accessor for it
+    def accessor(self, chunks, count, kind, componentType=FLOAT, target=None, bounds=False):
+        start = self.offset
+        low = high = None
+        for chunk in chunks:
+            chunk = np.ascontiguousarray(chunk, dtype="<f4" if componentType == FLOAT else "<u4")
+            # bounds of the values as stored
+            if bounds and len(chunk):
+                low = chunk.min(axis=0) if low is None else np.minimum(low, chunk.min(axis=0))
+                high = chunk.max(axis=0) if high is None else np.maximum(high, chunk.max(axis=0))
+            data = chunk.tobytes()
+            self.buffer.write(data)
+            self.offset += len(data)
+        view = dict(buffer=0, byteOffset=start, byteLength=self.offset - start)
+        if target:
+            view["target"] = target
+        # every view starts on a 4 byte boundary
+        pad = -self.offset % 4
+        self.buffer.write(b"\0" * pad)
+        self.offset += pad
+        self.gltf["bufferViews"].append(view)
+        accessor = dict(bufferView=len(self.gltf["bufferViews"]) - 1, componentType=componentType, count=int(count),
+                        type=kind)
+        if bounds and low is not None:
+            accessor.update(min=low.tolist(), max=high.tolist())
+        self.gltf["accessors"].append(accessor)
+        return len(self.gltf["accessors"]) - 1
+
+    def chunks(self, array):
+        for start in range(0, len(array), self.chunkSize):
+            yield array[start:start + self.chunkSize]
+
+    def triangleChunks(self, mesh):
+        for face, last, start, end in faceChunks(mesh.faceCounts, self.chunkSize):
+            yield triangulate(mesh.faceCounts[face:last], mesh.faceConnects[start:end]).ravel()
+
+    # the mesh as triangles, returns its index in the meshes
+    def addMesh(self, name, mesh):
+        position = self.accessor(self.chunks(mesh.points), len(mesh.points), "VEC3", target=ARRAY_BUFFER,
+                                 bounds=True)
+        triangleCount = int(np.maximum(mesh.faceCounts - 2, 0).sum())
+        indices = self.accessor(self.triangleChunks(mesh), triangleCount * 3, "SCALAR", UNSIGNED_INT,
+                                ELEMENT_ARRAY_BUFFER)
+        self.gltf["meshes"].append(dict(name=name, primitives=[dict(attributes=dict(POSITION=position),
+                                                                    indices=indices)]))
+        return len(self.gltf["meshes"]) - 1
+
+    def addNode(self, node):
+        self.gltf["nodes"].append(node)
+        return len(self.gltf["nodes"]) - 1
+
+    def writeMesh(self, name, mesh):
+        self.addNode(dict(name=name, mesh=self.addMesh(name, mesh)))
+        return name
+
+    # a node per source, its copies as instance transforms; no copies, no node
+    def writePlacements(self, name, placements):
+        if not len(placements):
+            return None
+        self.use("EXT_mesh_gpu_instancing")
+        children = []
+        for source in np.unique(placements.sourceIndex):
+            sourceName = placements.sources[source]
+            if sourceName not in self.sourceIndex:
+                mesh = self.sourceMeshes.get(sourceName) or boxMesh()
+                self.sourceIndex[sourceName] = self.addMesh(sourceName, mesh)
+            copies = np.flatnonzero(placements.sourceIndex == source)
+            attributes = dict(
+                TRANSLATION=self.accessor((placements.translates[chunk] for chunk in self.chunks(copies)),
+                                          len(copies), "VEC3"),
+                ROTATION=self.accessor((eulerQuaternions(placements.rotates[chunk]) for chunk in self.chunks(copies)),
+                                       len(copies), "VEC4"),
+                SCALE=self.accessor((placements.scales[chunk] for chunk in self.chunks(copies)), len(copies), "VEC3"))
+            children.append(self.addNode(dict(name="%s_%s" % (name, sourceName), mesh=self.sourceIndex[sourceName],
+                                              extensions=dict(EXT_mesh_gpu_instancing=dict(attributes=attributes)))))
+        self.addNode(dict(name=name, children=children))
+        return name
+
+    # lights shine down their -z like maya's, a moving sun is written where it starts the day
+    def writeSun(self, name, sun):
+        self.use("KHR_lights_punctual")
+        rotation = list(sun.rotation)
+        if sun.keys:
+            rotation[{"rotateX": 0, "rotateY": 1, "rotateZ": 2}[sun.axis]] = sun.keys[0][1]
+        lights = self.gltf.setdefault("extensions", {}).setdefault("KHR_lights_punctual", dict(lights=[]))["lights"]
+        lights.append(dict(name=name, type="directional", color=list(sun.color), intensity=sun.intensity))
+        self.addNode(dict(name=name, rotation=eulerQuaternions([rotation])[0].tolist(),
+                          extensions=dict(KHR_lights_punctual=dict(light=len(lights) - 1))))
+        return name
+
+    def close(self):
+        self.buffer.close()
+        self.gltf["buffers"] = [dict(uri=os.path.basename(self.binPath), byteLength=self.offset)]
+        # only the top nodes go in the scene
+        children = set(child for node in self.gltf["nodes"] for child in node.get("children", ()))
+        self.gltf["scenes"] = [dict(nodes=[i for i in range(len(self.gltf["nodes"])) if i not in children])]
+        if not self.gltf["extensionsUsed"]:
+            del self.gltf["extensionsUsed"]
+        with open(self.path, "w") as handle:
+            json.dump(self.gltf, handle)
+
+
+# export backends by file extension
+BACKENDS = {".obj": ObjBackend, ".gltf": GltfBackend}
+
+
+# write a whole city model to an .obj or .gltf
+def exportCity(path, city, sourceMeshes=None, chunkSize=CHUNK_SIZE):
+    backend = BACKENDS[os.path.splitext(path)[1].lower()](path, sourceMeshes, chunkSize)
+    try:
+        backend.write(city)
+    finally:
+        backend.close()
+    return path
@@ -7,11 +7,359 @@ With assistance from BCIT
 
 #Add dependencies
 import maya.cmds as cmds
-import random
-from random import uniform as rand
 import time
 import os
+import hashlib
+from contextlib import contextmanager
+from collections import OrderedDict
 import maya.mel as mel
+import maya.api.OpenMaya as om
+import numpy as np
+import EnvHeightfield
+import EnvCurve
+import EnvPlacement
+import EnvRandom
+import EnvRoadNetwork
+import EnvNoise
+import EnvParallel
+import EnvLOD
+import EnvErosion
+import EnvHeightmap
+import EnvCache
+import EnvStages
+import EnvPreview
+import EnvProfile
+import EnvCity
+import EnvExport
+import EnvAssets
+
+# every maya command goes through the profiler, which counts them while profiling is on
+cmds = EnvProfile.profiler.wrap(cmds, "cmds")
+mel = EnvProfile.profiler.wrap(mel, "mel")
+
+######### mesh helpers ###########
+# get the dag path to the shape of a transform or shape
+def getShapePath(node):
+    selList = om.MSelectionList()
+    selList.add(node)
+    dagPath = selList.getDagPath(0)
+    if dagPath.hasFn(om.MFn.kTransform):
+        dagPath.extendToShape()
+    return dagPath
+
+# get the mesh function set of a mesh transform or shape
+def getMeshFn(mesh):
+    return om.MFnMesh(getShapePath(mesh))
+
+# read all vertex positions of a mesh in one call as an (n, 3) array
+def getMeshPoints(mesh, world = False):
+    flat = cmds.xform("%s.vtx[*]"%mesh, query = True, translation = True, 
+                        objectSpace = not world, worldSpace = world)
+    return np.array(flat, dtype = np.float64).reshape(-1, 3)
+
+# write all vertex positions of a mesh in one bulk update
+def setMeshPoints(mesh, points, world = False):
+    meshFn = getMeshFn(mesh)
+    space = om.MSpace.kWorld if world else om.MSpace.kObject
+    meshFn.setPoints(om.MPointArray(np.asarray(points, dtype = np.float64).tolist()), space)
+    meshFn.updateSurface()
+
+# the name a stage gives its nodes: asked for the first time, the same one again when the stage is rebuilt
+def askName(title, message, text, name = None):
+    if name:
+        return name
+    cmds.promptDialog(title = title, message = message, text = text, button = "OK")
+    return cmds.promptDialog(query = True, text = True)
+
+# nodes made while profiling, counted by type against the running stage
+def profileNodeAdded(node, *args):
+    EnvProfile.profiler.nodeAdded(om.MFnDependencyNode(node).typeName)
+
+# stage results on disk, shared by every stage that can reuse a result
+generationCache = EnvCache.StageCache()
+# parsed OBJ assets on disk, so a library is only read once
+assetCache = EnvAssets.AssetCache()
+
+# terrain height indexes by shape path with the callbacks watching them, dropped when the terrain changes
+_heightIndexes = {}
+
+def dropHeightIndex(key):
+    index, callbacks = _heightIndexes.pop(key, (None, []))
+    # callbacks are taken off after the one running now has returned
+    if callbacks:
+        cmds.evalDeferred(lambda: om.MMessage.removeCallbacks(callbacks))
+
+# height lookup of a terrain, all of its vertices read once in world space and kept until it changes
+# a polyPlane gets a grid, any other mesh such as an imported terrain a bounding volume hierarchy
+def terrainHeightIndex(terrain):
+    shapePath = getShapePath(terrain)
+    key = shapePath.fullPathName()
+    if key in _heightIndexes:
+        return _heightIndexes[key][0]
+    points = getMeshPoints(terrain, world = True)
+    planes = cmds.ls(cmds.listHistory(terrain), type = "polyPlane")
+    if planes:
+        cols = cmds.getAttr("%s.subdivisionsWidth"%planes[0]) + 1
+        rows = cmds.getAttr("%s.subdivisionsHeight"%planes[0]) + 1
+    if planes and rows * cols == len(points):
+        index = EnvHeightfield.HeightGrid(points, rows, cols)
+    else:
+        triangles = getMeshFn(terrain).getTriangles()[1]
+        index = EnvHeightfield.HeightBVH(points, np.array(list(triangles)))
+    # any edit of the mesh or move of its transform makes the index stale
+    transformPath = om.MDagPath(shapePath)
+    transformPath.pop()
+    callbacks = [om.MNodeMessage.addNodeDirtyCallback(path.node(), lambda *args: dropHeightIndex(key)) 
+                    for path in (shapePath, transformPath)]
+    _heightIndexes[key] = (index, callbacks)
+    return index
+
+# face vertex counts and face vertex ids of a mesh
+def getMeshFaces(mesh):
+    faceCounts, faceConnects = getMeshFn(mesh).getVertices()
+    return np.array(list(faceCounts), dtype = np.int32), np.array(list(faceConnects), dtype = np.int32)
+
+# a mesh of the scene as a city model mesh, read in two bulk calls
+def sceneMesh(mesh, world = True):
+    faceCounts, faceConnects = getMeshFaces(mesh)
+    return EnvCity.Mesh(getMeshPoints(mesh, world = world), faceCounts, faceConnects)
+
+# build a whole mesh from point, face count and face vertex arrays in one create
+# uvs: (u, v) rows with uvIds giving one per face corner, when the mesh has them
+def createMesh(name, points, faceCounts, faceConnects, uvs = None, uvIds = None):
+    meshFn = om.MFnMesh()
+    transform = meshFn.create(om.MPointArray(np.asarray(points, dtype = np.float64).tolist()), 
+                                om.MIntArray(np.asarray(faceCounts).tolist()), 
+                                om.MIntArray(np.asarray(faceConnects).tolist()))
+    if uvs is not None:
+        uvs = np.asarray(uvs, dtype = np.float64)
+        meshFn.setUVs(om.MFloatArray(uvs[:, 0].tolist()), om.MFloatArray(uvs[:, 1].tolist()))
+        meshFn.assignUVs(om.MIntArray(np.asarray(faceCounts).tolist()), om.MIntArray(np.asarray(uvIds).tolist()))
+    meshName = om.MFnDagNode(transform).setName(name)
+    cmds.sets(meshName, edit = True, forceElement = "initialShadingGroup")
+    return meshName
+
+# estimated bytes of mesh data held by a mesh shape
+def meshBytes(mesh):
+    meshFn = getMeshFn(mesh)
+    # float points, edge pairs, face counts, face vertex ids and normals, uvs
+    return (meshFn.numVertices * 12 + meshFn.numEdges * 8 + meshFn.numPolygons * 4 
+            + meshFn.numFaceVertices * 16 + meshFn.numUVs() * 8)
+
+######### curve helpers ###########
+# read the cvs and knots of a curve once and get its cached arc-length sampler
+def getCurveSampler(curve):
+    curveFn = om.MFnNurbsCurve(getShapePath(curve))
+    cvs = [(p.x, p.y, p.z) for p in curveFn.cvPositions(om.MSpace.kWorld)]
+    periodic = curveFn.form == om.MFnNurbsCurve.kPeriodic
+    return EnvCurve.getSampler(cvs, list(curveFn.knots()), curveFn.degree, periodic)
+
+######### placement helpers ###########
+# object space bounding box (xmin, ymin, zmin, xmax, ymax, zmax) of every source mesh
+def sourceBounds(sources):
+    return np.array([cmds.xform(src, query = True, boundingBox = True, objectSpace = True) 
+                        for src in sources], dtype = np.float64)
+
+# rotation and scale of every source mesh as (n, 3) arrays
+def sourceTransforms(sources):
+    rotates = np.array([cmds.getAttr("%s.rotate"%src)[0] for src in sources], dtype = np.float64)
+    scales = np.array([cmds.getAttr("%s.scale"%src)[0] for src in sources], dtype = np.float64)
+    return rotates, scales
+
+# place copies of the sources with one transform per row of the arrays
+# mode: 1 duplicate, 2 transform instance, 3 one particle instancer
+def placeCopies(mode, sources, sourceIndex, translates, rotates, scales, folder):
+    if mode == 3:
+        return placeInstancer(sources, sourceIndex, translates, rotates, scales, folder)
+    copies = []
+    for obj in range(len(translates)):
+        # duplicate the mesh data or share it with the source
+        if mode == 2:
+            tempObj = cmds.instance(sources[sourceIndex[obj]])
+        else:
+            tempObj = cmds.duplicate(sources[sourceIndex[obj]])
+        cmds.setAttr(tempObj[0] + ".translate", *translates[obj].tolist())
+        cmds.setAttr(tempObj[0] + ".rotate", *rotates[obj].tolist())
+        cmds.setAttr(tempObj[0] + ".scale", *scales[obj].tolist())
+        copies.append(tempObj[0])
+    # parent all copies to the folder in one go
+    if copies:
+        copies = cmds.parent(copies, folder, relative = False)
+    return copies
+
+# feed all transforms to a single particle instancer
+def placeInstancer(sources, sourceIndex, translates, rotates, scales, folder):
+    particle = cmds.particle(position = translates.tolist(), name = "%sParticle"%folder)
+    shape = particle[1]
+    # per particle rotation, scale and source index, also stored as the initial state
+    for attr, dataType, values in (("rotationPP", "vectorArray", rotates.tolist()), 
+                                    ("scalePP", "vectorArray", scales.tolist()), 
+                                    ("indexPP", "doubleArray", [float(i) for i in sourceIndex])):
+        for name in (attr, attr + "0"):
+            cmds.addAttr(shape, longName = name, dataType = dataType)
+            cmds.setAttr("%s.%s"%(shape, name), values, type = dataType)
+    cmds.setAttr(shape + ".isDynamic", False)
+    instancer = cmds.particleInstancer(shape, addObject = True, object = list(sources), 
+                                        cycle = "None", rotationUnits = "Degrees", 
+                                        position = "worldPosition", rotation = "rotationPP", 
+                                        scale = "scalePP", objectIndex = "indexPP")
+    return cmds.parent(particle[0], instancer, folder, relative = False)
+
+# make copies under a group that hold the same mesh share a single shape
+def convertToInstances(folder):
+    masters = {}
+    converted = 0
+    saved = 0
+    for child in cmds.listRelatives(folder, children = True, type = "transform", fullPath = True) or []:
+        shapes = cmds.listRelatives(child, shapes = True, type = "mesh", fullPath = True) or []
+        # only plain copies that are not instanced already
+        if len(shapes) != 1 or len(cmds.listRelatives(shapes[0], allParents = True) or []) > 1:
+            continue
+        shape = shapes[0]
+        # copies match on their points, topology size and shading
+        meshFn = getMeshFn(shape)
+        key = (hashlib.sha1(getMeshPoints(shape).tobytes()).hexdigest(), meshFn.numPolygons, 
+                meshFn.numFaceVertices, tuple(sorted(cmds.listConnections(shape, type = "shadingEngine") or [])))
+        if key not in masters:
+            masters[key] = shape
+            continue
+        # swap the copy's own mesh for an instance of the first one
+        saved += meshBytes(shape)
+        cmds.delete(shape)
+        cmds.parent(masters[key], child, add = True, shape = True)
+        converted += 1
+    return converted, len(masters), saved
+
+######### scene backend ###########
+# writes the parts of a city model into the maya scene, every part in one bulk create
+# mode: how placements are copied, see placeCopies
+class MayaBackend(EnvCity.SceneBackend):
+    def __init__(self, mode = 1):
+        self.mode = mode
+
+    def writeMesh(self, name, mesh):
+        return createMesh(name, mesh.points, mesh.faceCounts, mesh.faceConnects, mesh.uvs, mesh.uvIds)
+
+    # copies go under a new group of that name
+    def writePlacements(self, name, placements):
+        cmds.group(empty = True, name = name)
+        if len(placements):
+            placeCopies(self.mode, placements.sources, placements.sourceIndex, placements.translates, 
+                        placements.rotates, placements.scales, name)
+        return name
+
+    def writeSun(self, name, sun):
+        cmds.directionalLight(name = name, rotation = sun.rotation)
+        cmds.setAttr("%sShape.color"%name, sun.color[0], sun.color[1], sun.color[2])
+        cmds.setAttr("%sShape.intensity"%name, sun.intensity)
+        # key the day without moving the timeline
+        for frame, value in sun.keys:
+            cmds.setKeyframe(name, attribute = sun.axis, time = frame, value = value)
+        return name
+
+    # returns the top node of the effect, a fluid container or the hidden surface particles come from
+    def writeWeather(self, name, weather):
+        settings = weather.settings
+        if weather.kind == "cloudy":
+            # create cloud emitter
+            cmds.Create3DContainerEmitter()
+            cmds.rename("fluid1", name)
+            shape = "|%s|%sShape"%(name, name)
+            cmds.select(name, replace=True)
+            cmds.move(0, settings["lift"], relative=True)
+            # set the dimentions and resolutions
+            cmds.setAttr("%s.squareVoxels"%shape, 0)
+            cmds.setAttr("%s.dimensionsW"%shape, settings["dimensions"][0])
+            cmds.setAttr("%s.dimensionsH"%shape, settings["dimensions"][1])
+            cmds.setAttr("%s.dimensionsD"%shape, settings["dimensions"][2])
+            cmds.setAttr("%s.resolution"%shape, *settings["resolution"])
+            # make the density to y gradient
+            cmds.setAttr("%s.densityMethod"%shape, 3) # can be zero
+            cmds.setAttr("%s.velocityMethod"%shape, 0)
+            # shading
+            cmds.setAttr("%s.dropoffShape"%shape, 6)
+            cmds.setAttr("%s.edgeDropoff"%shape, 0.4)
+            # color
+            cmds.setAttr("%s.color[0].color_Color"%shape, 0.4,0.4,0.4)
+            cmds.setAttr("%s.colorInput"%shape, 2)
+            # opacity
+            cmds.setAttr("%s.opacity[2].opacity_FloatValue"%shape, 0.1)
+            cmds.setAttr("%s.opacity[2].opacity_Position"%shape, 0.5)
+            cmds.setAttr("%s.opacity[3].opacity_FloatValue"%shape, 0.55)
+            cmds.setAttr("%s.opacity[3].opacity_Position"%shape, 0.75)
+            cmds.setAttr("%s.opacity[3].opacity_Interp"%shape, 1)
+            # textures
+            cmds.setAttr("%s.opacityTexture"%shape, 1)
+            cmds.setAttr("%s.amplitude"%shape, 1.5)
+            cmds.setAttr("%s.depthMax"%shape, 5)
+            cmds.setAttr("%s.inflection"%shape, 1)
+            # set key frame of texture time
+            for frame, value in settings["textureKeys"]:
+                cmds.setKeyframe(shape, attribute = "textureTime", time = frame, value = value)
+            # lighting
+            cmds.setAttr("%s.selfShadowing"%shape, 1)
+            return name
+        if weather.kind in ("rainy", "snowy"):
+            # making the surface of particles
+            surface = cmds.duplicate(weather.terrain, returnRootsOnly=True)[0]
+            cmds.select(surface)
+            cmds.move(0, settings["lift"], relative=True)
+            cmds.rotate(180, relative=True, objectSpace=True, forceOrderXYZ=True)
+            cmds.setAttr("%s.visibility"%surface, 0)
+            # create particles
+            particle = "%sParticle"%name
+            cmds.emitter(type="surface", name=name, rate=settings["rate"], scaleRateByObjectSize=False, 
+                        needParentUV=False, cycleEmission="None", cycleInterval=1, 
+                        speed=settings["speed"], speedRandom=0, normalSpeed=1, tangentSpeed=0, maxDistance=0, 
+                        minDistance=0, directionX=1, directionY=0, directionZ=0, spread=0)
+            cmds.nParticle(name=particle)
+            cmds.connectDynamic(particle, emitters=name)
+            # change particle color and shape
+            if "opacity" in settings:
+                cmds.setAttr("%s.particleColor"%name, 1,1,1)
+                cmds.setAttr("%sShape.opacity"%particle, settings["opacity"])
+            cmds.setAttr("%sShape.particleRenderType"%particle, settings["renderType"])
+            # change particle lifespan
+            cmds.setAttr("%sShape.lifespanMode"%particle, 2)
+            cmds.setAttr("%sShape.lifespan"%particle, settings["lifespan"])
+            # make particle collide with terrain
+            cmds.select(particle, replace=True)
+            cmds.select(weather.terrain, add=True)
+            mel.eval("makeCollideNCloth;")
+            cmds.select(clear=True)
+            return surface
+        return None
+
+# the scene every stage writes its results into
+mayaScene = MayaBackend()
+
+######### generation helpers ###########
+# run a generation stage without scrubbing the timeline or redrawing the viewports
+@contextmanager
+def generationMode(headless = True):
+    if not headless:
+        yield
+        return
+    # remember the user's time and refresh state
+    userTime = cmds.currentTime(query = True)
+    userSuspend = cmds.refresh(query = True, suspend = True)
+    mainPane = None
+    if not cmds.about(batch = True):
+        # hiding the main pane stops the viewports pulling on the DG while we build
+        mainPane = mel.eval("$tempPane = $gMainPane")
+        paneManaged = cmds.paneLayout(mainPane, query = True, manage = True)
+        cmds.paneLayout(mainPane, edit = True, manage = False)
+    cmds.refresh(suspend = True)
+    try:
+        yield
+    finally:
+        # give the user back their scene state
+        if mainPane:
+            cmds.paneLayout(mainPane, edit = True, manage = paneManaged)
+        cmds.refresh(suspend = userSuspend)
+        if cmds.currentTime(query = True) != userTime:
+            cmds.currentTime(userTime, edit = True)
+        cmds.refresh(force = True)
 
 # create UI class
 class UI(object):
@@ -19,11 +367,22 @@ class UI(object):
     def __init__(self):    
         # define variables 
         cmds.select(cl=True)
+        # general
+        self.headless = True
+        self.useCache = True
+        self.graph = self.cityGraph()
+        self.livePreview = False
+        self.previewStage = None
+        self.previewPending = False
+        self.previewDebounce = EnvPreview.Debounce()
+        self.previewDetail = EnvPreview.Detail()
+        self.profileCallback = None
         # terrain
         self.DimVal=20
         self.DivVal=20
         self.HeightVal=1.0
         self.DepthVal=-1.0
+        self.terrainSeed = 1
         # building
         self.copiesBuilding = 10
         self.offsetValBuilding = 0
@@ -32,14 +391,34 @@ class UI(object):
         self.randScaleBuilding = 0.0
         self.buildingCondition = False
         self.buildingCRVCondition = False
+        self.buildingMode = 1
+        self.buildingSeed = 1
+        self.overlapBuilding = 1
+        self.spacingBuilding = 0.0
+        self.terrainBuilding = None
+        self.blockCurves = []
+        self.blockRoadWidth = 1.0
+        self.blockLotArea = 50.0
+        self.blockLotWidth = 3.0
+        self.blockFill = 0.8
         # curve
         self.widthValRoad = 1
         self.divValRoad = 15
+        self.tessellationRoad = 1
+        self.toleranceRoad = 0.05
+        self.terrainRoad = None
+        self.clearanceRoad = 0.05
+        self.flattenValRoad = True
+        self.shoulderRoad = 1.0
+        self.depthRiver = 1.0
+        self.bankRiver = 2.0
         self.heightValRoad = 0
         self.riverValRoad = False
         self.usePlane = True
         self.userRoadCopy = 10
         self.populateRoadMesh = 0
+        self.roadMode = 1
+        self.networkCurves = []
         # light
         self.userNorth = 0
         self.userTime = 0
@@ -52,6 +431,36 @@ class UI(object):
         self.changeIntensity = 1.0
         self.userLightColor = (1.0, 1.0, 1.0)
         self.userWeatherTerrain = None
+        self.noiseTiles = 4
+        self.noiseDivisions = 64
+        self.noiseSpacing = 1.0
+        self.noiseHeight = 20.0
+        self.noiseFeature = 100.0
+        self.noiseOctaves = 6
+        self.noiseRidged = False
+        self.noiseWarp = 0.0
+        self.noiseWorkers = EnvParallel.defaultWorkers()
+        self.lodTerrain = None
+        self.lodCamera = "persp"
+        self.lodLeaf = 16
+        self.lodBudget = 100000
+        self.lodDetail = 0.5
+        self.lodFollow = True
+        self.mapPath = None
+        self.mapWidth = 0
+        self.mapSpacing = 1.0
+        self.mapScale = 1.0
+        self.mapStep = 1
+        self.mapDivisions = 128
+        self.erodeTerrain = None
+        self.erodeIterations = 50
+        self.erodeBudget = 0.0
+        self.erodeTalus = 1.0
+        self.erodeThermal = 0.5
+        self.erodeRain = 0.01
+        self.erodeCapacity = 1.0
+        self.erodeStrength = 0.3
+        self.erodeWorkers = EnvParallel.defaultWorkers()
 
     # make UI window
     def makeUI(self):
@@ -68,6 +477,36 @@ class UI(object):
 
     # make window UI layout
     def layoutUI(self):
+        # general settings shared by all tabs
+        cmds.columnLayout("mainLayout")
+        self.headlessCheck = cmds.checkBox(label = "Headless generation (no timeline scrubbing or viewport refresh)", 
+                                            value = True, changeCommand = self.headlessMode)
+        cmds.rowLayout(numberOfColumns = 2)
+        self.cacheCheck = cmds.checkBox(label = "Reuse cached results for known settings", 
+                                        value = True, changeCommand = self.cacheMode)
+        cmds.button(label = "Clear cache", command = self.clearCache)
+        cmds.setParent("mainLayout")
+        # low resolution preview while the sliders move, made at full quality on commit
+        cmds.rowLayout(numberOfColumns = 2)
+        self.previewCheck = cmds.checkBox(label = "Live preview of slider changes", 
+                                            value = False, changeCommand = self.previewMode)
+        self.commitPreviewButton = cmds.button(label = "Commit preview", enable = False, 
+                                                command = self.commitPreview)
+        cmds.setParent("mainLayout")
+        # the generated city straight from its arrays, without maya's exporters
+        cmds.button(label = "Export city as glTF/OBJ", command = self.exportCity)
+        # time, maya commands and nodes of every stage
+        cmds.frameLayout("profileFrame", label = "Profiling", width = 500, 
+                            marginWidth = 5, collapsable = True, collapse = True)
+        cmds.rowLayout(numberOfColumns = 3)
+        self.profileCheck = cmds.checkBox(label = "Profile generation", value = False, 
+                                            changeCommand = self.profileMode)
+        cmds.button(label = "Save report", command = self.saveProfile)
+        cmds.button(label = "Reset", command = self.resetProfile)
+        cmds.setParent("profileFrame")
+        self.profileText = cmds.scrollField(editable = False, wordWrap = False, height = 120, width = 490)
+        cmds.setParent("mainLayout")
+        cmds.setParent("mainLayout")
         # create tabs
         cmds.tabLayout("mainTab", scrollable = True, 
                         innerMarginHeight = 5, innerMarginWidth = 5)
@@ -93,6 +532,28 @@ class UI(object):
         # user import mesh 
         cmds.button(label = "import terrain", width = 100, command = self.importMesh)
         
+    ### 1.1 heightmap ###
+        cmds.frameLayout("terrainHeightmap", label = "Heightmap", width = 490,
+                            marginWidth = 5, collapsable = True, collapse = True)
+        cmds.separator(style = "none", height = 3)
+        
+        ## content
+        cmds.text("16/32 bit RAW (.r16, .raw, .r32) or float TIFF, read a tile at a time without loading the file.")
+        cmds.text("Integer maps go from 0 to the height scale, float maps are multiplied by it.")
+        self.MapFile=cmds.textFieldButtonGrp(l="Heightmap:",bl="Browse",ed=False,bc=self.getMapFile)
+        self.MapWidth=cmds.intFieldGrp(l="RAW width (0 square):",nf=1,v1=0,cc=self.getMap)
+        self.MapSpacing=cmds.floatSliderGrp(l="Sample spacing:",f=True,min=0.01,max=100.0,v=1.0,cc=self.getMap)
+        self.MapScale=cmds.floatSliderGrp(l="Height scale:",f=True,min=0.0,max=10000.0,v=1.0,cc=self.getMap)
+        self.MapStep=cmds.intSliderGrp(l="Use every nth sample:",f=True,min=1,max=64,v=1,cc=self.getMap)
+        self.MapDiv=cmds.intSliderGrp(l="Tile division:",f=True,min=16,max=256,v=128,cc=self.getMap)
+        self.MapImport=cmds.button(l="Import heightmap",backgroundColor = (0, 0.5, 0.3),command=self.CreateMapTerrain,
+                                    enable=False)
+        self.MapU=cmds.button(l="Undo",bgc = (0.5, 0.2, 0.2),command=self.UndoMapTerrain, enable=False)
+        cmds.button(l="Export selected terrain",command=self.exportHeightmap)
+        # go back to terrain mesh
+        cmds.separator(style = "none", height = 3)
+        cmds.setParent("terrainMesh")
+        
         # go back to terrain tab
         cmds.separator(style = "none", height = 3)
         cmds.setParent("terrainLayout")
@@ -105,13 +566,81 @@ class UI(object):
         ## content
         # get parameters
         cmds.text("Please modify parameters for the terrain")
-        self.PlaneDim=cmds.intSliderGrp(l="Dimension:",f=True,min=10,max=50,v=20,cc=self.getDim)
-        self.PlaneDiv=cmds.intSliderGrp(l="Division:",f=True,min=10,max=50,v=20,cc=self.getDiv)
-        self.MaxHeight=cmds.floatSliderGrp(l="Maximun Height:",f=True,min=0.0,max=5.0,v=0.5,cc=self.getHei)
-        self.MaxDepth=cmds.floatSliderGrp(l="Maximun Depth:",f=True,min=-5.0,max=0.0,v=-0.5,cc=self.getDep)
+        self.PlaneDim=cmds.intSliderGrp(l="Dimension:",f=True,min=10,max=50,v=20,cc=self.getDim,dc=self.getDim)
+        self.PlaneDiv=cmds.intSliderGrp(l="Division:",f=True,min=10,max=50,v=20,cc=self.getDiv,dc=self.getDiv)
+        self.MaxHeight=cmds.floatSliderGrp(l="Maximun Height:",f=True,min=0.0,max=5.0,v=0.5,cc=self.getHei,dc=self.getHei)
+        self.MaxDepth=cmds.floatSliderGrp(l="Maximun Depth:",f=True,min=-5.0,max=0.0,v=-0.5,cc=self.getDep,dc=self.getDep)
+        self.TerrainSeed=cmds.intFieldGrp(l="Seed:",nf=1,v1=1,cc=self.getTerrainSeed)
+        cmds.button(l="New seed",command=self.newTerrainSeed)
         cmds.button(l="Create",backgroundColor = (0, 0.5, 0.3),command=self.CreateTerrain)
         self.terrainU=cmds.button(l="Undo",bgc = (0.5, 0.2, 0.2),command=self.UndoTerrain, enable=False)
         
+    ### 2.1 noise terrain ###
+        cmds.frameLayout("noiseTerrain", label = "Noise terrain in tiles", width = 490,
+                            marginWidth = 5, collapsable = True, collapse = True)
+        cmds.separator(style = "none", height = 3)
+        
+        ## content
+        cmds.text("Fractal noise terrain built tile by tile, uses the seed above.")
+        self.NoiseTiles=cmds.intSliderGrp(l="Tiles across:",f=True,min=1,max=64,v=4,cc=self.getNoise)
+        self.NoiseDiv=cmds.intSliderGrp(l="Tile division:",f=True,min=8,max=256,v=64,cc=self.getNoise)
+        self.NoiseSpacing=cmds.floatSliderGrp(l="Cell size:",f=True,min=0.1,max=10.0,v=1.0,cc=self.getNoise)
+        self.NoiseHeight=cmds.floatSliderGrp(l="Height:",f=True,min=0.0,max=200.0,v=20.0,cc=self.getNoise)
+        self.NoiseFeature=cmds.floatSliderGrp(l="Feature size:",f=True,min=1.0,max=2000.0,v=100.0,cc=self.getNoise)
+        self.NoiseOctaves=cmds.intSliderGrp(l="Octaves:",f=True,min=1,max=10,v=6,cc=self.getNoise)
+        self.NoiseRidged=cmds.checkBox(l="Ridged",v=False,cc=self.getNoise)
+        self.NoiseWarp=cmds.floatSliderGrp(l="Domain warp:",f=True,min=0.0,max=2.0,v=0.0,cc=self.getNoise)
+        self.NoiseWorkers=cmds.intSliderGrp(l="Worker processes:",f=True,min=1,max=32,
+                                            v=EnvParallel.defaultWorkers(),cc=self.getNoise)
+        cmds.button(l="Create noise terrain",backgroundColor = (0, 0.5, 0.3),command=self.CreateNoiseTerrain)
+        self.noiseU=cmds.button(l="Undo",bgc = (0.5, 0.2, 0.2),command=self.UndoNoiseTerrain, enable=False)
+        # go back to terrain creation
+        cmds.separator(style = "none", height = 3)
+        cmds.setParent("createTerrain")
+        
+    ### 2.2 level of detail ###
+        cmds.frameLayout("terrainLOD", label = "Terrain level of detail", width = 490,
+                            marginWidth = 5, collapsable = True, collapse = True)
+        cmds.separator(style = "none", height = 3)
+        
+        ## content
+        cmds.text("Shows a polyPlane terrain as tiles, finer near the camera, within a face budget.")
+        self.LODTerrain=cmds.textFieldButtonGrp(l="Terrain:",bl="Select",ed=False,bc=self.getLODTerrain)
+        self.LODCamera=cmds.textFieldButtonGrp(l="Camera:",bl="Select",ed=False,tx="persp",bc=self.getLODCamera)
+        self.LODLeaf=cmds.intSliderGrp(l="Tile division:",f=True,min=4,max=64,v=16,cc=self.getLOD)
+        self.LODBudget=cmds.intSliderGrp(l="Face budget:",f=True,min=1000,max=2000000,v=100000,cc=self.getLOD)
+        self.LODDetail=cmds.floatSliderGrp(l="Detail limit:",f=True,min=0.05,max=4.0,v=0.5,pre=2,cc=self.getLOD)
+        self.LODFollow=cmds.checkBox(l="Follow camera",v=True,cc=self.getLOD)
+        self.LODMake=cmds.button(l="Make LOD",backgroundColor = (0, 0.5, 0.3),command=self.CreateLOD, enable=False)
+        self.LODUpdate=cmds.button(l="Update from camera",command=self.UpdateLOD, enable=False)
+        self.LODU=cmds.button(l="Undo",bgc = (0.5, 0.2, 0.2),command=self.UndoLOD, enable=False)
+        # go back to terrain creation
+        cmds.separator(style = "none", height = 3)
+        cmds.setParent("createTerrain")
+        
+    ### 2.3 erosion ###
+        cmds.frameLayout("terrainErosion", label = "Terrain erosion", width = 490,
+                            marginWidth = 5, collapsable = True, collapse = True)
+        cmds.separator(style = "none", height = 3)
+        
+        ## content
+        cmds.text("Slope slumping and rain wearing down a polyPlane terrain. A time budget of 0 runs every iteration.")
+        self.ErodeTerrain=cmds.textFieldButtonGrp(l="Terrain:",bl="Select",ed=False,bc=self.getErodeTerrain)
+        self.ErodeIterations=cmds.intSliderGrp(l="Iterations:",f=True,min=1,max=500,v=50,cc=self.getErosion)
+        self.ErodeBudget=cmds.floatSliderGrp(l="Time budget (s):",f=True,min=0.0,max=60.0,v=0.0,cc=self.getErosion)
+        self.ErodeTalus=cmds.floatSliderGrp(l="Talus slope:",f=True,min=0.1,max=5.0,v=1.0,cc=self.getErosion)
+        self.ErodeThermal=cmds.floatSliderGrp(l="Slumping:",f=True,min=0.0,max=1.0,v=0.5,cc=self.getErosion)
+        self.ErodeRain=cmds.floatSliderGrp(l="Rain:",f=True,min=0.0,max=0.1,v=0.01,pre=3,cc=self.getErosion)
+        self.ErodeCapacity=cmds.floatSliderGrp(l="Sediment capacity:",f=True,min=0.0,max=5.0,v=1.0,cc=self.getErosion)
+        self.ErodeStrength=cmds.floatSliderGrp(l="Erosion:",f=True,min=0.0,max=1.0,v=0.3,cc=self.getErosion)
+        self.ErodeWorkers=cmds.intSliderGrp(l="Worker processes:",f=True,min=1,max=32,
+                                            v=EnvParallel.defaultWorkers(),cc=self.getErosion)
+        self.ErodeMake=cmds.button(l="Erode",backgroundColor = (0, 0.5, 0.3),command=self.CreateErosion, enable=False)
+        self.ErodeU=cmds.button(l="Undo",bgc = (0.5, 0.2, 0.2),command=self.UndoErosion, enable=False)
+        # go back to terrain creation
+        cmds.separator(style = "none", height = 3)
+        cmds.setParent("createTerrain")
+        
     ### 3. apply texture ###
         cmds.frameLayout("terrainShader", label = "Apply terrain texture", width = 500,
                             marginWidth = 5, collapsable = True, collapse = False, enable =True)
@@ -192,22 +721,37 @@ class UI(object):
         # number of copies
         self.copyBuilding = cmds.intSliderGrp(  label = "Number of copies: ", 
                                                 value = 10, field = True, min = 3, max = 100,
-                                                changeCommand = self.buildingCP)
+                                                changeCommand = self.buildingCP, dragCommand = self.buildingCP)
         # position offset
         self.offsetBuilding = cmds.intSliderGrp(label = "Position offset: ", 
                                                 value = 0, field = True, min = -50, max = 50, 
-                                                changeCommand = self.buildingPO)        
+                                                changeCommand = self.buildingPO, dragCommand = self.buildingPO)        
         # random rotation
         self.rotationBuilding = cmds.intSliderGrp(  label = "random rotation: ", 
                                                     value = 0, field = True, min = -180, max = 180, 
-                                                    changeCommand = self.buildingRR)
+                                                    changeCommand = self.buildingRR, dragCommand = self.buildingRR)
         # rotate along curve
         self.curveRotation = cmds.checkBox( label = "Rotate along curve", value = False, align = "center",
                                             changeCommand = self.buildingCR)                                            
         # random size
         self.sizeBuilding = cmds.floatSliderGrp(label = "size randomness: ", 
                                                 value = 0, f = True, min = 0, max = 10, 
-                                                changeCommand = self.buildingRS)    
+                                                changeCommand = self.buildingRS, dragCommand = self.buildingRS)    
+        # seed of all the random choices
+        self.seedBuilding = cmds.intFieldGrp(label = "Seed: ", numberOfFields = 1, value1 = 1, 
+                                            changeCommand = self.buildingSD)
+        cmds.button(label = "New seed", command = self.newBuildingSeed)
+        # overlapping buildings
+        self.overlapCheck = cmds.radioButtonGrp(label = "Overlaps: ", numberOfRadioButtons = 3, select = 1,
+                                                labelArray3 = ("Allow", "Drop", "Push aside"), 
+                                                changeCommand = self.buildingOL)
+        self.spacing = cmds.floatSliderGrp(label = "Spacing: ", 
+                                            value = 0, f = True, min = 0, max = 10, 
+                                            changeCommand = self.buildingSP, dragCommand = self.buildingSP)
+        # stand every building on the ground
+        self.snapTerrain = cmds.textFieldButtonGrp(label = "Snap to terrain: ", 
+                                                    buttonLabel = "Select", editable = False,
+                                                    buttonCommand = self.selectBuildingTerrain)
         
         # go back to building tab
         cmds.separator(style = "none", height = 3)
@@ -220,14 +764,52 @@ class UI(object):
         cmds.separator(style = "none", height = 3)
         
         ## content
+        # duplicate, instance or particle instancer
+        self.modeBuilding = cmds.radioButtonGrp(label = "Copies as: ", numberOfRadioButtons = 3, select = 1,
+                                                labelArray3 = ("Duplicate", "Instance", "Instancer"), 
+                                                changeCommand = self.buildingM)
         self.populate = cmds.button(label = "Populate", backgroundColor = (0, 0.5, 0.3), 
                                     command = self.makeBuilding, enable = False)
         self.undoBuilding = cmds.button(label = "Undo", backgroundColor = (0.5, 0.2, 0.2), 
                                         command = self.deleteBuilding, enable = False)
+        cmds.button(label = "Convert selected group to instances", command = self.convertInstances)
 
         # go back to building tab
         cmds.setParent("buildingLayout")
         
+        
+    ### 5. fill city blocks ###
+        cmds.frameLayout("buildingBlocks", label = "Fill the blocks between road curves", width = 500,
+                            marginWidth = 5, collapsable = True, collapse = True)
+        cmds.separator(style = "none", height = 3)
+        
+        ## content
+        # road curves that close the blocks
+        self.selectedBlockCurves = cmds.textFieldButtonGrp(label = "Select road curves: ", 
+                                                            buttonLabel = "Select", editable = False,
+                                                            buttonCommand = self.selectBlockCRVs)
+        # lot parameters
+        self.blockWidth = cmds.floatSliderGrp(label = "Road width: ", 
+                                                value = 1, field = True, min = 0, max = 20,
+                                                changeCommand = self.blockP)
+        self.blockArea = cmds.floatSliderGrp(label = "Max lot area: ", 
+                                                value = 50, field = True, min = 1, max = 1000,
+                                                changeCommand = self.blockP)
+        self.blockLot = cmds.floatSliderGrp(label = "Min lot width: ", 
+                                            value = 3, field = True, min = 0.1, max = 50,
+                                            changeCommand = self.blockP)
+        self.blockFillRatio = cmds.floatSliderGrp(label = "Lot fill: ", 
+                                                    value = 0.8, field = True, min = 0.1, max = 1,
+                                                    changeCommand = self.blockP)
+        self.fillBlocks = cmds.button(label = "Fill blocks", backgroundColor = (0, 0.5, 0.3), 
+                                        command = self.makeBlocks, enable = False)
+        self.undoBlocks = cmds.button(label = "Undo", backgroundColor = (0.5, 0.2, 0.2), 
+                                        command = self.deleteBlocks, enable = False)
+        
+        # go back to building tab
+        cmds.separator(style = "none", height = 3)
+        cmds.setParent("buildingLayout")
+        
         ### go back to main tab
         cmds.setParent("mainTab")
         
@@ -277,6 +859,10 @@ class UI(object):
         self.copyRoad = cmds.intSliderGrp(  label = "Number of copies: ", enable =False,
                                             value = 10, field = True, min = 1, max = 100,
                                             changeCommand = self.roadC)
+        # duplicate, instance or particle instancer
+        self.modeRoad = cmds.radioButtonGrp(label = "Copies as: ", numberOfRadioButtons = 3, select = 1,
+                                            labelArray3 = ("Duplicate", "Instance", "Instancer"), 
+                                            enable = False, changeCommand = self.roadM)
         cmds.separator(style="none", height=3)
         
     ### 2.1 default road parameter ###
@@ -287,18 +873,44 @@ class UI(object):
         # road width
         self.widthRoad = cmds.floatSliderGrp(label = "Road Width: ", 
                                             value = 1, field = True, min = 0.1, max = 10,
-                                            changeCommand = self.roadW)
+                                            changeCommand = self.roadW, dragCommand = self.roadW)
         # road division
         self.divisionRoad = cmds.intSliderGrp(label = "Road division: ", 
                                                 value = 10, field = True, min = 1, max = 500, 
-                                                changeCommand = self.roadD)        
+                                                changeCommand = self.roadD, dragCommand = self.roadD)        
+        # fixed division or samples placed by curvature
+        self.tessellateRoad = cmds.radioButtonGrp(label = "Tessellation: ", numberOfRadioButtons = 2, select = 1,
+                                                labelArray2 = ["Fixed division", "Adaptive"],
+                                                changeCommand = self.roadT)
+        self.toleranceValue = cmds.floatSliderGrp(label = "Chord tolerance: ", 
+                                                value = 0.05, field = True, min = 0.001, max = 1, 
+                                                precision = 3, enable = False, changeCommand = self.roadTol, dragCommand = self.roadTol)
         # height offset
         self.heightRoad = cmds.floatSliderGrp(  label = "Height offset: ", 
                                                 value = 0, field = True, min = -10, max = 20, 
-                                                changeCommand = self.roadH)
+                                                changeCommand = self.roadH, dragCommand = self.roadH)
         # make river
         self.river = cmds.checkBox( label = "Make river ", value = False, align = "center",
                                     changeCommand = self.roadR)       
+        # a river on a terrain is carved into it
+        self.riverDepth = cmds.floatSliderGrp(label = "River depth: ", 
+                                                value = 1, field = True, min = 0, max = 10, 
+                                                enable = False, changeCommand = self.riverD)
+        self.riverBank = cmds.floatSliderGrp(label = "Bank width: ", 
+                                                value = 2, field = True, min = 0, max = 20, 
+                                                enable = False, changeCommand = self.riverB)
+        # follow the terrain, the clearance then takes the place of the height offset
+        self.conformTerrain = cmds.textFieldButtonGrp(label = "Conform to terrain: ", 
+                                                        buttonLabel = "Select", editable = False,
+                                                        buttonCommand = self.selectRoadTerrain)
+        self.clearance = cmds.floatSliderGrp(label = "Clearance: ", 
+                                                value = 0.05, field = True, min = 0, max = 2, 
+                                                precision = 3, changeCommand = self.roadCl, dragCommand = self.roadCl)
+        self.flattenTerrain = cmds.checkBox(label = "Flatten terrain under road ", value = True, align = "center",
+                                            changeCommand = self.roadFl)
+        self.shoulder = cmds.floatSliderGrp(label = "Shoulder width: ", 
+                                                value = 1, field = True, min = 0, max = 20, 
+                                                changeCommand = self.roadSh)
         # go back to main parameter tab
         cmds.separator(style = "none", height = 3)
         cmds.setParent("roadStyle")
@@ -318,6 +930,7 @@ class UI(object):
                                     command = self.makingRoad, enable = False)
         self.undoRoad = cmds.button(label = "Undo", backgroundColor = (0.5, 0.2, 0.2), 
                                         command = self.deleteRoad, enable = False)
+        cmds.button(label = "Convert selected group to instances", command = self.convertInstances)
         
         # go back to road tab
         cmds.separator(style = "none", height = 3)
@@ -342,6 +955,25 @@ class UI(object):
         cmds.setParent("roadLayout")
         
         
+    ### 5. road network ###
+        cmds.frameLayout("roadNetwork", label = "Make one road network from many curves", width = 500,
+                            marginWidth = 5, collapsable = True, collapse = True)
+        cmds.separator(style = "none", height = 3)
+        
+        ## content
+        cmds.text("Crossing curves are joined with junctions. Uses the road width and height offset above.")
+        self.selectedNetworkCurves = cmds.textFieldButtonGrp(label = "Select road curves: ", 
+                                                            buttonLabel = "Select", editable = False,
+                                                            buttonCommand = self.selectNetworkCRVs)
+        self.makeNetwork = cmds.button(label = "Make network", backgroundColor = (0, 0.5, 0.3), 
+                                        command = self.makingNetwork, enable = False)
+        self.undoNetwork = cmds.button(label = "Undo", backgroundColor = (0.5, 0.2, 0.2), 
+                                        command = self.deleteNetwork, enable = False)
+        # go back to road tab
+        cmds.separator(style = "none", height = 3)
+        cmds.setParent("roadLayout")
+        
+        
         ## go back to main tab
         cmds.setParent("mainTab")
 
@@ -447,18 +1079,246 @@ class UI(object):
 
 ######### general ###########
 
+    def headlessMode(self, *args):
+        # check if the user wants batch generation
+        self.headless = cmds.checkBox(self.headlessCheck, query = True, value = True)
+        return self.headless
+
+    def cacheMode(self, *args):
+        # check if the user wants known settings loaded from the cache
+        self.useCache = cmds.checkBox(self.cacheCheck, query = True, value = True)
+        return self.useCache
+
+    def clearCache(self, *args):
+        print "Cache cleared, %.2f MB freed."%((generationCache.size() + assetCache.size()) / 1048576.0)
+        generationCache.clear()
+        assetCache.clear()
+
+    # the cache for the stages, or None when it is switched off
+    def stageCache(self):
+        return generationCache if self.useCache else None
+
+    def previewMode(self, *args):
+        # check if the user wants a preview of every slider change
+        self.livePreview = cmds.checkBox(self.previewCheck, query = True, value = True)
+        if not self.livePreview:
+            self.dropPreview()
+        return self.livePreview
+
+    # a setting of a stage changed: preview it once the sliders have been still for a moment
+    def previewChanged(self, stage):
+        if not self.livePreview:
+            return
+        self.previewStage = stage
+        self.previewDebounce.touch()
+        if not self.previewPending:
+            self.previewPending = True
+            cmds.evalDeferred(self.previewIdle, lowestPriority = True)
+
+    # runs when maya is idle, until the debounce delay has passed
+    def previewIdle(self, *args):
+        if self.previewDebounce.wait() > 0:
+            cmds.evalDeferred(self.previewIdle, lowestPriority = True)
+            return
+        self.previewPending = False
+        self.previewDebounce.fire()
+        if self.livePreview:
+            self.makePreview()
+
+    # the preview of the stage last changed, built beside the old one and swapped in before the next redraw
+    @EnvProfile.stage("preview")
+    def makePreview(self):
+        started = time.time()
+        stride = self.previewDetail.stride()
+        # previews stay out of the undo queue
+        cmds.undoInfo(stateWithoutFlush = False)
+        try:
+            made = self.stagePreview(self.previewStage, stride)
+            if made is None:
+                return
+            group = cmds.group(made, name = "envPreviewNext")
+            if cmds.objExists("envPreview"):
+                cmds.delete("envPreview")
+            cmds.rename(group, "envPreview")
+        finally:
+            cmds.undoInfo(stateWithoutFlush = True)
+        cmds.button(self.commitPreviewButton, edit = True, enable = True)
+        elapsed = time.time() - started
+        self.previewDetail.took(elapsed)
+        print "%s preview keeping every %d. sample: %.0f ms."%(self.previewStage, stride, elapsed * 1000.0)
+
+    # one low resolution mesh of a stage, or None while the stage is missing its inputs
+    def stagePreview(self, stage, stride):
+        if stage == "terrain":
+            return Terrain(self.DimVal, self.DivVal, self.HeightVal, self.DepthVal, self.terrainSeed, 
+                            preview = stride).nameTR
+        if stage == "buildings" and self.buildingCondition and self.buildingCRVCondition:
+            return Building(self.copiesBuilding, self.offsetValBuilding, self.randRotateBuilding, 
+                            self.rotAlongCRVBuilding, self.randScaleBuilding, self.populateBuilding, 
+                            self.populateBuildingCRV[0], overlap = self.overlapBuilding, 
+                            spacing = self.spacingBuilding, seed = self.buildingSeed, 
+                            terrain = self.terrainBuilding, preview = stride).folderName
+        if stage == "roads" and self.usePlane and getattr(self, "populateRoadCRV", None):
+            return Road(self.widthValRoad, self.divValRoad, self.heightValRoad, self.riverValRoad, 
+                        self.userRoadCopy, self.populateRoadCRV[0], self.populateRoadMesh, self.usePlane, 
+                        tessellation = self.tessellationRoad, tolerance = self.toleranceRoad, 
+                        terrain = self.terrainRoad, clearance = self.clearanceRoad, preview = stride).roadBase
+        return None
+
+    def dropPreview(self, *args):
+        if cmds.objExists("envPreview"):
+            cmds.undoInfo(stateWithoutFlush = False)
+            cmds.delete("envPreview")
+            cmds.undoInfo(stateWithoutFlush = True)
+        cmds.button(self.commitPreviewButton, edit = True, enable = False)
+
+    # make the previewed stage at full quality
+    def commitPreview(self, *args):
+        self.dropPreview()
+        commit = {"terrain": self.CreateTerrain, "buildings": self.makeBuilding, "roads": self.makingRoad}
+        commit[self.previewStage]()
+
+    def profileMode(self, *args):
+        # check if the user wants the stages profiled
+        profiling = cmds.checkBox(self.profileCheck, query = True, value = True)
+        EnvProfile.profiler.active = profiling
+        EnvProfile.profiler.listener = self.showProfile if profiling else None
+        if profiling and self.profileCallback is None:
+            self.profileCallback = om.MDGMessage.addNodeAddedCallback(profileNodeAdded, "dependNode")
+        if not profiling and self.profileCallback is not None:
+            om.MMessage.removeCallback(self.profileCallback)
+            self.profileCallback = None
+        return profiling
+
+    def showProfile(self, *args):
+        cmds.scrollField(self.profileText, edit = True, text = EnvProfile.profiler.summary())
+
+    def saveProfile(self, *args):
+        path = cmds.fileDialog2(caption = "Save the profile report", fileMode = 0, 
+                                okCaption = "Save", fileFilter = "*.json")
+        if path:
+            EnvProfile.profiler.writeReport(path[0])
+            print "Profile report written to %s."%path[0]
+
+    def resetProfile(self, *args):
+        EnvProfile.profiler.reset()
+        self.showProfile()
+
+    # every stage item as it is now: meshes read back in bulk, copies and the sun from what the stages made
+    def exportCity(self, *args):
+        path = cmds.fileDialog2(caption = "Export the city", fileMode = 0, okCaption = "Export", 
+                                fileFilter = "glTF (*.gltf);;OBJ (*.obj)")
+        if not path:
+            return
+        city = EnvCity.CityModel()
+        for stage, item in self.graph.ordered():
+            made = self.graph.result(stage, item)
+            if made is None:
+                continue
+            if stage == "terrain":
+                city.meshes[made.nameTR] = sceneMesh(made.nameTR)
+            elif stage == "roads" and made.default == True:
+                city.meshes[made.roadBase] = sceneMesh(made.roadBase)
+            elif stage == "lighting":
+                city.suns[made.sun] = made.model
+            else:
+                city.placements[made.folderName] = made.model
+        # every copied source once, in its own space
+        sources = set(source for placements in city.placements.values() for source in placements.sources)
+        with generationMode(self.headless):
+            EnvExport.exportCity(path[0], city, dict((source, sceneMesh(source, world = False)) for source in sources))
+        print "City exported to %s."%path[0]
+
+    # the stages of the city, upstream first: terrain, roads, buildings and blocks, lighting and weather
+    # a change only rebuilds its own items, one per curve, and whatever was made from them
+    def cityGraph(self):
+        graph = EnvStages.StageGraph()
+        graph.addStage("terrain", self.buildTerrain, self.undoTerrainStage)
+        graph.addStage("roads", self.buildRoad, self.undoStage)
+        graph.addStage("buildings", self.buildBuilding, self.undoStage)
+        graph.addStage("blocks", self.buildBlocks, self.undoStage)
+        graph.addStage("lighting", self.buildLight, self.undoStage, 
+                        update = self.updateLight, updatable = ("intensity", "sunColor"))
+        return graph
+
+    # rebuilt items keep the names they were given the first time
+    def buildTerrain(self, item, params, old):
+        return Terrain(cache = self.stageCache(), name = old.nameTR if old else None, **params)
+
+    def buildRoad(self, item, params, old):
+        return Road(cache = self.stageCache(), name = getattr(old, "folderName", None), **params)
+
+    def buildBuilding(self, item, params, old):
+        return Building(cache = self.stageCache(), name = old.folderName if old else None, **params)
+
+    def buildBlocks(self, item, params, old):
+        return Blocks(name = old.folderName if old else None, **params)
+
+    def buildLight(self, item, params, old):
+        return Light(name = old.sun if old else None, **params)
+
+    def undoStage(self, item, result):
+        result.undo()
+
+    def undoTerrainStage(self, item, result):
+        # the height index of the old terrain goes with it
+        dropHeightIndex(getShapePath(result.terrain[0]).fullPathName())
+        result.UndoTerrain()
+
+    # intensity and colour are set on the sun, no need to make the light again
+    def updateLight(self, item, light, params, changed):
+        light.intensity = params["intensity"]
+        light.sunColor = params["sunColor"]
+        cmds.setAttr("%sShape.intensity"%light.sun, light.intensity)
+        cmds.setAttr("%sShape.color"%light.sun, light.sunColor[0], light.sunColor[1], light.sunColor[2])
+
+    # items standing on the terrain made in the terrain tab are rebuilt with it,
+    # and with the roads on it, which flatten and carve the ground they stand on
+    # a road only waits for the roads set before it, each road undoing to the ground the one before left
+    def terrainDependency(self, terrain, road = None):
+        made = self.graph.result("terrain", "terrain")
+        if terrain and made is not None and terrain in (made.nameTR, made.terrain[0]):
+            before = ("roads", road) if road else None
+            return [("terrain", "terrain")] + self.graph.users("roads", ("terrain", "terrain"), before)
+        return []
+
+    # what was already made on the ground a road changes waits for the road as well:
+    # the roads set after it on the same terrain and the buildings standing on that terrain
+    def roadDependents(self, road):
+        key = ("roads", road)
+        roads = self.graph.users("roads", ("terrain", "terrain"))
+        if key not in roads:
+            return
+        for other in roads[roads.index(key) + 1:] + self.graph.users("buildings", ("terrain", "terrain")):
+            self.graph.addDependency(other, key)
+
+    # bring every stage up to date
+    def runGraph(self):
+        with generationMode(self.headless):
+            rebuilt = self.graph.run()
+        # the texture buttons work on the items as they are now
+        self.terrainClass = self.graph.result("terrain", "terrain")
+        self.roadClass = self.graph.result("roads", getattr(self, "roadItem", None))
+        self.buildingClass = self.graph.result("buildings", getattr(self, "buildingItem", None))
+        self.blocksClass = self.graph.result("blocks", "blocks")
+        self.lightClass = self.graph.result("lighting", "sun")
+        print "%d stage items rebuilt: %s"%(len(rebuilt), ", ".join("%s %s"%key for key in rebuilt))
+        return rebuilt
+
     def importMesh(self, *args):
         # load mesh from user computer
         meshFilter = "*.obj ;; *.fbx ;; *.abc"
         userMesh = cmds.fileDialog2(caption = "Choose the items you want to import", 
                         fileMode = 4, okCaption = "Import", fileFilter = meshFilter)
+        if not userMesh:
+            return
+        # obj files are parsed once, in parallel, then made with one mesh create per object
+        objFiles = [mesh for mesh in userMesh if os.path.splitext(mesh)[1] == ".obj"]
+        if objFiles:
+            self.importAssets(objFiles)
         for mesh in userMesh:
             # get file extension format
             fileExtension = os.path.splitext(mesh)
-            # import obj
-            if fileExtension[1] == ".obj":
-                cmds.file(mesh, i = True, type = "OBJ", options = "mo=1", ignoreVersion = True, 
-                            renameAll = True, preserveReferences = True, importTimeRange = "combine")
             # import fbx
             if fileExtension[1] == ".fbx":
                 cmds.file(mesh, i = True, type = "FBX", options = "fbx", ignoreVersion = True, 
@@ -468,37 +1328,215 @@ class UI(object):
                 #cmds.AbcImport(mesh)
                 cmds.file(mesh, i = True, type = "Alembic", ignoreVersion = True, 
                             renameAll = True, preserveReferences = True, importTimeRange = "combine")
-            print "%s has imported."%mesh
+            if fileExtension[1] != ".obj":
+                print "%s has imported."%mesh
+
+    @EnvProfile.stage("asset import")
+    def importAssets(self, paths):
+        assets, cached = assetCache.load(paths)
+        with generationMode(self.headless):
+            for path, meshes in zip(paths, assets):
+                for name, mesh in meshes:
+                    mayaScene.writeMesh(name, mesh)
+                print "%s has imported."%path
+        print "%d of %d obj files read from the asset cache."%(cached, len(paths))
+
+    def convertInstances(self, *args):
+        # share the mesh of identical copies in the selected groups
+        for folder in cmds.ls(selection = True, type = "transform"):
+            converted, meshes, saved = convertToInstances(folder)
+            print "%s: %d copies now share %d meshes, about %.2f MB of mesh data saved."%(folder, converted, meshes, saved / 1048576.0)
     
 ######### 1. Terrain ###########
 
     # get parameters
     def getDim(self, *args):
         self.DimVal=cmds.intSliderGrp(self.PlaneDim,q=True,v=True)
+        self.previewChanged("terrain")
         return self.DimVal
     def getDiv(self, *args):
         self.DivVal=cmds.intSliderGrp(self.PlaneDiv,q=True,v=True)
+        self.previewChanged("terrain")
         return self.DivVal
     def getHei(self, *args):
         self.HeightVal=cmds.floatSliderGrp(self.MaxHeight,q=True,v=True)
+        self.previewChanged("terrain")
         return self.HeightVal
     def getDep(self, *args):    
         self.DepthVal=cmds.floatSliderGrp(self.MaxDepth,q=True,v=True)
+        self.previewChanged("terrain")
+    def getTerrainSeed(self, *args):
+        self.terrainSeed=cmds.intFieldGrp(self.TerrainSeed,q=True,v1=True)
+        self.previewChanged("terrain")
+        return self.terrainSeed
+    def newTerrainSeed(self, *args):
+        cmds.intFieldGrp(self.TerrainSeed,e=True,v1=EnvRandom.newSeed())
+        return self.getTerrainSeed()
+    def getNoise(self, *args):
+        self.noiseTiles=cmds.intSliderGrp(self.NoiseTiles,q=True,v=True)
+        self.noiseDivisions=cmds.intSliderGrp(self.NoiseDiv,q=True,v=True)
+        self.noiseSpacing=cmds.floatSliderGrp(self.NoiseSpacing,q=True,v=True)
+        self.noiseHeight=cmds.floatSliderGrp(self.NoiseHeight,q=True,v=True)
+        self.noiseFeature=cmds.floatSliderGrp(self.NoiseFeature,q=True,v=True)
+        self.noiseOctaves=cmds.intSliderGrp(self.NoiseOctaves,q=True,v=True)
+        self.noiseRidged=cmds.checkBox(self.NoiseRidged,q=True,v=True)
+        self.noiseWarp=cmds.floatSliderGrp(self.NoiseWarp,q=True,v=True)
+        self.noiseWorkers=cmds.intSliderGrp(self.NoiseWorkers,q=True,v=True)
         
     def CreateTerrain(self, *args):
-        # call class instances
-        self.terrainClass = Terrain(self.DimVal, 
-                                    self.DivVal, 
-                                    self.HeightVal, 
-                                    self.DepthVal)
+        # only a changed terrain is made again, together with everything standing on it
+        self.graph.set("terrain", "terrain", dict(DimVal = self.DimVal, 
+                                                  DivVal = self.DivVal, 
+                                                  HeightVal = self.HeightVal, 
+                                                  DepthVal = self.DepthVal,
+                                                  seed = self.terrainSeed))
+        self.runGraph()
         cmds.button(self.terrainU, edit=True, enable=True)
         cmds.button(self.terrainTexture, edit=True, enable=True)
         
+    def getLODTerrain(self, *args):
+        selected=cmds.ls(selection=True,objectsOnly=True)
+        self.lodTerrain=selected[0] if selected else None
+        cmds.textFieldButtonGrp(self.LODTerrain,e=True,tx=self.lodTerrain or "")
+        cmds.button(self.LODMake,e=True,enable=bool(self.lodTerrain))
+        cmds.select(cl=True)
+    def getLODCamera(self, *args):
+        selected=cmds.ls(selection=True,objectsOnly=True)
+        self.lodCamera=selected[0] if selected else "persp"
+        cmds.textFieldButtonGrp(self.LODCamera,e=True,tx=self.lodCamera)
+        cmds.select(cl=True)
+    def getLOD(self, *args):
+        self.lodLeaf=cmds.intSliderGrp(self.LODLeaf,q=True,v=True)
+        self.lodBudget=cmds.intSliderGrp(self.LODBudget,q=True,v=True)
+        self.lodDetail=cmds.floatSliderGrp(self.LODDetail,q=True,v=True)
+        self.lodFollow=cmds.checkBox(self.LODFollow,q=True,v=True)
+        
+    def getMapFile(self, *args):
+        chosen=cmds.fileDialog2(caption="Choose a heightmap",fileMode=1,okCaption="Choose",
+                                fileFilter="Heightmaps (*.r16 *.raw *.r32 *.tif *.tiff)")
+        if chosen:
+            self.mapPath=chosen[0]
+            cmds.textFieldButtonGrp(self.MapFile,e=True,tx=self.mapPath)
+            cmds.button(self.MapImport,e=True,enable=True)
+    def getMap(self, *args):
+        self.mapWidth=cmds.intFieldGrp(self.MapWidth,q=True,v1=True)
+        self.mapSpacing=cmds.floatSliderGrp(self.MapSpacing,q=True,v=True)
+        self.mapScale=cmds.floatSliderGrp(self.MapScale,q=True,v=True)
+        self.mapStep=cmds.intSliderGrp(self.MapStep,q=True,v=True)
+        self.mapDivisions=cmds.intSliderGrp(self.MapDiv,q=True,v=True)
+        
+    def CreateMapTerrain(self, *args):
+        with generationMode(self.headless):
+            self.mapTerrainClass = HeightmapTerrain(self.mapPath,
+                                                    self.mapWidth,
+                                                    self.mapSpacing,
+                                                    self.mapScale,
+                                                    self.mapStep,
+                                                    self.mapDivisions)
+        cmds.button(self.MapU, edit=True, enable=True)
+        
+    def UndoMapTerrain(self, *args):
+        cmds.button(self.MapU, edit=True, enable=False)
+        self.mapTerrainClass.UndoTerrain()
+        
+    def exportHeightmap(self, *args):
+        selected = cmds.ls(selection = True, objectsOnly = True)
+        if not selected:
+            cmds.error("Select a polyPlane terrain to export.")
+        index = terrainHeightIndex(selected[0])
+        if not isinstance(index, EnvHeightfield.HeightGrid):
+            cmds.error("%s is not a polyPlane terrain."%selected[0])
+        chosen = cmds.fileDialog2(caption = "Export heightmap", fileMode = 0, okCaption = "Export",
+                                    fileFilter = "Float TIFF (*.tif);;16 bit RAW (*.r16);;32 bit RAW (*.r32)")
+        if not chosen:
+            return
+        # rows along +z and columns along +x, the way heightmaps are imported
+        grid = index.points
+        if grid[-1, 0, 2] < grid[0, 0, 2]:
+            grid = grid[::-1]
+        if grid[0, -1, 0] < grid[0, 0, 0]:
+            grid = grid[:, ::-1]
+        low, high = EnvHeightmap.writeHeightmap(chosen[0], grid[:, :, 1])
+        print "%s written, %d x %d samples, heights %.3f to %.3f."%(chosen[0], grid.shape[1], grid.shape[0], low, high)
+        
+    def getErodeTerrain(self, *args):
+        selected=cmds.ls(selection=True,objectsOnly=True)
+        self.erodeTerrain=selected[0] if selected else None
+        cmds.textFieldButtonGrp(self.ErodeTerrain,e=True,tx=self.erodeTerrain or "")
+        cmds.button(self.ErodeMake,e=True,enable=bool(self.erodeTerrain))
+        cmds.select(cl=True)
+    def getErosion(self, *args):
+        self.erodeIterations=cmds.intSliderGrp(self.ErodeIterations,q=True,v=True)
+        self.erodeBudget=cmds.floatSliderGrp(self.ErodeBudget,q=True,v=True)
+        self.erodeTalus=cmds.floatSliderGrp(self.ErodeTalus,q=True,v=True)
+        self.erodeThermal=cmds.floatSliderGrp(self.ErodeThermal,q=True,v=True)
+        self.erodeRain=cmds.floatSliderGrp(self.ErodeRain,q=True,v=True)
+        self.erodeCapacity=cmds.floatSliderGrp(self.ErodeCapacity,q=True,v=True)
+        self.erodeStrength=cmds.floatSliderGrp(self.ErodeStrength,q=True,v=True)
+        self.erodeWorkers=cmds.intSliderGrp(self.ErodeWorkers,q=True,v=True)
+        
+    def CreateErosion(self, *args):
+        with generationMode(self.headless):
+            self.erosionClass = Erosion(self.erodeTerrain,
+                                        self.erodeIterations,
+                                        self.erodeBudget,
+                                        self.erodeTalus,
+                                        self.erodeThermal,
+                                        self.erodeRain,
+                                        self.erodeCapacity,
+                                        self.erodeStrength,
+                                        self.erodeWorkers)
+        cmds.button(self.ErodeU, edit=True, enable=True)
+        
+    def UndoErosion(self, *args):
+        cmds.button(self.ErodeU, edit=True, enable=False)
+        self.erosionClass.undo()
+        
+    def CreateLOD(self, *args):
+        with generationMode(self.headless):
+            self.lodClass = TerrainLOD(self.lodTerrain,
+                                       self.lodCamera,
+                                       self.lodLeaf,
+                                       self.lodBudget,
+                                       self.lodDetail,
+                                       self.lodFollow)
+        cmds.button(self.LODMake, edit=True, enable=False)
+        cmds.button(self.LODUpdate, edit=True, enable=True)
+        cmds.button(self.LODU, edit=True, enable=True)
+        
+    def UpdateLOD(self, *args):
+        self.lodClass.update()
+        
+    def UndoLOD(self, *args):
+        cmds.button(self.LODMake, edit=True, enable=True)
+        cmds.button(self.LODUpdate, edit=True, enable=False)
+        cmds.button(self.LODU, edit=True, enable=False)
+        self.lodClass.undo()
+        
+    def CreateNoiseTerrain(self, *args):
+        with generationMode(self.headless):
+            self.noiseTerrainClass = TiledTerrain(self.noiseTiles,
+                                                  self.noiseDivisions,
+                                                  self.noiseSpacing,
+                                                  self.noiseHeight,
+                                                  self.noiseFeature,
+                                                  self.noiseOctaves,
+                                                  self.noiseRidged,
+                                                  self.noiseWarp,
+                                                  self.noiseWorkers,
+                                                  self.terrainSeed)
+        cmds.button(self.noiseU, edit=True, enable=True)
+        
+    def UndoNoiseTerrain(self, *args):
+        cmds.button(self.noiseU, edit=True, enable=False)
+        self.noiseTerrainClass.UndoTerrain()
+        
     def UndoTerrain(self, *args):
         cmds.button(self.terrainU, edit=True, enable=False)
         cmds.button(self.terrainTexture, edit=True, enable=False)
         cmds.button(self.undoTerrainTexture, edit=True, enable=False)
-        self.terrainClass.UndoTerrain()
+        # whatever stands on the terrain is taken down with it until it is made again
+        self.graph.remove("terrain", "terrain")
         
     def importTerrainImage(self, *args):
         # call function in terrain class
@@ -535,6 +1573,7 @@ class UI(object):
         if self.populateBuilding:
             self.buildingCondition = True
         self.buildingPopulateCondition()
+        self.blockFillCondition()
         return self.populateBuilding
 
     def selectBuildingCRV(self, *args):
@@ -558,14 +1597,17 @@ class UI(object):
     # change commands (get user inputs of: copies, position offset, rotation, random size)
     def buildingCP(self, *args):
         self.copiesBuilding = cmds.intSliderGrp(self.copyBuilding, query = True, value = True)
+        self.previewChanged("buildings")
         return self.copiesBuilding
     
     def buildingPO(self, *args):
         self.offsetValBuilding = cmds.intSliderGrp(self.offsetBuilding, query = True, value = True)
+        self.previewChanged("buildings")
         return self.offsetValBuilding
     
     def buildingRR(self, *args):
         self.randRotateBuilding = cmds.intSliderGrp(self.rotationBuilding, query = True, value = True)
+        self.previewChanged("buildings")
         return self.randRotateBuilding
     
     def buildingCR(self, *args):
@@ -575,29 +1617,111 @@ class UI(object):
             cmds.intSliderGrp(self.rotationBuilding, edit = True, enable = False)
         if self.rotAlongCRVBuilding == False:
             cmds.intSliderGrp(self.rotationBuilding, edit = True, enable = True)
+        self.previewChanged("buildings")
         return self.rotAlongCRVBuilding
     
     def buildingRS(self, *args):
         self.randScaleBuilding = cmds.floatSliderGrp(self.sizeBuilding, query = True, value = True)
+        self.previewChanged("buildings")
         return self.randScaleBuilding
+    
+    def buildingSD(self, *args):
+        self.buildingSeed = cmds.intFieldGrp(self.seedBuilding, query = True, value1 = True)
+        self.previewChanged("buildings")
+        return self.buildingSeed
+    
+    def newBuildingSeed(self, *args):
+        cmds.intFieldGrp(self.seedBuilding, edit = True, value1 = EnvRandom.newSeed())
+        return self.buildingSD()
+    
+    def buildingOL(self, *args):
+        self.overlapBuilding = cmds.radioButtonGrp(self.overlapCheck, query = True, select = True)
+        self.previewChanged("buildings")
+        return self.overlapBuilding
+    
+    def buildingSP(self, *args):
+        self.spacingBuilding = cmds.floatSliderGrp(self.spacing, query = True, value = True)
+        self.previewChanged("buildings")
+        return self.spacingBuilding
+    
+    def selectBuildingTerrain(self, *args):
+        # the terrain the buildings stand on, nothing selected turns snapping off
+        selected = cmds.ls(selection = True, objectsOnly = True)
+        self.terrainBuilding = selected[0] if selected else None
+        cmds.textFieldButtonGrp(self.snapTerrain, edit = True, text = self.terrainBuilding or "")
+        cmds.select(cl = True)
+        return self.terrainBuilding
+    
+    def buildingM(self, *args):
+        self.buildingMode = cmds.radioButtonGrp(self.modeBuilding, query = True, select = True)
+        return self.buildingMode
         
     #call building class functions
     def makeBuilding(self, *args):
-        # call building class instance
-        self.buildingClass = Building(  self.copiesBuilding, 
-                                        self.offsetValBuilding, 
-                                        self.randRotateBuilding,
-                                        self.rotAlongCRVBuilding, 
-                                        self.randScaleBuilding,
-                                        self.populateBuilding,
-                                        self.populateBuildingCRV[0])
+        # one item per curve, made again only when its settings or its curve changed
+        self.buildingItem = self.populateBuildingCRV[0]
+        self.graph.set("buildings", self.buildingItem, 
+                        dict(   copies = self.copiesBuilding, 
+                                offset = self.offsetValBuilding, 
+                                randRotate = self.randRotateBuilding,
+                                curveRotate = self.rotAlongCRVBuilding, 
+                                randScale = self.randScaleBuilding,
+                                building = list(self.populateBuilding),
+                                curves = self.buildingItem,
+                                mode = self.buildingMode,
+                                overlap = self.overlapBuilding,
+                                spacing = self.spacingBuilding,
+                                seed = self.buildingSeed,
+                                terrain = self.terrainBuilding), 
+                        after = self.terrainDependency(self.terrainBuilding), 
+                        watch = dict(curve = getCurveSampler(self.buildingItem).key))
+        self.runGraph()
         # enable "undo" button
         cmds.button(self.undoBuilding, edit = True, enable = True)
     
     def deleteBuilding(self, *args):
         # call undo function from class Building
         cmds.button(self.undoBuilding, edit = True, enable = False)
-        self.buildingClass.undo()
+        self.graph.remove("buildings", self.buildingItem)
+    
+    # city blocks
+    def selectBlockCRVs(self, *args):
+        # all the road curves that close the blocks
+        self.blockCurves = cmds.ls(selection = True, objectsOnly = True)
+        cmds.textFieldButtonGrp(self.selectedBlockCurves, edit = True, text = "%d curves"%len(self.blockCurves))
+        cmds.select(cl = True)
+        self.blockFillCondition()
+        return self.blockCurves
+    
+    def blockFillCondition(self, *args):
+        # check if both buildings and road curves selected, then enable "fill blocks" button
+        if (self.buildingCondition == True) and self.blockCurves:
+            cmds.button(self.fillBlocks, edit = True, enable = True)
+    
+    def blockP(self, *args):
+        self.blockRoadWidth = cmds.floatSliderGrp(self.blockWidth, query = True, value = True)
+        self.blockLotArea = cmds.floatSliderGrp(self.blockArea, query = True, value = True)
+        self.blockLotWidth = cmds.floatSliderGrp(self.blockLot, query = True, value = True)
+        self.blockFill = cmds.floatSliderGrp(self.blockFillRatio, query = True, value = True)
+    
+    def makeBlocks(self, *args):
+        # the blocks are made again when a setting or any of their curves changed
+        self.graph.set("blocks", "blocks", 
+                        dict(   curves = list(self.blockCurves),
+                                building = list(self.populateBuilding),
+                                roadWidth = self.blockRoadWidth,
+                                lotArea = self.blockLotArea,
+                                lotWidth = self.blockLotWidth,
+                                fill = self.blockFill,
+                                mode = self.buildingMode,
+                                seed = self.buildingSeed), 
+                        watch = dict(curves = [getCurveSampler(crv).key for crv in self.blockCurves]))
+        self.runGraph()
+        cmds.button(self.undoBlocks, edit = True, enable = True)
+    
+    def deleteBlocks(self, *args):
+        cmds.button(self.undoBlocks, edit = True, enable = False)
+        self.graph.remove("blocks", "blocks")
 
 
 
@@ -622,30 +1746,79 @@ class UI(object):
     # change commands
     def roadW(self, *args):
         self.widthValRoad = cmds.floatSliderGrp(self.widthRoad, query = True, value = True)
+        self.previewChanged("roads")
         return self.widthValRoad
 
     def roadD(self, *args):
         self.divValRoad = cmds.intSliderGrp(self.divisionRoad, query = True, value = True)
+        self.previewChanged("roads")
         return self.divValRoad
 
+    def roadT(self, *args):
+        self.tessellationRoad = cmds.radioButtonGrp(self.tessellateRoad, query = True, select = True)
+        # the division only matters for fixed tessellation, the tolerance only for adaptive
+        cmds.intSliderGrp(self.divisionRoad, edit = True, enable = self.tessellationRoad == 1)
+        cmds.floatSliderGrp(self.toleranceValue, edit = True, enable = self.tessellationRoad == 2)
+        self.previewChanged("roads")
+        return self.tessellationRoad
+
+    def roadTol(self, *args):
+        self.toleranceRoad = cmds.floatSliderGrp(self.toleranceValue, query = True, value = True)
+        self.previewChanged("roads")
+        return self.toleranceRoad
+
+    def selectRoadTerrain(self, *args):
+        # the terrain the road lies on, nothing selected turns conforming off
+        selected = cmds.ls(selection = True, objectsOnly = True)
+        self.terrainRoad = selected[0] if selected else None
+        cmds.textFieldButtonGrp(self.conformTerrain, edit = True, text = self.terrainRoad or "")
+        cmds.select(cl = True)
+        return self.terrainRoad
+
+    def roadCl(self, *args):
+        self.clearanceRoad = cmds.floatSliderGrp(self.clearance, query = True, value = True)
+        self.previewChanged("roads")
+        return self.clearanceRoad
+
+    def roadFl(self, *args):
+        self.flattenValRoad = cmds.checkBox(self.flattenTerrain, query = True, value = True)
+        return self.flattenValRoad
+
+    def roadSh(self, *args):
+        self.shoulderRoad = cmds.floatSliderGrp(self.shoulder, query = True, value = True)
+        return self.shoulderRoad
+
     def roadH(self, *args):
         self.heightValRoad = cmds.floatSliderGrp(self.heightRoad, query = True, value = True)
+        self.previewChanged("roads")
         return self.heightValRoad
 
     def roadR(self, *args):
         self.riverValRoad = cmds.checkBox(self.river, query = True, value = True)
+        cmds.floatSliderGrp(self.riverDepth, edit = True, enable = self.riverValRoad)
+        cmds.floatSliderGrp(self.riverBank, edit = True, enable = self.riverValRoad)
         return self.riverValRoad
+
+    def riverD(self, *args):
+        self.depthRiver = cmds.floatSliderGrp(self.riverDepth, query = True, value = True)
+        return self.depthRiver
+
+    def riverB(self, *args):
+        self.bankRiver = cmds.floatSliderGrp(self.riverBank, query = True, value = True)
+        return self.bankRiver
     
     def default(self, *args):
         self.usePlane = cmds.checkBox(self.defaultRoad, query = True, value = True)
         if self.usePlane == False:
             cmds.button(self.importRoad, edit = True, enable = True)
             cmds.intSliderGrp(self.copyRoad, edit = True, enable = True)
+            cmds.radioButtonGrp(self.modeRoad, edit = True, enable = True)
             cmds.textFieldButtonGrp(self.userRoad, edit =True, enable =True)
             cmds.frameLayout("roadParam", edit = True, enable = False)
         if self.usePlane == True:
             cmds.button(self.importRoad, edit = True, enable = False)
             cmds.intSliderGrp(self.copyRoad, edit = True, enable = False)            
+            cmds.radioButtonGrp(self.modeRoad, edit = True, enable = False)
             cmds.textFieldButtonGrp(self.userRoad, edit =True, enable =False)
             cmds.frameLayout("roadParam", edit = True, enable = True)
         return self.usePlane
@@ -654,17 +1827,36 @@ class UI(object):
         self.userRoadCopy = cmds.intSliderGrp(self.copyRoad, query = True, value = True)
         return self.userRoadCopy
     
+    def roadM(self, *args):
+        self.roadMode = cmds.radioButtonGrp(self.modeRoad, query = True, select = True)
+        return self.roadMode
+    
     # calling road class instance
     def makingRoad(self, *args):
-        # make instance
-        self.roadClass = Road(  self.widthValRoad,
-                                self.divValRoad,
-                                self.heightValRoad,
-                                self.riverValRoad,
-                                self.userRoadCopy,
-                                self.populateRoadCRV[0],
-                                self.populateRoadMesh,
-                                self.usePlane)
+        # one item per curve, made again only when its settings, its curve or its terrain changed
+        self.roadItem = self.populateRoadCRV[0]
+        self.graph.set("roads", self.roadItem, 
+                        dict(   width = self.widthValRoad,
+                                div = self.divValRoad,
+                                height = self.heightValRoad,
+                                river = self.riverValRoad,
+                                copy = self.userRoadCopy,
+                                curves = self.roadItem,
+                                userRoad = self.populateRoadMesh,
+                                default = self.usePlane,
+                                mode = self.roadMode,
+                                tessellation = self.tessellationRoad,
+                                tolerance = self.toleranceRoad,
+                                terrain = self.terrainRoad,
+                                clearance = self.clearanceRoad,
+                                flatten = self.flattenValRoad,
+                                shoulder = self.shoulderRoad,
+                                riverDepth = self.depthRiver,
+                                riverBank = self.bankRiver), 
+                        after = self.terrainDependency(self.terrainRoad, self.roadItem), 
+                        watch = dict(curve = getCurveSampler(self.roadItem).key))
+        self.roadDependents(self.roadItem)
+        self.runGraph()
         # enable buttons
         cmds.button(self.undoRoad, edit = True, enable = True)
         if self.usePlane == True:
@@ -674,8 +1866,11 @@ class UI(object):
         # disable buttons
         cmds.button(self.undoRoad, edit = True, enable = False)
         cmds.button(self.roadTexture, edit = True, enable = False)
-        # call function in road class
-        self.roadClass.undo()
+        # take the road down, the terrain gets its ground back
+        # and the roads and buildings made on the ground it changed are made again without it
+        self.graph.remove("roads", self.roadItem)
+        self.graph.dropDependency("roads", self.roadItem)
+        self.runGraph()
         
     def importRoadImage(self, *args):
         # call function in road class
@@ -688,6 +1883,30 @@ class UI(object):
         cmds.button(self.undoRoadTexture, edit = True, enable = False)
         # call function in road class
         self.roadClass.undoTexture()
+    
+    # road network
+    def selectNetworkCRVs(self, *args):
+        # all the curves that make the network
+        self.networkCurves = cmds.ls(selection = True, objectsOnly = True)
+        cmds.textFieldButtonGrp(self.selectedNetworkCurves, edit = True, text = "%d curves"%len(self.networkCurves))
+        cmds.select(cl = True)
+        if self.networkCurves:
+            cmds.button(self.makeNetwork, edit = True, enable = True)
+        return self.networkCurves
+    
+    def makingNetwork(self, *args):
+        # call road network class instance
+        with generationMode(self.headless):
+            self.networkClass = RoadNetwork(self.networkCurves, 
+                                            self.widthValRoad, 
+                                            self.heightValRoad,
+                                            self.tessellationRoad,
+                                            self.toleranceRoad)
+        cmds.button(self.undoNetwork, edit = True, enable = True)
+    
+    def deleteNetwork(self, *args):
+        cmds.button(self.undoNetwork, edit = True, enable = False)
+        self.networkClass.undo()
         
 ############### 4. Light #################
     
@@ -751,24 +1970,26 @@ class UI(object):
                 pass
         
     def makingLight(self, *args):
-        # call light class instance
-        self.lightClass = Light( self.userNorth,
-                                 self.userTime,
-                                 self.userWeather,
-                                 self.dynamicScene,
-                                 self.userFrameStart,
-                                 self.userFrameEnd,
-                                 self.userTimeStart,
-                                 self.userTimeEnd,
-                                 self.changeIntensity,
-                                 self.userLightColor,
-                                 self.userWeatherTerrain)
-        # edit buttons enable/disable
-        cmds.button(self.createLight, edit =True, enable = False)
+        # a new intensity or colour is set on the sun, anything else makes the light again
+        self.graph.set("lighting", "sun", 
+                        dict(   north = self.userNorth,
+                                time = self.userTime,
+                                weather = self.userWeather,
+                                dynamic = self.dynamicScene,
+                                frameStart = self.userFrameStart,
+                                frameEnd = self.userFrameEnd,
+                                timeStart = self.userTimeStart,
+                                timeEnd = self.userTimeEnd,
+                                intensity = self.changeIntensity,
+                                sunColor = tuple(self.userLightColor),
+                                terrain = self.userWeatherTerrain), 
+                        after = self.terrainDependency(self.userWeatherTerrain))
+        self.runGraph()
+        # edit buttons enable/disable, create stays on to apply changed settings
         cmds.button(self.undoLight, edit =True, enable = True)
     
     def deleteLight(self, *args):
-        self.lightClass.undo()
+        self.graph.remove("lighting", "sun")
         # edit buttons enable/disable
         cmds.button(self.createLight, edit =True, enable = True)
         cmds.button(self.undoLight, edit =True, enable = False)
@@ -787,50 +2008,52 @@ class UI(object):
 ############################################
 
 ###################################### TERRAIN
-class Terrain(UI):
-    def __init__(self, DimVal, DivVal, HeightVal, DepthVal):
+class Terrain(object):
+    def __init__(self, DimVal, DivVal, HeightVal, DepthVal, seed = 1, cache = None, name = None, preview = 0):
         # receiving output from UI class
         self.DimVal=DimVal
         self.DivVal=DivVal
         self.HeightVal=HeightVal
         self.DepthVal=DepthVal
-        # execution of creation
-        self.CreateTerrain()
+        self.seed=seed
+        self.cache=cache
+        self.name=name
+        # execution of creation, or a preview keeping every nth vertex
+        if preview:
+            self.previewTerrain(preview)
+        else:
+            self.CreateTerrain()
     
+    @EnvProfile.stage("terrain")
     def CreateTerrain(self, *args):
-        cmds.promptDialog(title = "Name your terrain", 
-                            message = "Please name the terrain: ", 
-                            text = "terrain", button = "Create")
-        self.nameTR = cmds.promptDialog(query =  True, text = True)
+        self.nameTR = askName("Name your terrain", "Please name the terrain: ", "terrain", self.name)
         self.terrain=cmds.polyPlane(n=self.nameTR,w=self.DimVal,h=self.DimVal,sw=self.DivVal,sh=self.DivVal)
-        #select vertex
-        SelectedObject=cmds.ls(selection=True)
-        AllVerts=cmds.ls(SelectedObject[0]+".vtx[*]",flatten=True)
-        cmds.select(AllVerts)
-        #soft select
-        cmds.softSelect(sse=1,ssd=5.0,ssc='0,1,2,1,0,2',ssf=2)
-        #morphing
-        for i in range(0,len(AllVerts),5):
-            cmds.select(cl=True)
-            singleVert=AllVerts[i]
-            cmds.select(singleVert)
-            
-            RandX=rand(-1.0,1.0)
-            RandY=rand(self.DepthVal,self.HeightVal)
-            RandZ=rand(-1.0,1.0)
-            cmds.move(RandX,RandY,RandZ,r=True)
-            
-            #time.sleep(0.001)
-            cmds.NextFrame()
-        cmds.softSelect(sse=0)
+        #same settings, same terrain: reuse the points from the cache
+        key=EnvCache.stageKey("terrain",self.DimVal,self.DivVal,self.HeightVal,self.DepthVal,self.seed)
+        stored=self.cache.load(key) if self.cache else None
+        if stored is not None:
+            points=stored["points"]
+        else:
+            #morphing: soft select moves of every 5th vertex, computed for all vertices at once
+            points=EnvCity.terrainPoints(self.DimVal,self.DivVal,self.HeightVal,self.DepthVal,self.seed,
+                                         base=getMeshPoints(self.terrain[0]))
+            if self.cache:
+                self.cache.save(key,points=points)
+        #write the whole grid back in one update
+        setMeshPoints(self.terrain[0],points)
         cmds.select(cl=True)
-        #go to first frame
-        cmds.currentTime(1)
+        
+    # the same morph as the terrain on every stride-th row and column, made as one mesh
+    def previewTerrain(self, stride):
+        mesh=EnvCity.terrainMesh(self.DimVal,self.DivVal,self.HeightVal,self.DepthVal,self.seed,stride)
+        self.nameTR=mayaScene.writeMesh("terrainPreview",mesh)
+        self.terrain=[self.nameTR]
         
     def UndoTerrain(self, *args):
         cmds.select(self.nameTR, replace=True)
         cmds.delete()
         
+    @EnvProfile.stage("terrain shader")
     def terrainShader(self, *args):
         # create a shader for road
         shaderBlinn = cmds.shadingNode("blinn", asShader = True, name = "terrainShaderBlinn")
@@ -867,9 +2090,195 @@ class Terrain(UI):
         cmds.delete()
     
         
+###################################### NOISE TERRAIN
+class TiledTerrain(object):
+    def __init__(self, tiles, divisions, spacing, height, featureSize, octaves, ridged, warp, workers, seed = 1):
+        # receiving output from UI class
+        self.tiles = tiles
+        self.divisions = divisions
+        self.spacing = spacing
+        self.height = height
+        self.featureSize = featureSize
+        self.octaves = octaves
+        self.ridged = ridged
+        self.warp = warp
+        self.workers = workers
+        self.seed = seed
+        # execution of creation
+        self.CreateTerrain()
+    
+    @EnvProfile.stage("noise terrain")
+    def CreateTerrain(self, *args):
+        cmds.promptDialog(title = "Name your terrain", 
+                            message = "Please name the terrain: ", 
+                            text = "noiseTerrain", button = "Create")
+        self.nameTR = cmds.promptDialog(query =  True, text = True)
+        self.terrain = cmds.group(empty = True, name = self.nameTR)
+        noise = EnvNoise.NoiseTerrain(self.seed, self.divisions, self.spacing, self.height, self.featureSize,
+                                      self.octaves, self.ridged, self.warp)
+        # whole terrain centred on the origin
+        tileSize = self.divisions * self.spacing
+        start = -self.tiles * tileSize * 0.5
+        keys = [(row, col) for row in range(self.tiles) for col in range(self.tiles)]
+        # tiles are computed in the workers and made into meshes here as each one arrives
+        for row, col, heights in noise.tiles(keys, self.workers):
+            points, faceCounts, faceConnects = EnvHeightfield.gridMesh(heights, (start + col * tileSize, 
+                                                                        start + row * tileSize), self.spacing)
+            tile = createMesh("%s_%d_%d"%(self.nameTR, row, col), points, faceCounts, faceConnects)
+            cmds.parent(tile, self.terrain)
+        print "%d terrain tiles of %d x %d made."%(len(keys), self.divisions, self.divisions)
+        cmds.select(cl = True)
+        
+    def UndoTerrain(self, *args):
+        cmds.delete(self.terrain)
+
+
+###################################### HEIGHTMAP TERRAIN
+class HeightmapTerrain(object):
+    def __init__(self, path, width, spacing, scale, step, divisions):
+        # receiving output from UI class
+        self.path = path
+        self.width = width
+        self.spacing = spacing
+        self.scale = scale
+        self.step = step
+        self.divisions = divisions
+        # execution of creation
+        self.CreateTerrain()
+    
+    @EnvProfile.stage("heightmap terrain")
+    def CreateTerrain(self, *args):
+        heightmap = EnvHeightmap.openHeightmap(self.path, self.width)
+        # integer samples run from 0 to the height scale
+        scale = self.scale
+        if np.issubdtype(heightmap.dtype, np.integer):
+            scale = self.scale / np.iinfo(heightmap.dtype).max
+        self.nameTR = os.path.splitext(os.path.basename(self.path))[0]
+        self.terrain = cmds.group(empty = True, name = self.nameTR)
+        # whole terrain centred on the origin
+        cellSize = self.spacing * self.step
+        tileSize = self.divisions * cellSize
+        startX = -((heightmap.shape[1] - 1) // self.step) * cellSize * 0.5
+        startZ = -((heightmap.shape[0] - 1) // self.step) * cellSize * 0.5
+        tiles = 0
+        # only the samples of one tile are read from the file at a time
+        for row, col, heights in EnvHeightmap.heightTiles(heightmap, self.divisions, self.step):
+            points, faceCounts, faceConnects = EnvHeightfield.gridMesh(heights * scale, (startX + col * tileSize, 
+                                                                        startZ + row * tileSize), cellSize)
+            tile = createMesh("%s_%d_%d"%(self.nameTR, row, col), points, faceCounts, faceConnects)
+            cmds.parent(tile, self.terrain)
+            tiles += 1
+        print "%s: %d x %d samples made into %d tiles."%(self.path, heightmap.shape[1], heightmap.shape[0], tiles)
+        cmds.select(cl = True)
+        
+    def UndoTerrain(self, *args):
+        cmds.delete(self.terrain)
+
+
+###################################### TERRAIN EROSION
+class Erosion(object):
+    def __init__(self, terrain, iterations, timeBudget, talus, thermalRate, rain, capacity, strength, workers):
+        # receiving output from UI class
+        self.terrain = terrain
+        self.iterations = iterations
+        self.timeBudget = timeBudget
+        self.settings = EnvErosion.erosionSettings(talus, thermalRate, rain, capacity, strength, strength)
+        self.workers = workers
+        # execution of erosion
+        self.erodeTerrain()
+    
+    @EnvProfile.stage("erosion")
+    def erodeTerrain(self, *args):
+        index = terrainHeightIndex(self.terrain)
+        if not isinstance(index, EnvHeightfield.HeightGrid):
+            cmds.error("%s is not a polyPlane terrain."%self.terrain)
+        self.terrainPoints = index.points.reshape(-1, 3)
+        start = time.time()
+        heights, done = EnvErosion.erode(index.points[:, :, 1], index.spacing, self.iterations, 
+                                         self.timeBudget or None, self.settings, workers = self.workers)
+        # the whole grid written back in one update
+        erodedPoints = index.points.copy()
+        erodedPoints[:, :, 1] = heights
+        setMeshPoints(self.terrain, erodedPoints.reshape(-1, 3), world = True)
+        print "%d erosion iterations in %.2f s."%(done, time.time() - start)
+    
+    def undo(self, *args):
+        setMeshPoints(self.terrain, self.terrainPoints, world = True)
+
+
+###################################### TERRAIN LEVEL OF DETAIL
+class TerrainLOD(object):
+    def __init__(self, terrain, camera, leaf, budget, detail, follow):
+        # receiving output from UI class
+        self.terrain = terrain
+        self.camera = camera
+        self.leaf = leaf
+        self.budget = budget
+        self.detail = detail
+        self.follow = follow
+        self.job = None
+        # execution of creation
+        self.makeLOD()
+    
+    @EnvProfile.stage("terrain lod")
+    def makeLOD(self, *args):
+        index = terrainHeightIndex(self.terrain)
+        if not isinstance(index, EnvHeightfield.HeightGrid):
+            cmds.error("%s is not a polyPlane terrain."%self.terrain)
+        self.quadtree = EnvLOD.TerrainQuadtree(index.points, self.leaf)
+        self.folder = cmds.group(empty = True, name = "%sLOD"%self.terrain)
+        # tile meshes made so far, hidden rather than deleted when not needed, oldest first
+        self.tiles = OrderedDict()
+        self.shown = set()
+        cmds.setAttr("%s.visibility"%self.terrain, False)
+        self.update()
+        if self.follow:
+            # a camera shape is followed through its transform
+            transform = cmds.ls(self.camera, type = "transform") or cmds.listRelatives(self.camera, parent = True)
+            self.job = cmds.scriptJob(attributeChange = ["%s.translate"%transform[0], self.cameraMoved])
+    
+    def cameraPosition(self):
+        return np.array(cmds.xform(self.camera, query = True, translation = True, worldSpace = True))
+    
+    @EnvProfile.stage("terrain lod update")
+    def update(self, *args):
+        camera = self.cameraPosition()
+        keys = set(self.quadtree.select(camera, self.budget, self.detail))
+        for key in sorted(keys - set(self.tiles)):
+            points, faceCounts, faceConnects = self.quadtree.tileMesh(key)
+            tile = createMesh("%sLOD_%d_%d_%d"%((self.terrain,) + key), points, faceCounts, faceConnects)
+            self.tiles[key] = cmds.parent(tile, self.folder)[0]
+        # swapping is only showing and hiding
+        for key in self.shown - keys:
+            cmds.setAttr("%s.visibility"%self.tiles[key], False)
+        for key in keys:
+            cmds.setAttr("%s.visibility"%self.tiles[key], True)
+            self.tiles[key] = self.tiles.pop(key)
+        self.shown = keys
+        self.lastCamera = camera
+        # hidden tiles beyond as many as are shown are dropped, oldest first
+        hidden = [key for key in self.tiles if key not in keys]
+        for key in hidden[:max(len(hidden) - len(keys), 0)]:
+            cmds.delete(self.tiles.pop(key))
+        print "Terrain LOD: %d tiles, %d faces."%(len(keys), len(keys) * self.quadtree.tileFaces())
+    
+    def cameraMoved(self, *args):
+        # only worth looking again once the camera has moved half of a finest tile
+        if np.sqrt(((self.cameraPosition() - self.lastCamera) ** 2).sum()) < self.quadtree.finestTileSize() * 0.5:
+            return
+        self.update()
+    
+    def undo(self, *args):
+        if self.job is not None and cmds.scriptJob(exists = self.job):
+            cmds.scriptJob(kill = self.job, force = True)
+        cmds.delete(self.folder)
+        cmds.setAttr("%s.visibility"%self.terrain, True)
+
+
 ###################################### BUILDING
-class Building(UI):
-    def __init__(self, copies, offset, randRotate, curveRotate, randScale, building, curves):
+class Building(object):
+    def __init__(self, copies, offset, randRotate, curveRotate, randScale, building, curves, mode = 1, 
+                    overlap = 1, spacing = 0.0, seed = 1, terrain = None, cache = None, name = None, preview = 0):
         # receiving output from UI class
         self.copies = copies
         self.offset = offset
@@ -878,73 +2287,111 @@ class Building(UI):
         self.randScale = randScale
         self.building = building
         self.curves = curves
+        self.mode = mode
+        self.overlap = overlap
+        self.spacing = spacing
+        self.seed = seed
+        self.terrain = terrain
+        self.cache = cache
+        self.name = name
         
-        # determine the starting frame of the timeline
-        self.minFrame = cmds.playbackOptions(query = True, min = True)
-        
-        # executing populate function
-        self.populate()
+        # executing populate function, or proxy boxes of every nth copy for a preview
+        if preview:
+            self.previewBoxes(preview)
+        else:
+            self.populate()
         
     # populating the building blocks
+    @EnvProfile.stage("buildings")
     def populate(self, *args):    
-        folder = cmds.promptDialog(  title = "Name your folder", 
-                            message = "Please name the folder that holds all your building duplications: ", 
-                            text = "buildingGrp", button = "Create")
-        # create a dummy node to animate along the curve: anim -> constrain -> attach to motion path
-        cmds.spaceLocator(name = "bLoc")
-        # select the locator and curve
-        cmds.select(self.curves, add = True)
-        # create motion path
-        cmds.pathAnimation( fractionMode = True, follow = True, followAxis = "x", upAxis = "y",
-                            inverseFront = False, startTimeU = 0, endTimeU = self.copies)
-        # change motion to linear
-        cmds.selectKey("motionPath1_uValue")
-        cmds.keyTangent(inTangentType = "linear", outTangentType = "linear")
         # create empty folder to hold all buildings created later
-        self.folderName = cmds.promptDialog(query =  True, text = True)
-        parentFolder = cmds.group(empty = True, name = self.folderName)
-        # multiply the buildings
-        for obj in range(int(self.minFrame), int(self.minFrame) + self.copies):
-            # get attributes of the locator every frame
-            cmds.currentTime(obj, edit = True)
-            currentX = cmds.getAttr("bLoc.tx")
-            currentY = cmds.getAttr("bLoc.ty")
-            currentZ = cmds.getAttr("bLoc.tz")
-            currentRotY = cmds.getAttr('bLoc.ry')
-            
-            # select the building that chosen for population
-            cmds.select(random.choice(self.building), replace = True)
-            
-            # duplicate the building mesh and set the translation according to locator
-            tempObj = cmds.duplicate()
-            cmds.setAttr(tempObj[0] + ".tx", currentX)
-            cmds.setAttr(tempObj[0] + ".ty", currentY)
-            cmds.setAttr(tempObj[0] + ".tz", currentZ)
-            
-            # using the info from user to modify translation
-            newRotation = random.uniform(-self.randRotate, self.randRotate)
-            newOffsetX = random.uniform(0, self.offset)
-            newScale = random.uniform(1, self.randScale)
-            
-            # apply these modifications
-            # rotation: along curve / random
-            if self.curveRotate == True:
-                cmds.setAttr(tempObj[0] + ".ry", currentRotY)
-            else:
-                cmds.rotate(0, newRotation, 0, relative = True)
-            # translation
-            cmds.move(newOffsetX, 0, 0, relative = True)
-            # scale
-            if self.randScale > 0:
-                # makes sure the size randomness only happens when user change the parameter
-                cmds.scale(newScale, newScale, newScale, relative = True)
-            
-            # parent all buildings created to the folder
-            cmds.parent(tempObj[0], self.folderName, relative = False)  # let user name it
-        
-        # delete the dummy node
-        cmds.select("bLoc")
-        cmds.delete()    
+        self.folderName = askName("Name your folder", 
+                                    "Please name the folder that holds all your building duplications: ", 
+                                    "buildingGrp", self.name)
+        # same settings, curve, sources and ground: reuse the transforms from the cache
+        srcRotates, srcScales = sourceTransforms(self.building)
+        terrain = terrainHeightIndex(self.terrain).points if self.terrain else None
+        key = EnvCache.stageKey("building", self.copies, self.offset, self.randRotate, self.curveRotate, 
+                                self.randScale, self.overlap, self.spacing, self.seed, self.curves,
+                                getCurveSampler(self.curves).key, list(self.building), srcRotates, srcScales,
+                                sourceBounds(self.building), terrain)
+        stored = self.cache.load(key) if self.cache else None
+        if stored is not None:
+            placements = EnvCity.Placements(self.building, stored["sourceIndex"], stored["translates"], 
+                                            stored["rotates"], stored["scales"])
+        else:
+            placements = self.placements(srcRotates, srcScales)
+            if self.cache:
+                self.cache.save(key, sourceIndex = placements.sourceIndex, translates = placements.translates, 
+                                rotates = placements.rotates, scales = placements.scales)
+        
+        # multiply the buildings and parent them to the folder
+        self.model = placements
+        MayaBackend(self.mode).writePlacements(self.folderName, placements)
+    
+    def placements(self, srcRotates, srcScales, stride = 1):
+        # footprints are only needed to clear overlaps
+        bounds = sourceBounds(self.building) if self.overlap != EnvPlacement.OVERLAP_ALLOW else None
+        ground = terrainHeightIndex(self.terrain) if self.terrain else None
+        placements = EnvCity.curvePlacements(getCurveSampler(self.curves), self.curves, self.building, 
+                                             srcRotates, srcScales, bounds, self.copies, self.offset, 
+                                             self.randRotate, self.curveRotate == True, self.randScale, 
+                                             self.overlap, self.spacing, self.seed, ground, stride)
+        if placements.kept is not None:
+            print "%d of %d buildings kept without overlaps."%(placements.kept, len(range(0, self.copies, stride)))
+        if placements.snapped is not None:
+            print "%d of %d buildings snapped to %s."%(placements.snapped, len(placements), self.terrain)
+        return placements
+    
+    # one mesh of boxes the size of the copies, far quicker to make than the copies
+    def previewBoxes(self, stride):
+        srcRotates, srcScales = sourceTransforms(self.building)
+        placements = self.placements(srcRotates, srcScales, stride)
+        self.folderName = None
+        if len(placements):
+            bounds = sourceBounds(self.building)[placements.sourceIndex]
+            points, faceCounts, faceConnects = EnvPreview.boxMesh(bounds, placements.translates, 
+                                                                  placements.rotates, placements.scales)
+            self.folderName = mayaScene.writeMesh("buildingPreview", EnvCity.Mesh(points, faceCounts, faceConnects))
+    
+    def undo(self, *args):
+        cmds.select(self.folderName)
+        cmds.delete()
+
+
+
+###################################### CITY BLOCKS
+class Blocks(object):
+    def __init__(self, curves, building, roadWidth, lotArea, lotWidth, fill, mode = 1, seed = 1, name = None):
+        # receiving output from UI class
+        self.curves = curves
+        self.building = building
+        self.roadWidth = roadWidth
+        self.lotArea = lotArea
+        self.lotWidth = lotWidth
+        self.fill = fill
+        self.mode = mode
+        self.seed = seed
+        self.name = name
+        
+        # executing block filling
+        self.fillBlocks()
+    
+    @EnvProfile.stage("blocks")
+    def fillBlocks(self, *args):
+        self.folderName = askName("Name your folder", 
+                                    "Please name the folder that holds all your block buildings: ", 
+                                    "blockGrp", self.name)
+        # every road curve as points, then the lots of all the blocks between them
+        polylines = [getCurveSampler(crv).polyline(self.lotWidth * 0.5) for crv in self.curves]
+        srcRotates, srcScales = sourceTransforms(self.building)
+        placements = EnvCity.blockPlacements(polylines, self.building, srcRotates, srcScales, 
+                                             sourceBounds(self.building), self.roadWidth, self.lotArea, 
+                                             self.lotWidth, self.fill, self.seed)
+        print "%d lots found between %d road curves."%(len(placements), len(self.curves))
+        # one random building per lot, stretched to fill the lot
+        self.model = placements
+        MayaBackend(self.mode).writePlacements(self.folderName, placements)
     
     def undo(self, *args):
         cmds.select(self.folderName)
@@ -953,8 +2400,11 @@ class Building(UI):
 
 
 ########################################################## ROAD
-class Road(UI):
-    def __init__(self, width, div, height, river, copy, curves, userRoad, default):
+class Road(object):
+    def __init__(self, width, div, height, river, copy, curves, userRoad, default, mode = 1, 
+                    tessellation = 1, tolerance = 0.05, terrain = None, clearance = 0.05, 
+                    flatten = True, shoulder = 1.0, riverDepth = 1.0, riverBank = 2.0, cache = None, 
+                    name = None, preview = 0):
         # define variables
         self.width = width
         self.div = div
@@ -964,42 +2414,94 @@ class Road(UI):
         self.curves = curves
         self.userRoad = userRoad
         self.default = default
+        self.mode = mode
+        self.tessellation = tessellation
+        self.tolerance = tolerance
+        self.terrain = terrain
+        self.clearance = clearance
+        self.flatten = flatten
+        self.shoulder = shoulder
+        self.riverDepth = riverDepth
+        self.riverBank = riverBank
+        self.cache = cache
+        self.name = name
+        self.terrainPoints = None
 
         # check if user wants to use own model
-        if self.default == True:
-            # make road from scratch
-            self.makeDefaultRoad()
+        if preview:
+            self.previewRoad(preview)
+        elif self.default == True:
+            # height index of the terrain, read once and shared by the road and the flattening
+            self.heightIndex = terrainHeightIndex(self.terrain) if self.terrain else None
+            key = self.roadKey()
+            stored = self.cache.load(key) if self.cache else None
+            if stored is not None:
+                self.restoreRoad(stored)
+            else:
+                # make road from scratch
+                self.makeRoad()
+                if self.cache:
+                    self.storeRoad(key)
         else:
             # populate user road
             self.makeUserRoad()
         
-    def makeDefaultRoad(self, *args):
-        # create base plane
-        self.roadBase = cmds.polyPlane(n="roadBase", subdivisionsHeight = 1, subdivisionsWidth = 1, width = self.width)[0]
-        cmds.select(self.curves, add=True)
-        # create motion path
-        cmds.currentTime(0, edit = True)
-        cmds.pathAnimation( fractionMode = True, follow = True,
-                            followAxis = "z", upAxis = "y",
-                            inverseUp = False, inverseFront = False,
-                            startTimeU = 1, endTimeU = 2)
-        # extrude plane edge
-        theRoad = cmds.polyExtrudeEdge("%s.e[0]"%self.roadBase, inputCurve = self.curves, divisions = self.div)
-        cmds.select(self.roadBase, replace = True)    
-        cmds.DeleteMotionPaths()
-        # move road if user input height
-        if self.height > 0:
-            cmds.move(0, self.height, 0, relative = True)
-        # make river if user checked
-        if self.river:
-            self.flattenRoad()
+    def roadKey(self, *args):
+        # everything the finished road and the ground under it depend on
+        terrain = self.heightIndex.points if self.heightIndex is not None else None
+        return EnvCache.stageKey("road", self.width, self.div, self.height, self.river, self.tessellation, 
+                                 self.tolerance, self.clearance, self.flatten, self.shoulder, self.riverDepth, 
+                                 self.riverBank, getCurveSampler(self.curves).key, terrain)
+    
+    def storeRoad(self, key):
+        # the road as vertex and face buffers, and the terrain heights if the road changed them
+        faceCounts, faceConnects = getMeshFaces(self.roadBase)
+        arrays = dict(points = getMeshPoints(self.roadBase, world = True), 
+                      faceCounts = faceCounts, faceConnects = faceConnects)
+        if self.terrainPoints is not None:
+            arrays["terrainHeights"] = getMeshPoints(self.terrain, world = True)[:, 1]
+        self.cache.save(key, **arrays)
+    
+    @EnvProfile.stage("road from cache")
+    def restoreRoad(self, stored):
+        # one mesh create instead of building the road again
+        self.roadBase = mayaScene.writeMesh("roadBase", EnvCity.Mesh(stored["points"], stored["faceCounts"], 
+                                                                    stored["faceConnects"]))
+        if "terrainHeights" in stored:
+            self.changeTerrain(stored["terrainHeights"])
+        print "Road loaded from the cache."
+    
+    # new terrain heights in one write, the old ground kept for undo
+    def changeTerrain(self, heights):
+        self.terrainPoints = self.heightIndex.points.reshape(-1, 3)
+        changed = self.terrainPoints.copy()
+        changed[:, 1] = heights
+        setMeshPoints(self.terrain, changed, world = True)
+    
+    @EnvProfile.stage("road")
+    def makeRoad(self, *args):
+        # road and the ground under it worked out as arrays, then one mesh create and one terrain write
+        road, terrainHeights = EnvCity.roadModel(getCurveSampler(self.curves), self.width, self.div, self.height, 
+                                                 self.tessellation, self.tolerance, self.heightIndex, self.river, 
+                                                 self.clearance, self.flatten, self.shoulder, self.riverDepth, 
+                                                 self.riverBank)
+        self.roadBase = mayaScene.writeMesh("roadBase", road)
+        if self.tessellation == 2:
+            print "Adaptive road: %d faces, fixed division gives %d."%(len(road.faceCounts), self.div)
+        if terrainHeights is not None:
+            self.changeTerrain(terrainHeights)
+            if self.river:
+                print "River carved %d terrain vertices."%(terrainHeights < self.terrainPoints[:, 1]).sum()
             
-    def flattenRoad(self, *args):
-        # make the road flat
-        cmds.select(self.roadBase, replace = True)
-        cmds.ConvertSelectionToVertices()
-        cmds.scale(1,0,1, relative = True)        
+    # quick strip of every nth division lying on the terrain, the ground left as it is
+    def previewRoad(self, stride):
+        ground = terrainHeightIndex(self.terrain) if self.terrain else None
+        road, terrainHeights = EnvCity.roadModel(getCurveSampler(self.curves), self.width, max(self.div // stride, 1), 
+                                                 self.height, self.tessellation, self.tolerance * stride, ground, 
+                                                 clearance = self.clearance, flatten = False)
+        self.roadBase = mayaScene.writeMesh("roadPreview", road)
     
+    @EnvProfile.stage("road shader")
     def roadRiverShader(self):
         if self.default == True:
             if self.river:
@@ -1007,7 +2509,7 @@ class Road(UI):
                 self.oceanShader = cmds.shadingNode("oceanShader", asShader=True)
                 cmds.select(self.roadBase, replace=True)
                 cmds.defaultNavigation(source=self.oceanShader, 
-                                        destination="|%s|%sShape.instObjGroups[0]"%(self.roadBase,self.roadBase), 
+                                        destination="%s.instObjGroups[0]"%getShapePath(self.roadBase).fullPathName(), 
                                         connectToExisting=True)
 
             else:
@@ -1054,65 +2556,76 @@ class Road(UI):
             cmds.delete()
     
         
+    @EnvProfile.stage("user road")
     def makeUserRoad(self, *args):
         # ask user to give a name for mesh duplicates
-        folder = cmds.promptDialog(  title = "Name your folder", 
-                            message = "Please name the folder that holds all your model duplications: ", 
-                            text = "%sGrp"%self.userRoad , button = "Create")
-        # create a dummy node to animate along the curve: anim -> constrain -> attach to motion path
-        cmds.spaceLocator(name = "rLoc")
-        # select the locator and curve
-        cmds.select(self.curves, add = True)
-        # create motion path
-        cmds.pathAnimation( fractionMode = True, follow = True, followAxis = "x", upAxis = "y",
-                            inverseFront = False, startTimeU = 0, endTimeU = self.copy)
-        # change motion to linear
-        cmds.selectKey("motionPath1_uValue") ## wouldn't it be repeated?
-        cmds.keyTangent(inTangentType = "linear", outTangentType = "linear")
-        # create empty folder to hold all duplicates created later
-        self.folderName = cmds.promptDialog(query =  True, text = True)
-        parentFolder = cmds.group(empty = True, name = self.folderName)
-        # multiply road
-        # determine the starting frame of the timeline
-        self.minFrame = cmds.playbackOptions(query = True, min = True)
-        for obj in range(int(self.minFrame), int(self.minFrame) + self.copy):
-            # get attributes of the locator every frame
-            cmds.currentTime(obj, edit = True)
-            currentX = cmds.getAttr("rLoc.tx")
-            currentY = cmds.getAttr("rLoc.ty")
-            currentZ = cmds.getAttr("rLoc.tz")
-            currentRotY = cmds.getAttr('rLoc.ry')
-            
-            # select the model that chosen for population
-            cmds.select(self.userRoad, replace = True)
-            
-            # duplicate the mesh and set the translation according to locator
-            tempObj = cmds.duplicate()
-            cmds.setAttr(tempObj[0] + ".tx", currentX)
-            cmds.setAttr(tempObj[0] + ".ty", currentY)
-            cmds.setAttr(tempObj[0] + ".tz", currentZ)
-            cmds.setAttr(tempObj[0] + ".ry", currentRotY)
-            
-            # parent all models created to the folder
-            cmds.parent(tempObj[0], self.folderName, relative = False)  # let user name it
-        
-        # delete the dummy node
-        cmds.select("rLoc")
-        cmds.delete()
+        self.folderName = askName("Name your folder", 
+                                    "Please name the folder that holds all your model duplications: ", 
+                                    "%sGrp"%self.userRoad, self.name)
+        # sample evenly spaced positions and headings along the curve in one go
+        positions, headings = getCurveSampler(self.curves).sample(self.copy)
+        # the model that chosen for population
+        roadSource = self.userRoad[0] if isinstance(self.userRoad, list) else self.userRoad
+        srcRotates, srcScales = sourceTransforms([roadSource])
+        # follow the curve heading, keep the rest of the source transform
+        rotates = np.repeat(srcRotates, self.copy, axis = 0)
+        rotates[:, 1] = headings
+        scales = np.repeat(srcScales, self.copy, axis = 0)
+        # multiply road and parent all models to a new folder
+        self.model = EnvCity.Placements([roadSource], np.zeros(self.copy), positions, rotates, scales)
+        MayaBackend(self.mode).writePlacements(self.folderName, self.model)
         
     def undo(self, *args):
         if self.default == True:
             # make road from scratch
             cmds.select(self.roadBase, replace=True)
             cmds.delete()
+            # give the terrain its ground back
+            if self.terrainPoints is not None:
+                setMeshPoints(self.terrain, self.terrainPoints, world = True)
         else:
             # populate user road
             cmds.select(self.folderName, replace=True)
             cmds.delete()
 
+########################################################## ROAD NETWORK
+class RoadNetwork(object):
+    def __init__(self, curves, width, height, tessellation = 1, tolerance = 0.05):
+        # define variables
+        self.curves = curves
+        self.width = width
+        self.height = height
+        self.tessellation = tessellation
+        self.tolerance = tolerance
+        
+        # build the whole network
+        self.makeNetwork()
+    
+    @EnvProfile.stage("road network")
+    def makeNetwork(self, *args):
+        # every curve as points, close enough that bends stay smooth at this width
+        samplers = [getCurveSampler(crv) for crv in self.curves]
+        if self.tessellation == 2:
+            # or only where the curves bend
+            polylines = [sampler.adaptivePolyline(self.tolerance, self.width * 0.5) for sampler in samplers]
+            evenCount = sum(max(int(np.ceil(sampler.length / (self.width * 0.5))), 8) for sampler in samplers)
+            print "Adaptive network: %d road segments, evenly spaced gives about %d."%(
+                    sum(len(line) - 1 for line in polylines), evenCount)
+        else:
+            polylines = [sampler.polyline(self.width * 0.5) for sampler in samplers]
+        # graph, crossings, junctions and road strips all computed before touching the scene
+        points, faceCounts, faceConnects = EnvRoadNetwork.networkMesh(polylines, self.width)
+        points[:, 1] += self.height
+        self.roadNetwork = mayaScene.writeMesh("roadNetwork", EnvCity.Mesh(points, faceCounts, faceConnects))
+        print "Road network of %d curves made with %d faces."%(len(self.curves), len(faceCounts))
+    
+    def undo(self, *args):
+        cmds.delete(self.roadNetwork)
+
 ########################################################## LIGHT
-class Light(UI):
-    def __init__(self, north, time, weather, dynamic, frameStart, frameEnd, timeStart, timeEnd, intensity, sunColor, terrain):
+class Light(object):
+    def __init__(self, north, time, weather, dynamic, frameStart, frameEnd, timeStart, timeEnd, intensity, sunColor, terrain, 
+                    name = None):
         
         self.north = north
         self.time = time
@@ -1125,223 +2638,41 @@ class Light(UI):
         self.intensity = intensity
         self.sunColor = sunColor
         self.terrain = terrain
+        self.name = name
         
         # define additional variables
-        self.mdNode = 0
-        self.adlNode = 0
-        self.newTerrain = 0
-        self.rainEmitter = 0
-        self.rainParticle = 0
+        self.weatherNode = 0
         # executing functions
         self.create()
         
         
+    @EnvProfile.stage("light")
     def create(self, *args):
         # let user name their light
-        cmds.promptDialog(title='Light Name', message='Name your light: ',
-                                        text='sun', button='OK')
-        self.sun = cmds.promptDialog(query = True, text=True)
-        # create light
-        cmds.directionalLight(name= self.sun, rotation=(90,0,0))
-        cmds.setAttr("%sShape.color"%self.sun, self.sunColor[0], self.sunColor[1], self.sunColor[2])
-        cmds.setAttr("%sShape.intensity"%self.sun, self.intensity)
-        # define north direction
-        self.northDir()
-    
-    def northDir(self, *args):
-        # define north direction
-        if self.dynamic == False:
-            self.mdNode=cmds.shadingNode('multiplyDivide', asUtility=True)
-            cmds.setAttr("%s.input1X"%self.mdNode, self.time)
-            if self.north == 1:
-                # change rotate x, create extra add node
-                cmds.setAttr('%s.input2X'%self.mdNode, -15)
-                self.adlNode = cmds.shadingNode('addDoubleLinear', asUtility=True)
-                cmds.setAttr("%s.input1"%self.adlNode, 90)
-                cmds.connectAttr("%s.outputX"%self.mdNode, "%s.input2"%self.adlNode, force=True)
-                cmds.connectAttr('%s.output'%self.adlNode, '%s.rotateX'%self.sun, force=True)
-            if self.north == 2:
-                # change rotate x, create extra add node
-                cmds.setAttr('%s.input2X'%self.mdNode, 15)
-                self.adlNode = cmds.shadingNode('addDoubleLinear', asUtility=True)
-                cmds.setAttr("%s.input1"%self.adlNode, 90)
-                cmds.connectAttr("%s.outputX"%self.mdNode, "%s.input2"%self.adlNode, force=True)
-                cmds.connectAttr('%s.output'%self.adlNode, '%s.rotateX'%self.sun, force=True)
-            if self.north == 3:
-                # change rotate z
-                cmds.setAttr('%s.input2X'%self.mdNode, -15)
-                cmds.connectAttr("%s.outputX"%self.mdNode,"%s.rotateZ"%self.sun, force=True)
-            if self.north == 4:
-                # change rotate z
-                cmds.setAttr('%s.input2X'%self.mdNode, 15)
-                cmds.connectAttr("%s.outputX"%self.mdNode,"%s.rotateZ"%self.sun, force=True)
-        # if using dynamic light
+        self.sun = askName('Light Name', 'Name your light: ', 'sun', self.name)
+        # the sun at its hour, or keyed through the day
+        sun = EnvCity.sunModel(self.north, self.time, self.sunColor, self.intensity, self.dynamic == True, 
+                                self.frameStart, self.frameEnd, self.timeStart, self.timeEnd)
+        self.model = sun
+        mayaScene.writeSun(self.sun, sun)
+        # create weather
         if self.dynamic == True:
-            # check validation of frame and time range
-            if self.frameEnd <= self.frameStart:
-                raise Exception (" Start frame is greater than end frame! ")
-            if self.timeEnd <= self.timeStart:
-                raise Exception (" Start time is greater than end time! ")
-            cmds.select(self.sun)
-            # check north direction
-            if self.north == 1:
-                # key the starting rotation
-                cmds.currentTime(self.frameStart)
-                cmds.rotate(self.timeStart*-15, relative=True)
-                cmds.setKeyframe()
-                # key the ending rotation
-                cmds.currentTime(self.frameEnd)
-                cmds.rotate(self.timeEnd*-15, relative=True)
-                cmds.setKeyframe()
-            if self.north == 2:
-                # key the starting rotation
-                cmds.currentTime(self.frameStart)
-                cmds.rotate(self.timeStart*15, relative=True)
-                cmds.setKeyframe()
-                # key the ending rotation
-                cmds.currentTime(self.frameEnd)
-                cmds.rotate(self.timeEnd*15, relative=True)
-                cmds.setKeyframe()
-            if self.north == 3:
-                # key the starting rotation
-                cmds.currentTime(self.frameStart)
-                cmds.rotate(0,0,self.timeStart*-15, relative=True)
-                cmds.setKeyframe()
-                # key the ending rotation
-                cmds.currentTime(self.frameEnd)
-                cmds.rotate(0,0,self.timeEnd*-15, relative=True)
-                cmds.setKeyframe()
-            if self.north == 4:
-                # key the starting rotation
-                cmds.currentTime(self.frameStart)
-                cmds.rotate(0,0,self.timeStart*15, relative=True)
-                cmds.setKeyframe()
-                # key the ending rotation
-                cmds.currentTime(self.frameEnd)
-                cmds.rotate(0,0,self.timeEnd*15, relative=True)
-                cmds.setKeyframe()
-            # create weather
             cmds.select(clear=True)
             self.weatherCon()
 
-
+    @EnvProfile.stage("weather")
     def weatherCon(self, *args):        
-        # define weather condition
-        if self.weather == 1:
-            print 'sunny'
-            
-        if self.weather == 2:
-            print 'cloudly'
-            # get the terrain bounding box
-            bbox = cmds.exactWorldBoundingBox(self.terrain)
-            # create cloud emitter
-            cmds.Create3DContainerEmitter()
-            cmds.rename("fluid1","cloud")
-            cmds.select("cloud", replace=True)
-            cmds.move(0, abs(bbox[0]*2), relative=True)
-            # set the dimentions and resolutions
-            cmds.setAttr("cloudShape.squareVoxels", 0)
-            cmds.setAttr("cloudShape.dimensionsW", abs(bbox[0]*2))
-            cmds.setAttr("cloudShape.dimensionsH", abs(bbox[0]*0.1))
-            cmds.setAttr("cloudShape.dimensionsD", abs(bbox[0]*2))
-            cmds.setAttr("cloudShape.resolution", abs(bbox[0]*5),abs(bbox[0]),abs(bbox[0]*5))
-            # make the density to y gradient
-            cmds.setAttr("cloudShape.densityMethod", 3) # can be zero
-            cmds.setAttr("cloudShape.velocityMethod", 0)
-            # shading
-            cmds.setAttr("cloudShape.dropoffShape", 6)
-            cmds.setAttr("cloudShape.edgeDropoff", 0.4)
-            # color
-            cmds.setAttr("cloudShape.color[0].color_Color", 0.4,0.4,0.4)
-            cmds.setAttr("cloudShape.colorInput", 2)
-            # opacity
-            cmds.setAttr("cloudShape.opacity[2].opacity_FloatValue", 0.1)
-            cmds.setAttr("cloudShape.opacity[2].opacity_Position", 0.5)
-            cmds.setAttr("|cloud|cloudShape.opacity[3].opacity_FloatValue", 0.55)
-            cmds.setAttr("|cloud|cloudShape.opacity[3].opacity_Position", 0.75)
-            cmds.setAttr("|cloud|cloudShape.opacity[3].opacity_Interp", 1)
-            # textures
-            cmds.setAttr("cloudShape.opacityTexture", 1)
-            cmds.setAttr("cloudShape.amplitude", 1.5)
-            cmds.setAttr("cloudShape.depthMax", 5)
-            cmds.setAttr("cloudShape.inflection", 1)
-            # set key frame of texture time
-            cmds.currentTime(self.frameStart)
-            cmds.setAttr("cloudShape.textureTime", 1)
-            cmds.setKeyframe("cloudShape.tti")
-            cmds.currentTime(self.frameEnd)
-            cmds.setAttr("cloudShape.textureTime", 4)
-            cmds.setKeyframe("cloudShape.tti")
-            # lighting
-            cmds.setAttr("cloudShape.selfShadowing", 1)
-        
-        if self.weather == 3:
-            print 'Rainy'
-            # making the surface of particles
-            self.newTerrain = cmds.duplicate(self.terrain, returnRootsOnly=True)[0]
-            bbox = cmds.exactWorldBoundingBox(self.newTerrain)
-            cmds.select(self.newTerrain)
-            cmds.move(0, abs(bbox[0])*2, relative=True)
-            cmds.rotate(180, relative=True, objectSpace=True, forceOrderXYZ=True)
-            cmds.setAttr("%s.visibility"%self.newTerrain, 0)
-            # create particles
-            self.rainEmitter = cmds.emitter(type="surface", name="rain", rate=1000, scaleRateByObjectSize=False, 
-                        needParentUV=False, cycleEmission="None", cycleInterval=1, 
-                        speed=1, speedRandom=0, normalSpeed=1, tangentSpeed=0, maxDistance=0, minDistance=0, 
-                        directionX=1, directionY=0, directionZ=0, spread=0)
-            self.rainParticle = cmds.nParticle(name="rainParticle")
-            cmds.connectDynamic("rainParticle", emitters="rain")
-            # change particle shape
-            cmds.setAttr("rainParticleShape.particleRenderType", 6)
-            # change particle lifespan
-            cmds.setAttr("rainParticleShape.lifespanMode", 2)
-            cmds.setAttr("rainParticleShape.lifespan", abs(bbox[0])*0.5)
-            # make particle collide with terrain
-            cmds.select("rainParticle", replace=True)
-            cmds.select(self.terrain, add=True)
-            makecollide="makeCollideNCloth;"
-            mel.eval(makecollide)
-            cmds.select(clear=True)
-            
-        if self.weather == 4:
-            print 'Snowy'
-            # making the surface of particles
-            self.newTerrain = cmds.duplicate(self.terrain, returnRootsOnly=True)[0]
-            bbox = cmds.exactWorldBoundingBox(self.newTerrain)
-            cmds.select(self.newTerrain)
-            cmds.move(0, abs(bbox[0])*2, relative=True)
-            cmds.rotate(180, relative=True, objectSpace=True, forceOrderXYZ=True)
-            cmds.setAttr("%s.visibility"%self.newTerrain, 0)
-            # create particles
-            self.snowEmitter = cmds.emitter(type="surface", name="snow", rate=150, scaleRateByObjectSize=False, 
-                        needParentUV=False, cycleEmission="None", cycleInterval=1, 
-                        speed=0.25, speedRandom=0, normalSpeed=1, tangentSpeed=0, maxDistance=0, minDistance=0, 
-                        directionX=1, directionY=0, directionZ=0, spread=0)
-            self.snowParticle = cmds.nParticle(name="snowParticle")
-            cmds.connectDynamic("snowParticle", emitters="snow")
-            # change particle color and shape
-            cmds.setAttr("snow.particleColor", 1,1,1)
-            cmds.setAttr("snowParticleShape.particleRenderType", 8)
-            cmds.setAttr("snowParticleShape.opacity", 0.3)
-            # change particle lifespan
-            cmds.setAttr("snowParticleShape.lifespanMode", 2)
-            cmds.setAttr("snowParticleShape.lifespan", abs(bbox[0])*0.25)
-            # make particle collide with terrain
-            cmds.select("snowParticle", replace=True)
-            cmds.select(self.terrain, add=True)
-            makecollide="makeCollideNCloth;"
-            mel.eval(makecollide)
-            cmds.select(clear=True)
+        # define weather condition over the terrain
+        bbox = cmds.exactWorldBoundingBox(self.terrain) if self.weather != 1 else None
+        weather = EnvCity.weatherModel(self.weather, self.terrain, bbox, self.frameStart, self.frameEnd)
+        print weather.kind
+        self.weatherNode = mayaScene.writeWeather(EnvCity.WEATHER_NAMES.get(weather.kind), weather)
         
     def undo(self, *args):
         # delete light and nodes created
         cmds.delete(self.sun)
-        if cmds.objExists(self.mdNode):
-            cmds.delete(self.mdNode)
-        if cmds.objExists(self.adlNode):
-            cmds.delete(self.adlNode)
-        if cmds.objExists(self.newTerrain):
-            cmds.delete(self.newTerrain)
+        if self.weatherNode and cmds.objExists(self.weatherNode):
+            cmds.delete(self.weatherNode)
         # dynamic scene
         if cmds.objExists("cloud"):
             cmds.delete("cloud")        
@@ -1357,6 +2688,8 @@ class Light(UI):
             cmds.delete("nRigid1")
 
 ################################## instance UI class ########################################
-instanceUI = UI()
-instanceUI.makeUI()
+# only when run as a script, so the stages can be imported e.g. by the benchmarks
+if __name__ == "__main__":
+    instanceUI = UI()
+    instanceUI.makeUI()
 
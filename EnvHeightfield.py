@@ -0,0 +1,287 @@
+'''
+Environment Generator Project
+Heightfield engine: vectorized terrain deformation on regular grids
+'''
+
+from __future__ import division
+import numpy as np
+
+
+# soft select style falloff: 1 at the centre, 0 at the radius, smooth in between
+def softFalloff(dist, radius):
+    t = np.clip(np.asarray(dist, dtype=np.float64) / radius, 0.0, 1.0)
+    return 1.0 - t * t * (3.0 - 2.0 * t)
+
+
+# falloff weights of every grid offset that lies inside the radius
+def falloffKernel(spacing, radius):
+    cells = int(np.ceil(radius / spacing))
+    offsets = np.arange(-cells, cells + 1) * spacing
+    dist = np.hypot(offsets[:, None], offsets[None, :])
+    return softFalloff(dist, radius)
+
+
+# spread sparse (rows, cols, k) offsets over the grid with the falloff kernel
+def spreadOffsets(impulses, spacing, radius):
+    kernel = falloffKernel(spacing, radius)
+    half = kernel.shape[0] // 2
+    rows, cols = impulses.shape[:2]
+    # linear convolution through the fft, padded so nothing wraps around
+    shape = (rows + 2 * half, cols + 2 * half)
+    layers = np.moveaxis(np.asarray(impulses, dtype=np.float64), -1, 0)
+    spread = np.fft.irfft2(np.fft.rfft2(layers, s=shape) * np.fft.rfft2(kernel, s=shape), s=shape)
+    return np.moveaxis(spread[:, half:half + rows, half:half + cols], 0, -1)
+
+
+# random morph of a polyPlane, same as soft-select moving every nth vertex
+def morphGrid(divisions, dimension, height, depth, step=5, radius=5.0, rng=np.random):
+    side = divisions + 1
+    count = side * side
+    # random offsets on the moved vertices only
+    sources = np.arange(0, count, step)
+    impulses = np.zeros((count, 3))
+    impulses[sources, 0] = rng.uniform(-1.0, 1.0, len(sources))
+    impulses[sources, 1] = rng.uniform(depth, height, len(sources))
+    impulses[sources, 2] = rng.uniform(-1.0, 1.0, len(sources))
+    # every vertex gets the falloff weighted sum of the moves around it
+    offsets = spreadOffsets(impulses.reshape(side, side, 3), dimension / divisions, radius)
+    return offsets.reshape(count, 3)
+
+
+# quads of a (rows, cols) vertex grid stored row after row, wound so the faces point up
+def gridQuads(rows, cols, start=0):
+    first = (np.arange(rows - 1)[:, None] * cols + np.arange(cols - 1)[None, :]).ravel()
+    return start + first[:, None] + np.array([0, cols, cols + 1, 1])
+
+
+# vertices and quads of a (rows, cols) height grid with its first vertex at origin (x, z)
+# returns points, face vertex counts and face vertex ids, ready for a single mesh create
+def gridMesh(heights, origin, spacing):
+    rows, cols = heights.shape
+    x, z = np.meshgrid(origin[0] + np.arange(cols) * spacing, origin[1] + np.arange(rows) * spacing)
+    points = np.column_stack([x.ravel(), heights.ravel(), z.ravel()])
+    quads = gridQuads(rows, cols)
+    return points, np.full(len(quads), 4), quads.ravel()
+
+
+# height lookup on a regular grid mesh such as a polyPlane, whose vertices may have drifted sideways
+# points: (rows * cols, 3) vertices row after row
+class HeightGrid(object):
+    def __init__(self, points, rows, cols):
+        self.points = np.asarray(points, dtype=np.float64).reshape(rows, cols, 3)
+        self.rows = rows
+        self.cols = cols
+        # best fitting affine map from (column, row) to xz, to find the cell of a point
+        colIndex, rowIndex = np.meshgrid(np.arange(cols), np.arange(rows))
+        basis = np.column_stack([np.ones(rows * cols), colIndex.ravel(), rowIndex.ravel()])
+        fit = np.linalg.lstsq(basis, self.points[:, :, [0, 2]].reshape(-1, 2), rcond=None)[0]
+        self.origin = fit[0]
+        self.toIndex = np.linalg.inv(fit[1:])
+        self.spacing = np.sqrt(np.abs(np.linalg.det(fit[1:])))
+
+    # (column, row) grid coordinates of xz positions, newton steps through the bilinear cells
+    def gridCoords(self, xz, steps=8):
+        xz = np.asarray(xz, dtype=np.float64).reshape(-1, 2)
+        coords = (xz - self.origin).dot(self.toIndex)
+        flat = self.points[:, :, [0, 2]]
+        for step in range(steps):
+            u, v, fu, fv = self.cells(coords)
+            p00, p10 = flat[v, u], flat[v, u + 1]
+            p01, p11 = flat[v + 1, u], flat[v + 1, u + 1]
+            fu = fu[:, None]
+            fv = fv[:, None]
+            position = (1 - fu) * (1 - fv) * p00 + fu * (1 - fv) * p10 + (1 - fu) * fv * p01 + fu * fv * p11
+            du = (1 - fv) * (p10 - p00) + fv * (p11 - p01)
+            dv = (1 - fu) * (p01 - p00) + fu * (p11 - p10)
+            # solve the 2 by 2 jacobian of every point at once
+            det = du[:, 0] * dv[:, 1] - du[:, 1] * dv[:, 0]
+            det = np.where(np.abs(det) > 1e-12, det, 1e-12)
+            miss = xz - position
+            coords[:, 0] += (miss[:, 0] * dv[:, 1] - miss[:, 1] * dv[:, 0]) / det
+            coords[:, 1] += (du[:, 0] * miss[:, 1] - du[:, 1] * miss[:, 0]) / det
+        return coords
+
+    # cell corner indices and the fractions inside the cell, clamped to the grid
+    def cells(self, coords):
+        coords = np.clip(coords, 0.0, [self.cols - 1, self.rows - 1])
+        u = np.minimum(np.floor(coords[:, 0]).astype(int), self.cols - 2)
+        v = np.minimum(np.floor(coords[:, 1]).astype(int), self.rows - 2)
+        return u, v, coords[:, 0] - u, coords[:, 1] - v
+
+    # bilinear terrain height under many xz positions at once, edge heights outside the grid
+    def heights(self, xz):
+        u, v, fu, fv = self.cells(self.gridCoords(xz))
+        y = self.points[:, :, 1]
+        return ((1 - fu) * (1 - fv) * y[v, u] + fu * (1 - fv) * y[v, u + 1] + 
+                (1 - fu) * fv * y[v + 1, u] + fu * fv * y[v + 1, u + 1])
+
+
+# height lookup on any triangle mesh: a bounding volume hierarchy of the triangles seen from above
+# queries go down the tree together, one level of (query, node) pairs at a time
+class HeightBVH(object):
+    def __init__(self, points, triangles, leafSize=8):
+        self.points = np.asarray(points, dtype=np.float64)
+        self.triangles = np.asarray(triangles, dtype=np.int64).reshape(-1, 3)
+        corners = self.points[self.triangles][:, :, [0, 2]]
+        self.triLow = corners.min(axis=1)
+        self.triHigh = corners.max(axis=1)
+        centres = corners.mean(axis=1)
+        # typical triangle size, for callers that sample the surface about once per triangle
+        edges = corners[:, 1:] - corners[:, :1]
+        area = np.abs(edges[:, 0, 0] * edges[:, 1, 1] - edges[:, 0, 1] * edges[:, 1, 0]).sum()
+        self.spacing = np.sqrt(area / max(len(self.triangles), 1))
+        # nodes as flat arrays: bounds, children (-1 on leaves) and the leaf's run of triangles
+        low, high, children, runs = [], [], [], []
+        order = np.arange(len(self.triangles))
+        stack = [(0, len(order), -1, 0)]
+        while stack:
+            start, end, parent, side = stack.pop()
+            node = len(low)
+            if parent >= 0:
+                children[parent][side] = node
+            members = order[start:end]
+            low.append(self.triLow[members].min(axis=0))
+            high.append(self.triHigh[members].max(axis=0))
+            children.append([-1, -1])
+            runs.append((start, end))
+            if end - start <= leafSize:
+                continue
+            # split at the median along the longer side
+            axis = int(np.argmax(high[node] - low[node]))
+            middle = (start + end) // 2
+            part = np.argpartition(centres[members, axis], middle - start)
+            order[start:end] = members[part]
+            stack.append((middle, end, node, 1))
+            stack.append((start, middle, node, 0))
+        self.order = order
+        self.nodeLow = np.array(low)
+        self.nodeHigh = np.array(high)
+        self.children = np.array(children)
+        self.runs = np.array(runs)
+
+    # highest surface point under many xz positions at once, nan where nothing is below
+    def heights(self, xz):
+        xz = np.asarray(xz, dtype=np.float64).reshape(-1, 2)
+        result = np.full(len(xz), -np.inf)
+        query = np.arange(len(xz))
+        node = np.zeros(len(xz), dtype=np.int64)
+        while len(query):
+            inside = ((xz[query] >= self.nodeLow[node]) & (xz[query] <= self.nodeHigh[node])).all(axis=1)
+            query = query[inside]
+            node = node[inside]
+            leaf = self.children[node, 0] < 0
+            self.hitLeaves(xz, query[leaf], node[leaf], result)
+            # inner nodes hand their queries on to both children
+            query = np.repeat(query[~leaf], 2)
+            node = self.children[node[~leaf]].ravel()
+        result[np.isinf(result)] = np.nan
+        return result
+
+    # test every query against every triangle of its leaf, keeping the highest hit
+    def hitLeaves(self, xz, query, node, result):
+        if len(query) == 0:
+            return
+        sizes = self.runs[node, 1] - self.runs[node, 0]
+        pairs = np.repeat(query, sizes)
+        firstOfRun = np.repeat(np.cumsum(sizes) - sizes, sizes)
+        triangle = self.order[np.repeat(self.runs[node, 0], sizes) + np.arange(sizes.sum()) - firstOfRun]
+        point = xz[pairs]
+        corners = self.points[self.triangles[triangle]]
+        a = corners[:, 0, [0, 2]]
+        ab = corners[:, 1, [0, 2]] - a
+        ac = corners[:, 2, [0, 2]] - a
+        ap = point - a
+        # barycentric coordinates on the xz plane
+        det = ab[:, 0] * ac[:, 1] - ab[:, 1] * ac[:, 0]
+        safe = np.where(np.abs(det) > 1e-12, det, 1.0)
+        u = (ap[:, 0] * ac[:, 1] - ap[:, 1] * ac[:, 0]) / safe
+        v = (ab[:, 0] * ap[:, 1] - ab[:, 1] * ap[:, 0]) / safe
+        hit = (np.abs(det) > 1e-12) & (u >= -1e-9) & (v >= -1e-9) & (u + v <= 1.0 + 1e-9)
+        y = corners[:, 0, 1] + u * (corners[:, 1, 1] - corners[:, 0, 1]) + v * (corners[:, 2, 1] - corners[:, 0, 1])
+        np.maximum.at(result, pairs[hit], y[hit])
+
+
+# distance on the xz plane from many points to a polyline
+# returns the distance, nearest segment and position along it (0 to 1); points further than reach get inf
+def polylineDistance(points, line, reach=np.inf, chunkSize=32):
+    xz = np.asarray(points, dtype=np.float64)[:, [0, 2]]
+    flat = np.asarray(line, dtype=np.float64)[:, [0, 2]]
+    count = len(xz)
+    distance = np.full(count, np.inf)
+    segment = np.zeros(count, dtype=int)
+    along = np.zeros(count)
+    if len(flat) < 2:
+        return distance, segment, along
+    if not np.isfinite(reach):
+        reach = np.ptp(xz, axis=0).sum() + np.ptp(flat, axis=0).sum()
+    starts = flat[:-1]
+    chords = flat[1:] - flat[:-1]
+    lengths = np.maximum((chords ** 2).sum(axis=1), 1e-12)
+    # neighbouring segments a chunk at a time, only testing the points inside the chunk's grown bounds
+    for first in range(0, len(starts), chunkSize):
+        ends = flat[first:first + chunkSize + 1]
+        low = ends.min(axis=0) - reach
+        high = ends.max(axis=0) + reach
+        near = np.flatnonzero((xz[:, 0] >= low[0]) & (xz[:, 0] <= high[0]) & 
+                              (xz[:, 1] >= low[1]) & (xz[:, 1] <= high[1]))
+        if len(near) == 0:
+            continue
+        a = starts[first:first + chunkSize]
+        d = chords[first:first + chunkSize]
+        offset = xz[near, None, :] - a[None, :, :]
+        t = np.clip((offset * d[None]).sum(axis=2) / lengths[None, first:first + chunkSize], 0.0, 1.0)
+        gap = np.sqrt(((offset - t[:, :, None] * d[None]) ** 2).sum(axis=2))
+        best = np.argmin(gap, axis=1)
+        rows = np.arange(len(near))
+        closer = gap[rows, best] < distance[near]
+        picked = near[closer]
+        distance[picked] = gap[rows, best][closer]
+        segment[picked] = first + best[closer]
+        along[picked] = t[rows, best][closer]
+    distance[distance > reach] = np.inf
+    return distance, segment, along
+
+
+# height of a polyline at the spots given by polylineDistance
+def heightAlong(line, segment, along):
+    return line[segment, 1] + (line[segment + 1, 1] - line[segment, 1]) * along
+
+
+# level ground under a road: heights within half the road width become the road height,
+# blending back to the old height across the shoulder
+def flattenUnder(points, line, half, shoulder):
+    points = np.asarray(points, dtype=np.float64)
+    distance, segment, along = polylineDistance(points, line, half + shoulder)
+    heights = points[:, 1].copy()
+    near = np.isfinite(distance)
+    roadY = heightAlong(line, segment[near], along[near])
+    blend = softFalloff(np.maximum(distance[near] - half, 0.0), max(shoulder, 1e-6))
+    heights[near] += (roadY - heights[near]) * blend
+    return heights
+
+
+# water level along a river line: the ground height, never rising on the way downstream
+# the line is turned round first if its far end is the higher one
+def waterLevel(line):
+    line = np.array(line, dtype=np.float64)
+    if line[0, 1] < line[-1, 1]:
+        line = line[::-1]
+    line[:, 1] = np.minimum.accumulate(line[:, 1])
+    return line
+
+
+# river channel cut into the ground: a rounded bed depth below the water within half the width,
+# banks sloping from the old ground down to the water across the bank width
+def carveChannel(points, line, half, depth, bank):
+    points = np.asarray(points, dtype=np.float64)
+    distance, segment, along = polylineDistance(points, line, half + bank)
+    heights = points[:, 1].copy()
+    near = np.isfinite(distance)
+    gap = distance[near]
+    water = heightAlong(line, segment[near], along[near])
+    bed = water - depth * np.clip(1.0 - (gap / max(half, 1e-6)) ** 2, 0.0, 1.0)
+    # only ever dig, and fade the digging out across the banks
+    carved = np.minimum(heights[near], bed)
+    blend = softFalloff(np.maximum(gap - half, 0.0), max(bank, 1e-6))
+    heights[near] += (carved - heights[near]) * blend
+    return heights
@@ -0,0 +1,175 @@
+'''
+Environment Generator Project
+Heightmaps: RAW and float TIFF height images read and written through memory maps
+'''
+
+from __future__ import division
+import os
+import struct
+import numpy as np
+
+# RAW sample types by file extension, anything else is taken as 16 bit
+RAW_TYPES = {".r16": "<u2", ".raw": "<u2", ".r32": "<f4"}
+# rows written at a time when exporting
+WRITE_ROWS = 1024
+
+# tiff tags used here
+TAG_WIDTH = 256
+TAG_LENGTH = 257
+TAG_BITS = 258
+TAG_COMPRESSION = 259
+TAG_PHOTOMETRIC = 262
+TAG_STRIP_OFFSETS = 273
+TAG_SAMPLES = 277
+TAG_ROWS_PER_STRIP = 278
+TAG_STRIP_BYTES = 279
+TAG_TILE_WIDTH = 322
+TAG_SAMPLE_FORMAT = 339
+# value types of tiff fields: size and struct code
+TIFF_TYPES = {1: (1, "B"), 3: (2, "H"), 4: (4, "I"), 16: (8, "Q")}
+# sample format and bits to numpy type
+TIFF_SAMPLES = {(1, 8): "u1", (1, 16): "u2", (1, 32): "u4", (2, 16): "i2", (2, 32): "i4",
+                (3, 32): "f4", (3, 64): "f8"}
+
+
+# a RAW heightmap as a read only memory map of (rows, cols), square unless width is given
+def openRaw(path, width=None, dtype=None):
+    dtype = np.dtype(dtype or RAW_TYPES.get(os.path.splitext(path)[1].lower(), "<u2"))
+    count = os.path.getsize(path) // dtype.itemsize
+    if not width:
+        width = int(round(np.sqrt(count)))
+    if count % width:
+        raise ValueError("%s does not hold whole rows of %d samples." % (path, width))
+    return np.memmap(path, dtype=dtype, mode="r", shape=(count // width, width))
+
+
+# fields of the first image of a tiff file
+def readTiffTags(handle):
+    order = handle.read(2)
+    endian = {b"II": "<", b"MM": ">"}.get(order)
+    if endian is None:
+        raise ValueError("not a tiff file")
+    magic, = struct.unpack(endian + "H", handle.read(2))
+    if magic == 43:
+        # bigtiff: 8 byte offsets and counts
+        handle.read(4)
+        offsetCode, countCode, entrySize = "Q", "Q", 20
+    elif magic == 42:
+        offsetCode, countCode, entrySize = "I", "H", 12
+    else:
+        raise ValueError("not a tiff file")
+    offset, = struct.unpack(endian + offsetCode, handle.read(struct.calcsize(offsetCode)))
+    handle.seek(offset)
+    entries, = struct.unpack(endian + countCode, handle.read(struct.calcsize(countCode)))
+    inline = struct.calcsize(offsetCode)
+    tags = {}
+    for entry in range(entries):
+        raw = handle.read(entrySize)
+        tag, kind = struct.unpack(endian + "HH", raw[:4])
+        count, = struct.unpack(endian + offsetCode, raw[4:4 + inline])
+        data = raw[4 + inline:]
+        if kind not in TIFF_TYPES:
+            continue
+        size, code = TIFF_TYPES[kind]
+        if size * count > inline:
+            # the values are somewhere else in the file
+            where = handle.tell()
+            handle.seek(struct.unpack(endian + offsetCode, data)[0])
+            data = handle.read(size * count)
+            handle.seek(where)
+        tags[tag] = struct.unpack(endian + code * count, data[:size * count])
+    return endian, tags
+
+
+# an uncompressed single channel tiff as a read only memory map of (rows, cols)
+# the strips have to follow each other in the file, as most writers of float heightmaps do
+def openTiff(path):
+    with open(path, "rb") as handle:
+        endian, tags = readTiffTags(handle)
+    if tags.get(TAG_COMPRESSION, (1,))[0] != 1:
+        raise ValueError("%s is compressed, only uncompressed tiffs can be memory mapped." % path)
+    if TAG_TILE_WIDTH in tags or tags.get(TAG_SAMPLES, (1,))[0] != 1:
+        raise ValueError("%s is not a single channel tiff in strips." % path)
+    width = tags[TAG_WIDTH][0]
+    length = tags[TAG_LENGTH][0]
+    kind = TIFF_SAMPLES.get((tags.get(TAG_SAMPLE_FORMAT, (1,))[0], tags[TAG_BITS][0]))
+    if kind is None:
+        raise ValueError("%s has a sample type that is not supported." % path)
+    offsets = np.array(tags[TAG_STRIP_OFFSETS])
+    counts = np.array(tags[TAG_STRIP_BYTES])
+    if np.any(offsets[1:] != offsets[:-1] + counts[:-1]):
+        raise ValueError("%s has its strips spread over the file." % path)
+    return np.memmap(path, dtype=np.dtype(endian + kind), mode="r", offset=int(offsets[0]), shape=(length, width))
+
+
+# any supported heightmap by its extension
+def openHeightmap(path, width=None):
+    if os.path.splitext(path)[1].lower() in (".tif", ".tiff"):
+        return openTiff(path)
+    return openRaw(path, width)
+
+
+# (row, col, heights) windows of tileDivisions cells, every step-th sample
+# neighbouring windows share their edge row and column so the tiles meet; only the window is read
+def heightTiles(heightmap, tileDivisions, step=1):
+    rows = (heightmap.shape[0] - 1) // step
+    cols = (heightmap.shape[1] - 1) // step
+    for row in range(0, max(rows, 1), tileDivisions):
+        for col in range(0, max(cols, 1), tileDivisions):
+            window = heightmap[row * step:(min(row + tileDivisions, rows)) * step + 1:step, 
+                               col * step:(min(col + tileDivisions, cols)) * step + 1:step]
+            yield row // tileDivisions, col // tileDivisions, np.array(window, dtype=np.float64)
+
+
+# fill a writable memory map from heights a block of rows at a time, scaling into the file's type
+def fillMap(target, heights, low, high):
+    integer = np.issubdtype(target.dtype, np.integer)
+    top = np.iinfo(target.dtype).max if integer else 1.0
+    for start in range(0, len(heights), WRITE_ROWS):
+        block = np.asarray(heights[start:start + WRITE_ROWS], dtype=np.float64)
+        if integer:
+            block = np.round((block - low) / max(high - low, 1e-12) * top)
+        target[start:start + WRITE_ROWS] = block
+    target.flush()
+
+
+# write heights as RAW, integers spread over the height range and floats as they are
+# returns the height range so an integer map can be scaled back on import
+def writeRaw(path, heights, dtype=None):
+    dtype = np.dtype(dtype or RAW_TYPES.get(os.path.splitext(path)[1].lower(), "<u2"))
+    low, high = float(np.min(heights)), float(np.max(heights))
+    target = np.memmap(path, dtype=dtype, mode="w+", shape=np.shape(heights))
+    fillMap(target, heights, low, high)
+    del target
+    return low, high
+
+
+# write heights as an uncompressed 32 bit float tiff, the samples in one strip after the header
+def writeTiff(path, heights):
+    rows, cols = np.shape(heights)
+    fields = [(TAG_WIDTH, 4, cols), (TAG_LENGTH, 4, rows), (TAG_BITS, 3, 32), (TAG_COMPRESSION, 3, 1),
+              (TAG_PHOTOMETRIC, 3, 1), (TAG_STRIP_OFFSETS, 4, 0), (TAG_SAMPLES, 3, 1),
+              (TAG_ROWS_PER_STRIP, 4, rows), (TAG_STRIP_BYTES, 4, rows * cols * 4), (TAG_SAMPLE_FORMAT, 3, 3)]
+    # header, then the directory, then the samples
+    dataOffset = 8 + 2 + 12 * len(fields) + 4
+    dataOffset += (-dataOffset) % 16
+    with open(path, "wb") as handle:
+        handle.write(struct.pack("<2sHI", b"II", 42, 8))
+        handle.write(struct.pack("<H", len(fields)))
+        for tag, kind, value in fields:
+            value = dataOffset if tag == TAG_STRIP_OFFSETS else value
+            code = "H2x" if kind == 3 else "I"
+            handle.write(struct.pack("<HHI" + code, tag, kind, 1, value))
+        handle.write(struct.pack("<I", 0))
+        handle.write(b"\0" * (dataOffset - handle.tell()))
+    target = np.memmap(path, dtype="<f4", mode="r+", offset=dataOffset, shape=(rows, cols))
+    fillMap(target, heights, 0.0, 1.0)
+    del target
+    return float(np.min(heights)), float(np.max(heights))
+
+
+# write heights in the format the extension asks for
+def writeHeightmap(path, heights):
+    if os.path.splitext(path)[1].lower() in (".tif", ".tiff"):
+        return writeTiff(path, heights)
+    return writeRaw(path, heights)
@@ -0,0 +1,108 @@
+'''
+Environment Generator Project
+Terrain level of detail: a quadtree of tiles cut from one heightfield, chosen by camera distance
+'''
+
+from __future__ import division
+import heapq
+import numpy as np
+import EnvHeightfield
+
+
+class TerrainQuadtree(object):
+    # points: (rows, cols, 3) terrain vertices row after row, every tile has leafDivisions cells a side
+    # a tile is (level, column, row), level 0 being the whole terrain in one tile
+    def __init__(self, points, leafDivisions=16, skirtDepth=None):
+        self.points = np.asarray(points, dtype=np.float64)
+        self.rows, self.cols = self.points.shape[:2]
+        self.leaf = int(leafDivisions)
+        # deep enough for the finest tiles to show every terrain vertex
+        cells = max(self.rows - 1, self.cols - 1)
+        self.maxLevel = max(int(np.ceil(np.log2(max(cells / self.leaf, 1.0)))), 0)
+        heights = self.points[:, :, 1]
+        if skirtDepth is None:
+            # deep enough to hide the step between a tile and its coarser neighbour
+            skirtDepth = 0.1 * (heights.max() - heights.min()) + 1e-3
+        self.skirtDepth = skirtDepth
+
+    # width of the finest tiles
+    def finestTileSize(self):
+        extent = self.points[:, :, [0, 2]].reshape(-1, 2)
+        return np.ptp(extent, axis=0).max() / 2 ** self.maxLevel
+
+    # faces of one tile, its skirt included
+    def tileFaces(self):
+        return self.leaf * self.leaf + 4 * self.leaf
+
+    # fractional grid row and column of the samples of a tile, neighbours share their edge samples
+    def tileIndices(self, key):
+        level, col, row = key
+        count = 2 ** level
+        u = (col + np.linspace(0.0, 1.0, self.leaf + 1)) * (self.cols - 1) / count
+        v = (row + np.linspace(0.0, 1.0, self.leaf + 1)) * (self.rows - 1) / count
+        return u, v
+
+    # terrain vertices at fractional grid positions, bilinear between the grid vertices around them
+    def sampleGrid(self, u, v):
+        u0 = np.minimum(np.floor(u).astype(int), self.cols - 2) if self.cols > 1 else np.zeros(len(u), int)
+        v0 = np.minimum(np.floor(v).astype(int), self.rows - 2) if self.rows > 1 else np.zeros(len(v), int)
+        fu = (u - u0)[None, :, None]
+        fv = (v - v0)[:, None, None]
+        u1 = np.minimum(u0 + 1, self.cols - 1)
+        v1 = np.minimum(v0 + 1, self.rows - 1)
+        grid = self.points
+        return ((1 - fu) * (1 - fv) * grid[v0][:, u0] + fu * (1 - fv) * grid[v0][:, u1] + 
+                (1 - fu) * fv * grid[v1][:, u0] + fu * fv * grid[v1][:, u1])
+
+    # centre and radius of a tile from its corners and the terrain's height range
+    def tileSphere(self, key):
+        u, v = self.tileIndices(key)
+        corners = self.sampleGrid(np.array([u[0], u[-1]]), np.array([v[0], v[-1]])).reshape(-1, 3)
+        centre = corners.mean(axis=0)
+        radius = np.sqrt(((corners - centre) ** 2).sum(axis=1)).max()
+        return centre, radius
+
+    # how badly a tile is too coarse for a camera: its size over its distance
+    def tileError(self, key, camera):
+        centre, radius = self.tileSphere(key)
+        distance = max(np.sqrt(((centre - camera) ** 2).sum()) - radius, radius * 0.1, 1e-6)
+        return 2.0 * radius / distance
+
+    # tiles covering the terrain for a camera position: the worst tile is split into four
+    # while its error is over the limit and the four still fit in the face budget
+    def select(self, camera, budget, errorLimit=0.5):
+        camera = np.asarray(camera, dtype=np.float64)
+        root = (0, 0, 0)
+        heap = [(-self.tileError(root, camera), root)]
+        chosen = []
+        faces = self.tileFaces()
+        while heap:
+            error, key = heapq.heappop(heap)
+            level, col, row = key
+            if -error <= errorLimit or level >= self.maxLevel or faces + 3 * self.tileFaces() > budget:
+                chosen.append(key)
+                continue
+            faces += 3 * self.tileFaces()
+            for child in ((level + 1, col * 2 + dc, row * 2 + dr) for dr in (0, 1) for dc in (0, 1)):
+                heapq.heappush(heap, (-self.tileError(child, camera), child))
+        return sorted(chosen)
+
+    # mesh of one tile with a skirt hanging down from its edge
+    # returns points, face vertex counts and face vertex ids, ready for a single mesh create
+    def tileMesh(self, key):
+        u, v = self.tileIndices(key)
+        side = self.leaf + 1
+        grid = self.sampleGrid(u, v)
+        # the edge going round the tile, and the skirt under it
+        ring = np.concatenate([np.arange(side), np.arange(1, side) * side + side - 1, 
+                               side * side - 1 - np.arange(1, side), (side - 1 - np.arange(1, side - 1)) * side])
+        flat = grid.reshape(-1, 3)
+        skirt = flat[ring] - [0.0, self.skirtDepth, 0.0]
+        points = np.vstack([flat, skirt])
+        top = EnvHeightfield.gridQuads(side, side)
+        after = np.roll(np.arange(len(ring)), -1)
+        below = side * side + np.arange(len(ring))
+        # wound so the skirt faces outwards
+        walls = np.column_stack([ring, ring[after], below[after], below])
+        quads = np.vstack([top, walls])
+        return points, np.full(len(quads), 4), quads.ravel()
@@ -0,0 +1,607 @@
+'''
+Environment Generator Project
+Maya stand-in: maya.cmds, maya.mel and the OpenMaya calls the generator makes, on a small in-memory scene
+'''
+
+from __future__ import division
+import re
+import sys
+import types
+from collections import OrderedDict
+import numpy as np
+import EnvCurve
+import EnvHeightfield
+import EnvRoadNetwork
+
+# node names may come as unicode on python 2
+try:
+    STRING_TYPES = (str, unicode)
+except NameError:
+    STRING_TYPES = (str,)
+
+
+class Node(object):
+    # a transform and its shape in one: mesh points and faces, curve cvs and knots, or only attributes
+    def __init__(self, name, nodeType, shapeType=None):
+        self.name = name
+        self.type = nodeType
+        self.shapeType = shapeType
+        self.parent = None
+        self.attrs = {}
+        self.translate = np.zeros(3)
+        self.rotate = np.zeros(3)
+        self.scale = np.ones(3)
+        self.points = None
+        self.faceCounts = None
+        self.faceConnects = None
+        self.curve = None
+        self.history = []
+
+
+class Scene(object):
+    def __init__(self):
+        self.nodes = OrderedDict()
+        self.selection = []
+        self.prompt = ""
+        self.time = 1.0
+        self.calls = {}
+        self.callbacks = {}
+        self.nextCallback = 1
+
+    def record(self, name):
+        self.calls[name] = self.calls.get(name, 0) + 1
+
+    # maya's way of making a name unique: a number on the end, counting up
+    def unique(self, name):
+        if name not in self.nodes:
+            return name
+        stem = re.sub(r"\d+$", "", name)
+        number = 1
+        while "%s%d" % (stem, number) in self.nodes:
+            number += 1
+        return "%s%d" % (stem, number)
+
+    def add(self, name, nodeType, shapeType=None):
+        node = Node(self.unique(name), nodeType, shapeType)
+        self.nodes[node.name] = node
+        for kind, callback in list(self.callbacks.values()):
+            if kind[0] == "added":
+                callback(MObject(node.name))
+                if shapeType:
+                    callback(MObject(node.name + "Shape"))
+        return node
+
+    # a node by name, path or shape name, with any attribute or component after the dot dropped
+    def find(self, name):
+        if not isinstance(name, STRING_TYPES):
+            return None
+        name = name.split(".")[0].split("|")[-1]
+        if name in self.nodes:
+            return self.nodes[name]
+        if name.endswith("Shape") and name[:-5] in self.nodes:
+            return self.nodes[name[:-5]]
+        return None
+
+    def dirty(self, node):
+        for kind, callback in list(self.callbacks.values()):
+            if kind == ("dirty", node.name):
+                callback()
+
+    def remove(self, node):
+        for child in [other for other in self.nodes.values() if other.parent is node]:
+            self.remove(child)
+        self.dirty(node)
+        self.nodes.pop(node.name, None)
+        if node.name in self.selection:
+            self.selection.remove(node.name)
+
+    # object space points moved by the transform and its parents, rotations are left out
+    def worldPoints(self, node, points=None):
+        points = (node.points if points is None else points) * node.scale + node.translate
+        parent = node.parent
+        while parent is not None:
+            points = points * parent.scale + parent.translate
+            parent = parent.parent
+        return points
+
+    def localPoints(self, node, points):
+        chain = []
+        parent = node
+        while parent is not None:
+            chain.append(parent)
+            parent = parent.parent
+        for transform in reversed(chain):
+            points = (points - transform.translate) / transform.scale
+        return points
+
+
+# the scene every stand-in command works on
+scene = Scene()
+
+
+def reset():
+    global scene
+    scene = Scene()
+    return scene
+
+
+def names(items):
+    if items is None:
+        return []
+    if isinstance(items, (list, tuple)):
+        return [str(item) for item in items]
+    return [str(items)]
+
+
+def setMesh(node, points, faceCounts, faceConnects):
+    node.points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+    node.faceCounts = np.asarray(faceCounts, dtype=np.int64)
+    node.faceConnects = np.asarray(faceConnects, dtype=np.int64)
+
+
+class Cmds(object):
+    # maya.cmds: the commands the generator needs act on the scene, any other one is only recorded
+
+    def __getattr__(self, name):
+        def command(*args, **kwargs):
+            scene.record(name)
+            return None
+        return command
+
+    def polyPlane(self, n="pPlane1", w=1.0, h=1.0, sw=10, sh=10, **kwargs):
+        scene.record("polyPlane")
+        width = kwargs.get("width", w)
+        height = kwargs.get("height", h)
+        cols = kwargs.get("subdivisionsWidth", sw) + 1
+        rows = kwargs.get("subdivisionsHeight", sh) + 1
+        node = scene.add(kwargs.get("name", n), "transform", "mesh")
+        # rows run from +z to -z like maya's plane
+        x, z = np.meshgrid(np.linspace(-0.5, 0.5, cols) * width, np.linspace(0.5, -0.5, rows) * height)
+        quads = EnvHeightfield.gridQuads(rows, cols)[:, ::-1]
+        setMesh(node, np.column_stack([x.ravel(), np.zeros(x.size), z.ravel()]), np.full(len(quads), 4), quads.ravel())
+        history = scene.add("polyPlane1", "polyPlane")
+        history.attrs.update(subdivisionsWidth=cols - 1, subdivisionsHeight=rows - 1)
+        node.history = [history.name]
+        return [node.name, history.name]
+
+    def polyCube(self, name="pCube1", width=1.0, height=1.0, depth=1.0, **kwargs):
+        scene.record("polyCube")
+        node = scene.add(name, "transform", "mesh")
+        corners = (np.array([[i & 1, (i >> 1) & 1, (i >> 2) & 1] for i in range(8)]) - 0.5) * [width, height, depth]
+        quads = [[0, 4, 6, 2], [1, 3, 7, 5], [0, 1, 5, 4], [2, 6, 7, 3], [0, 2, 3, 1], [4, 5, 7, 6]]
+        setMesh(node, corners, [4] * 6, np.ravel(quads))
+        return [node.name]
+
+    # a b-spline through its cvs with a clamped uniform knot list, maya's short knot form
+    def curve(self, p=(), d=3, name="curve1", **kwargs):
+        scene.record("curve")
+        cvs = np.asarray(kwargs.get("point", p), dtype=np.float64)
+        degree = kwargs.get("degree", d)
+        spans = len(cvs) - degree
+        knots = [0.0] * (degree - 1) + list(range(spans + 1)) + [float(spans)] * (degree - 1)
+        node = scene.add(name, "transform", "nurbsCurve")
+        node.curve = (cvs, np.array(knots, dtype=np.float64), degree)
+        return node.name
+
+    def listHistory(self, node, **kwargs):
+        scene.record("listHistory")
+        found = scene.find(node)
+        return [found.name] + found.history if found else []
+
+    def ls(self, *args, **kwargs):
+        scene.record("ls")
+        items = names(args[0]) if args else list(scene.nodes)
+        if kwargs.get("selection") or kwargs.get("sl"):
+            items = list(scene.selection)
+        nodeType = kwargs.get("type")
+        if nodeType:
+            items = [item for item in items if scene.find(item) and scene.find(item).type == nodeType]
+        return [item for item in items if scene.find(item)]
+
+    def select(self, *args, **kwargs):
+        scene.record("select")
+        if kwargs.get("clear") or kwargs.get("cl"):
+            scene.selection = []
+            return
+        items = [scene.find(item).name for item in names(args[0] if args else None) if scene.find(item)]
+        if kwargs.get("add"):
+            scene.selection.extend(item for item in items if item not in scene.selection)
+        else:
+            scene.selection = items
+
+    def objExists(self, name):
+        scene.record("objExists")
+        return scene.find(name) is not None
+
+    def delete(self, *args, **kwargs):
+        scene.record("delete")
+        for item in (names(args[0]) if args else list(scene.selection)):
+            node = scene.find(item)
+            if node is not None and node.name in scene.nodes:
+                scene.remove(node)
+
+    def group(self, *args, **kwargs):
+        scene.record("group")
+        node = scene.add(kwargs.get("name", kwargs.get("n", "group1")), "transform")
+        if not kwargs.get("empty") and not kwargs.get("em"):
+            for item in names(args[0] if args else scene.selection):
+                scene.find(item).parent = node
+        return node.name
+
+    def parent(self, *args, **kwargs):
+        scene.record("parent")
+        items = []
+        for item in args[:-1]:
+            items.extend(names(item))
+        folder = scene.find(args[-1])
+        for item in items:
+            scene.find(item).parent = folder
+        return [scene.find(item).name for item in items]
+
+    def duplicate(self, name, **kwargs):
+        scene.record("duplicate")
+        source = scene.find(names(name)[0])
+        node = scene.add(source.name, source.type, source.shapeType)
+        node.attrs = dict(source.attrs)
+        node.translate, node.rotate, node.scale = source.translate.copy(), source.rotate.copy(), source.scale.copy()
+        if source.points is not None:
+            setMesh(node, source.points.copy(), source.faceCounts, source.faceConnects)
+        node.curve = source.curve
+        return [node.name]
+
+    # an instance shares the point array of its source
+    def instance(self, name, **kwargs):
+        scene.record("instance")
+        source = scene.find(names(name)[0])
+        node = scene.add(source.name, source.type, source.shapeType)
+        node.points, node.faceCounts, node.faceConnects = source.points, source.faceCounts, source.faceConnects
+        return [node.name]
+
+    def rename(self, old, new):
+        scene.record("rename")
+        node = scene.find(old)
+        if node is None:
+            node = scene.add(old, "transform")
+        del scene.nodes[node.name]
+        node.name = scene.unique(new)
+        scene.nodes[node.name] = node
+        return node.name
+
+    def setAttr(self, plug, *values, **kwargs):
+        scene.record("setAttr")
+        node = scene.find(plug)
+        attr = plug.split(".", 1)[1] if "." in plug else ""
+        if node is None:
+            return
+        if attr in ("translate", "rotate", "scale"):
+            setattr(node, attr, np.array(values, dtype=np.float64))
+            scene.dirty(node)
+        else:
+            node.attrs[attr] = values[0] if len(values) == 1 else values
+
+    def getAttr(self, plug, **kwargs):
+        scene.record("getAttr")
+        node = scene.find(plug)
+        attr = plug.split(".", 1)[1]
+        if attr in ("translate", "rotate", "scale"):
+            return [tuple(getattr(node, attr).tolist())]
+        axes = dict(translateX=("translate", 0), translateY=("translate", 1), translateZ=("translate", 2),
+                    rotateX=("rotate", 0), rotateY=("rotate", 1), rotateZ=("rotate", 2))
+        if attr in axes:
+            return float(getattr(node, axes[attr][0])[axes[attr][1]])
+        return node.attrs.get(attr, 0.0)
+
+    def xform(self, item, **kwargs):
+        scene.record("xform")
+        node = scene.find(item)
+        if ".vtx[" in item:
+            points = node.points if kwargs.get("objectSpace") else scene.worldPoints(node)
+            return points.ravel().tolist()
+        if kwargs.get("boundingBox"):
+            points = node.points if kwargs.get("objectSpace") else scene.worldPoints(node)
+            return points.min(axis=0).tolist() + points.max(axis=0).tolist()
+        return node.translate.tolist()
+
+    def exactWorldBoundingBox(self, item, **kwargs):
+        scene.record("exactWorldBoundingBox")
+        points = scene.worldPoints(scene.find(item))
+        return points.min(axis=0).tolist() + points.max(axis=0).tolist()
+
+    # values first, then the objects, the selection when there are none
+    def move(self, *args, **kwargs):
+        scene.record("move")
+        values = [value for value in args if not isinstance(value, STRING_TYPES + (list, tuple))]
+        offset = np.zeros(3)
+        offset[:len(values)] = values
+        for item in names(args[len(values)] if len(args) > len(values) else scene.selection):
+            node = scene.find(item)
+            node.translate = node.translate + offset if kwargs.get("relative") else offset
+            scene.dirty(node)
+
+    def currentTime(self, *args, **kwargs):
+        scene.record("currentTime")
+        if kwargs.get("query"):
+            return scene.time
+        scene.time = float(args[0])
+        return scene.time
+
+    def about(self, **kwargs):
+        scene.record("about")
+        return True
+
+    # the prompt answers with the name it suggests
+    def promptDialog(self, **kwargs):
+        scene.record("promptDialog")
+        if kwargs.get("query"):
+            return scene.prompt
+        scene.prompt = kwargs.get("text", "")
+        return "OK"
+
+    def directionalLight(self, name="directionalLight1", **kwargs):
+        scene.record("directionalLight")
+        node = scene.add(name, "transform", "directionalLight")
+        node.rotate = np.array(kwargs.get("rotation", (0, 0, 0)), dtype=np.float64)
+        return node.name + "Shape"
+
+    def shadingNode(self, nodeType, **kwargs):
+        scene.record("shadingNode")
+        return scene.add(kwargs.get("name", nodeType + "1"), nodeType).name
+
+    def Create3DContainerEmitter(self, *args, **kwargs):
+        scene.record("Create3DContainerEmitter")
+        scene.add("fluid1", "transform", "fluidShape")
+
+    def emitter(self, **kwargs):
+        scene.record("emitter")
+        node = scene.add(kwargs.get("name", "emitter1"), "pointEmitter")
+        return [node.name]
+
+    def nParticle(self, **kwargs):
+        scene.record("nParticle")
+        node = scene.add(kwargs.get("name", "nParticle1"), "transform", "nParticle")
+        return [node.name, node.name + "Shape"]
+
+    def particle(self, **kwargs):
+        scene.record("particle")
+        node = scene.add(kwargs.get("name", "particle1"), "transform", "particle")
+        return [node.name, node.name + "Shape"]
+
+    def particleInstancer(self, *args, **kwargs):
+        scene.record("particleInstancer")
+        return scene.add("instancer1", "instancer").name
+
+    def listRelatives(self, item, **kwargs):
+        scene.record("listRelatives")
+        node = scene.find(item)
+        if node is None:
+            return None
+        if kwargs.get("shapes"):
+            return [node.name + "Shape"] if node.shapeType else None
+        if kwargs.get("parent") or kwargs.get("allParents"):
+            return [node.parent.name] if node.parent else None
+        return [child.name for child in scene.nodes.values() if child.parent is node] or None
+
+    # the plane's far edge extruded along the curve: a strip of quads the plane's width wide
+    def polyExtrudeEdge(self, edge, inputCurve=None, divisions=1, **kwargs):
+        scene.record("polyExtrudeEdge")
+        node = scene.find(edge)
+        cvs, knots, degree = scene.find(inputCurve).curve
+        line = EnvCurve.getSampler(cvs, knots, degree).sampleFractions(np.linspace(0.0, 1.0, divisions + 1))[0]
+        width = node.points[:, 0].max() - node.points[:, 0].min()
+        points, quads = EnvRoadNetwork.stripMesh(line, width * 0.5)
+        setMesh(node, points, np.full(len(quads), 4), quads.ravel())
+        return [node.name + "_polyExtrudeEdge1"]
+
+
+class Mel(object):
+    # maya.mel: scripts are recorded by the command they run, globals read back empty
+    def eval(self, script):
+        words = script.replace(";", " ").split()
+        scene.record("mel " + (words[0] if words else ""))
+        return ""
+
+
+class MObject(object):
+    def __init__(self, name):
+        self.name = name
+
+
+class MPoint(object):
+    def __init__(self, x=0.0, y=0.0, z=0.0):
+        self.x, self.y, self.z = x, y, z
+
+
+class MSpace(object):
+    kObject = 2
+    kWorld = 4
+
+
+class MFn(object):
+    kTransform = 110
+
+
+class MDagPath(object):
+    def __init__(self, other=None):
+        self.name = other.name if other else None
+        self.shape = other.shape if other else False
+
+    def hasFn(self, kind):
+        return kind == MFn.kTransform and not self.shape
+
+    def extendToShape(self):
+        self.shape = scene.find(self.name).shapeType is not None
+
+    def pop(self):
+        self.shape = False
+
+    def node(self):
+        return MObject(self.name + "Shape" if self.shape else self.name)
+
+    def fullPathName(self):
+        node = scene.find(self.name)
+        path = []
+        while node is not None:
+            path.append(node.name)
+            node = node.parent
+        return "|" + "|".join(reversed(path)) + ("|%sShape" % self.name if self.shape else "")
+
+
+class MSelectionList(object):
+    def __init__(self):
+        self.items = []
+
+    def add(self, name):
+        self.items.append(name)
+
+    def getDagPath(self, index):
+        path = MDagPath()
+        path.name = scene.find(self.items[index]).name
+        path.shape = self.items[index].endswith("Shape")
+        return path
+
+
+class MFnMesh(object):
+    def __init__(self, path=None):
+        self.node = scene.find(path.name) if path is not None else None
+
+    def create(self, points, faceCounts, faceConnects):
+        self.node = scene.add("polySurface1", "transform", "mesh")
+        setMesh(self.node, [tuple(point) for point in points], list(faceCounts), list(faceConnects))
+        return MObject(self.node.name)
+
+    def setPoints(self, points, space=MSpace.kObject):
+        points = np.array([tuple(point) for point in points], dtype=np.float64)
+        if space == MSpace.kWorld:
+            points = scene.localPoints(self.node, points)
+        self.node.points = points
+        scene.dirty(self.node)
+
+    def updateSurface(self):
+        pass
+
+    def getVertices(self):
+        return self.node.faceCounts.tolist(), self.node.faceConnects.tolist()
+
+    def setUVs(self, us, vs):
+        self.node.uvs = np.column_stack([list(us), list(vs)])
+
+    def assignUVs(self, uvCounts, uvIds):
+        self.node.uvIds = np.array(list(uvIds))
+
+    # fan triangles of every face
+    def getTriangles(self):
+        triangles = []
+        start = 0
+        for count in self.node.faceCounts.tolist():
+            face = self.node.faceConnects[start:start + count].tolist()
+            for corner in range(1, count - 1):
+                triangles.extend([face[0], face[corner], face[corner + 1]])
+            start += count
+        return [count - 2 for count in self.node.faceCounts.tolist()], triangles
+
+    @property
+    def numVertices(self):
+        return len(self.node.points)
+
+    @property
+    def numPolygons(self):
+        return len(self.node.faceCounts)
+
+    @property
+    def numFaceVertices(self):
+        return len(self.node.faceConnects)
+
+    @property
+    def numEdges(self):
+        return self.numFaceVertices
+
+    def numUVs(self):
+        return 0
+
+
+class MFnNurbsCurve(object):
+    kOpen = 1
+    kClosed = 2
+    kPeriodic = 3
+
+    def __init__(self, path):
+        self.node = scene.find(path.name)
+        self.degree = self.node.curve[2]
+        self.form = self.kOpen
+
+    def cvPositions(self, space=MSpace.kObject):
+        cvs = self.node.curve[0]
+        if space == MSpace.kWorld:
+            cvs = scene.worldPoints(self.node, cvs)
+        return [MPoint(*cv) for cv in cvs.tolist()]
+
+    def knots(self):
+        return self.node.curve[1].tolist()
+
+
+class MFnDependencyNode(object):
+    def __init__(self, obj):
+        self.obj = obj
+
+    @property
+    def typeName(self):
+        node = scene.find(self.obj.name)
+        if node is None:
+            return "unknown"
+        return node.shapeType if self.obj.name.endswith("Shape") and node.shapeType else node.type
+
+
+class MFnDagNode(MFnDependencyNode):
+    def setName(self, name):
+        return Cmds().rename(self.obj.name, name)
+
+
+class MMessage(object):
+    @staticmethod
+    def removeCallback(callbackId):
+        scene.callbacks.pop(callbackId, None)
+
+    @staticmethod
+    def removeCallbacks(callbackIds):
+        for callbackId in callbackIds:
+            scene.callbacks.pop(callbackId, None)
+
+
+def addCallback(kind, callback):
+    callbackId = scene.nextCallback
+    scene.nextCallback += 1
+    scene.callbacks[callbackId] = (kind, callback)
+    return callbackId
+
+
+class MNodeMessage(MMessage):
+    @staticmethod
+    def addNodeDirtyCallback(obj, callback):
+        return addCallback(("dirty", scene.find(obj.name).name), callback)
+
+
+class MDGMessage(MMessage):
+    @staticmethod
+    def addNodeAddedCallback(callback, nodeType="dependNode"):
+        return addCallback(("added", nodeType), callback)
+
+
+# stand-in maya, maya.cmds, maya.mel and maya.api.OpenMaya modules, put where import finds them
+def install():
+    openMaya = types.ModuleType("maya.api.OpenMaya")
+    for value in (MObject, MPoint, MSpace, MFn, MDagPath, MSelectionList, MFnMesh, MFnNurbsCurve,
+                  MFnDependencyNode, MFnDagNode, MMessage, MNodeMessage, MDGMessage):
+        setattr(openMaya, value.__name__, value)
+    openMaya.MPointArray = list
+    openMaya.MIntArray = list
+    openMaya.MFloatArray = list
+    api = types.ModuleType("maya.api")
+    api.OpenMaya = openMaya
+    maya = types.ModuleType("maya")
+    maya.cmds = Cmds()
+    maya.mel = Mel()
+    maya.api = api
+    sys.modules.update({"maya": maya, "maya.cmds": maya.cmds, "maya.mel": maya.mel,
+                        "maya.api": api, "maya.api.OpenMaya": openMaya})
+    return maya
+
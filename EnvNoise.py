@@ -0,0 +1,147 @@
+'''
+Environment Generator Project
+Noise terrain: fractal simplex noise computed as independent, edge sharing tiles
+'''
+
+from __future__ import division
+from collections import OrderedDict
+import numpy as np
+import EnvRandom
+import EnvParallel
+
+# number of computed tiles kept around
+CACHE_TILES = 64
+
+# simplex skew factors in 2d
+SKEW = 0.5 * (np.sqrt(3.0) - 1.0)
+UNSKEW = (3.0 - np.sqrt(3.0)) / 6.0
+# twelve gradient directions, as in the 3d edge set seen from above
+GRADIENTS = np.array([[1, 1], [-1, 1], [1, -1], [-1, -1], [1, 0], [-1, 0],
+                      [1, 0], [-1, 0], [0, 1], [0, -1], [0, 1], [0, -1]], dtype=np.float64)
+
+
+# permutation table of a seed, doubled so lookups never need wrapping
+def permutation(seed):
+    table = EnvRandom.stream(seed, "noise").permutation(256)
+    return np.concatenate([table, table])
+
+
+# 2d simplex noise at many points at once, roughly -1 to 1
+def simplex(x, z, perm):
+    x = np.asarray(x, dtype=np.float64)
+    z = np.asarray(z, dtype=np.float64)
+    skew = (x + z) * SKEW
+    i = np.floor(x + skew).astype(np.int64)
+    j = np.floor(z + skew).astype(np.int64)
+    unskew = (i + j) * UNSKEW
+    x0 = x - (i - unskew)
+    z0 = z - (j - unskew)
+    # which of the two triangles of the skewed cell the point is in
+    upper = (x0 > z0).astype(np.int64)
+    corners = ((x0, z0, 0, 0),
+               (x0 - upper + UNSKEW, z0 - (1 - upper) + UNSKEW, upper, 1 - upper),
+               (x0 - 1.0 + 2.0 * UNSKEW, z0 - 1.0 + 2.0 * UNSKEW, 1, 1))
+    ii = i & 255
+    jj = j & 255
+    total = np.zeros(x.shape)
+    for dx, dz, di, dj in corners:
+        gradient = GRADIENTS[perm[ii + di + perm[jj + dj]] % 12]
+        falloff = np.maximum(0.5 - dx * dx - dz * dz, 0.0)
+        total += falloff ** 4 * (gradient[..., 0] * dx + gradient[..., 1] * dz)
+    return 70.0 * total
+
+
+# fractal sum of noise octaves, each twice as fine and half as strong by default
+# ridged turns every octave into sharp crests, roughly 0 to 1 instead of -1 to 1
+def fbm(x, z, perm, octaves=6, lacunarity=2.0, gain=0.5, ridged=False):
+    total = np.zeros(np.shape(x))
+    amplitude = 1.0
+    frequency = 1.0
+    norm = 0.0
+    for octave in range(octaves):
+        # every octave is moved so their lattices do not line up
+        layer = simplex(x * frequency + octave * 17.31, z * frequency - octave * 9.17, perm)
+        if ridged:
+            layer = (1.0 - np.abs(layer)) ** 2
+        total += amplitude * layer
+        norm += amplitude
+        amplitude *= gain
+        frequency *= lacunarity
+    return total / norm
+
+
+class NoiseTerrain(object):
+    # a terrain of tiles, each tileDivisions cells square, with spacing between vertices
+    # featureSize is the size of the largest hills, warp bends the noise by up to that many feature sizes
+    def __init__(self, seed=1, tileDivisions=64, spacing=1.0, height=10.0, featureSize=100.0, 
+                 octaves=6, ridged=False, warp=0.0):
+        self.seed = seed
+        self.tileDivisions = int(tileDivisions)
+        self.spacing = float(spacing)
+        self.height = float(height)
+        self.featureSize = float(featureSize)
+        self.octaves = int(octaves)
+        self.ridged = ridged
+        self.warp = float(warp)
+        self.perm = permutation(seed)
+        self.cache = OrderedDict()
+
+    # world xz of the vertices of a tile, the last row and column are the next tile's first
+    def tileCoords(self, row, col):
+        steps = np.arange(self.tileDivisions + 1)
+        x = (col * self.tileDivisions + steps) * self.spacing
+        z = (row * self.tileDivisions + steps) * self.spacing
+        return np.meshgrid(x, z)
+
+    # heights of one tile, (tileDivisions + 1) square, from its world position only
+    # so neighbouring tiles give the same heights along the edge they share
+    def tileHeights(self, row, col):
+        x, z = self.tileCoords(row, col)
+        x = x / self.featureSize
+        z = z / self.featureSize
+        if self.warp > 0:
+            # domain warp: look the noise up somewhere else, pushed by two more noise fields
+            pushX = fbm(x + 5.2, z + 1.3, self.perm, 3)
+            pushZ = fbm(x - 8.3, z + 2.8, self.perm, 3)
+            x = x + self.warp * pushX
+            z = z + self.warp * pushZ
+        return self.height * fbm(x, z, self.perm, self.octaves, ridged=self.ridged)
+
+    # heights of a tile, kept for a while in case it is asked for again
+    def tile(self, row, col):
+        key = (row, col)
+        heights = self.cache.pop(key, None)
+        if heights is None:
+            heights = self.tileHeights(row, col)
+        self.store(key, heights)
+        return heights
+
+    def store(self, key, heights):
+        self.cache[key] = heights
+        while len(self.cache) > CACHE_TILES:
+            self.cache.popitem(last=False)
+
+    # (row, col, heights) of many tiles in order, missing ones computed in worker processes
+    # each tile is handed out as soon as it is ready, so the whole terrain never sits in memory
+    def tiles(self, keys, workers=None):
+        keys = list(keys)
+        # tiles already cached are held on to here, as computing the others may push them out
+        ready = dict((key, self.cache[key]) for key in keys if key in self.cache)
+        missing = [key for key in keys if key not in ready]
+        computed = EnvParallel.mapJobs(_tileJob, [(self.settings(), key) for key in missing], workers)
+        for key in keys:
+            heights = ready[key] if key in ready else next(computed)
+            self.store(key, heights)
+            yield key[0], key[1], heights
+
+    # everything needed to rebuild this terrain in a worker
+    def settings(self):
+        return (self.seed, self.tileDivisions, self.spacing, self.height, self.featureSize, 
+                self.octaves, self.ridged, self.warp)
+
+
+# one tile in a worker process
+def _tileJob(job):
+    settings, key = job
+    return NoiseTerrain(*settings).tileHeights(*key)
+
@@ -0,0 +1,56 @@
+'''
+Environment Generator Project
+Process pools for the tiled stages, usable inside Maya and from a plain python
+'''
+
+from __future__ import division
+import itertools
+import multiprocessing
+import os
+import sys
+from collections import deque
+
+
+# processes to use when the caller does not say
+def defaultWorkers():
+    return max(multiprocessing.cpu_count() - 1, 1)
+
+
+# inside maya the interpreter is maya itself, so workers have to be started with mayapy
+def useMayaPython():
+    name = os.path.basename(sys.executable).lower()
+    if not name.startswith("maya") or name.startswith("mayapy"):
+        return
+    folder = os.path.dirname(sys.executable)
+    for mayapy in ("mayapy.exe", "mayapy"):
+        if os.path.exists(os.path.join(folder, mayapy)):
+            multiprocessing.set_executable(os.path.join(folder, mayapy))
+            return
+
+
+# results of function over jobs in order, handed out as each one is ready
+# jobs go to the pool a window at a time, about two per worker, so only those jobs and their results are held at once
+# one worker, or one job, runs right here without a pool
+def mapJobs(function, jobs, workers=None):
+    workers = defaultWorkers() if workers is None else workers
+    jobs = iter(jobs)
+    # the first jobs decide whether a pool is worth starting
+    first = list(itertools.islice(jobs, max(workers, 2)))
+    if workers <= 1 or len(first) <= 1:
+        for job in itertools.chain(first, jobs):
+            yield function(job)
+        return
+    useMayaPython()
+    size = min(workers, len(first))
+    pool = multiprocessing.Pool(size)
+    try:
+        window = deque()
+        for job in itertools.chain(first, jobs):
+            window.append(pool.apply_async(function, (job,)))
+            if len(window) >= size * 2:
+                yield window.popleft().get()
+        while window:
+            yield window.popleft().get()
+    finally:
+        pool.terminate()
+        pool.join()
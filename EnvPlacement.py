@@ -0,0 +1,111 @@
+'''
+Environment Generator Project
+Placement: overlap-free footprints with a uniform grid spatial hash
+'''
+
+from __future__ import division
+import math
+import numpy as np
+
+# overlap handling: 1 allow, 2 drop the overlapping copy, 3 push it aside
+OVERLAP_ALLOW = 1
+OVERLAP_DROP = 2
+OVERLAP_PUSH = 3
+
+
+class SpatialHash(object):
+    # uniform grid of cells on the xz plane, each holding the footprints whose centre falls in it
+    def __init__(self, cellSize):
+        self.cellSize = float(cellSize)
+        self.cells = {}
+        self.maxRadius = 0.0
+
+    def cellOf(self, x, z):
+        return int(math.floor(x / self.cellSize)), int(math.floor(z / self.cellSize))
+
+    def insert(self, item, x, z, radius):
+        self.cells.setdefault(self.cellOf(x, z), []).append(item)
+        self.maxRadius = max(self.maxRadius, radius)
+
+    # everything that could touch a circle of this radius
+    def query(self, x, z, radius):
+        reach = radius + self.maxRadius
+        x0, z0 = self.cellOf(x - reach, z - reach)
+        x1, z1 = self.cellOf(x + reach, z + reach)
+        for i in range(x0, x1 + 1):
+            for j in range(z0, z1 + 1):
+                for item in self.cells.get((i, j), ()):
+                    yield item
+
+
+# separating axis test of two oriented rectangles
+# a footprint is (centre x, centre z, half width, half depth, x axis x, x axis z, radius)
+# returns None when apart, else the smallest push (depth, push x, push z) moving a out of b
+def rectPenetration(a, b):
+    dx = a[0] - b[0]
+    dz = a[1] - b[1]
+    best = None
+    for ax, az in ((a[4], a[5]), (-a[5], a[4]), (b[4], b[5]), (-b[5], b[4])):
+        # the z axis of a footprint is its x axis turned a quarter
+        reachA = a[2] * abs(a[4] * ax + a[5] * az) + a[3] * abs(-a[5] * ax + a[4] * az)
+        reachB = b[2] * abs(b[4] * ax + b[5] * az) + b[3] * abs(-b[5] * ax + b[4] * az)
+        distance = dx * ax + dz * az
+        depth = reachA + reachB - abs(distance)
+        if depth <= 0:
+            return None
+        if best is None or depth < best[0]:
+            sign = 1.0 if distance >= 0 else -1.0
+            best = (depth, ax * sign, az * sign)
+    return best
+
+
+# keep footprints that do not overlap, checking each against the already placed ones
+# pivots: (n, 2) xz positions, offsets: (n, 2) footprint centre relative to the pivot in local space
+# halfSizes: (n, 2) footprint half width/depth, yaw: (n,) degrees around y
+def placeWithoutOverlap(pivots, offsets, halfSizes, yaw, mode=OVERLAP_DROP, spacing=0.0,
+                        relaxSteps=4, grid=None):
+    pivots = np.array(pivots, dtype=np.float64)
+    count = len(pivots)
+    keep = np.ones(count, dtype=bool)
+    if mode == OVERLAP_ALLOW or count == 0:
+        return keep, pivots
+    half = np.asarray(halfSizes, dtype=np.float64) + spacing * 0.5
+    angle = np.radians(yaw)
+    xAxes = np.stack([np.cos(angle), -np.sin(angle)], axis=1)
+    zAxes = np.stack([np.sin(angle), np.cos(angle)], axis=1)
+    offsets = np.asarray(offsets, dtype=np.float64)
+    shift = offsets[:, :1] * xAxes + offsets[:, 1:] * zAxes
+    centres = pivots + shift
+    radii = np.hypot(half[:, 0], half[:, 1])
+    if grid is None:
+        # cells about one footprint across keep every query to a handful of cells
+        grid = SpatialHash(max(2.0 * float(np.median(radii)), 1e-6))
+    steps = relaxSteps if mode == OVERLAP_PUSH else 0
+    # plain floats are much quicker than tiny arrays in the per footprint loop
+    rows = np.column_stack([centres, half, xAxes, radii]).tolist()
+    for i, footprint in enumerate(rows):
+        for step in range(steps + 1):
+            pushX = pushZ = 0.0
+            hits = 0
+            for other in grid.query(footprint[0], footprint[1], footprint[6]):
+                if math.hypot(footprint[0] - other[0], footprint[1] - other[1]) >= footprint[6] + other[6]:
+                    continue
+                hit = rectPenetration(footprint, other)
+                if hit is not None:
+                    pushX += hit[1] * hit[0]
+                    pushZ += hit[2] * hit[0]
+                    hits += 1
+            if not hits:
+                break
+            if step == steps:
+                keep[i] = False
+                break
+            # move out of the overlaps, a little further so touching edges do not count
+            if pushX == 0.0 and pushZ == 0.0:
+                pushX, pushZ = footprint[4] * footprint[2], footprint[5] * footprint[2]
+            footprint[0] += pushX * 1.001
+            footprint[1] += pushZ * 1.001
+        if keep[i]:
+            grid.insert(footprint, footprint[0], footprint[1], footprint[6])
+    centres = np.array(rows)[:, :2] if rows else centres
+    return keep, centres - shift
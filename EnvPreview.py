@@ -0,0 +1,87 @@
+'''
+Environment Generator Project
+Live preview: debounced slider changes, a detail level steered by update time, proxy box meshes
+'''
+
+from __future__ import division
+import time
+import numpy as np
+
+# seconds the sliders have to stay still before the preview is made
+DELAY = 0.1
+# seconds a preview update should take
+TARGET = 0.1
+
+# corners of a unit box, bit 0 picks x, bit 1 y and bit 2 z
+BOX_CORNERS = np.array([[i & 1, (i >> 1) & 1, (i >> 2) & 1] for i in range(8)], dtype=np.float64)
+# quads of a box wound so the faces point out
+BOX_QUADS = np.array([[0, 4, 6, 2], [1, 3, 7, 5], [0, 1, 5, 4], [2, 6, 7, 3], [0, 2, 3, 1], [4, 5, 7, 6]])
+
+
+class Debounce(object):
+    # waits until the last change is delay seconds old
+    def __init__(self, delay=DELAY, clock=time.time):
+        self.delay = delay
+        self.clock = clock
+        self.due = None
+
+    def touch(self):
+        self.due = self.clock() + self.delay
+
+    # seconds still to wait, 0 once it is time, None when nothing changed
+    def wait(self):
+        if self.due is None:
+            return None
+        return max(self.due - self.clock(), 0.0)
+
+    def fire(self):
+        self.due = None
+
+
+class Detail(object):
+    # fraction of the full resolution a preview is made at, steered so an update takes about target seconds
+    def __init__(self, target=TARGET, start=0.5, low=0.02, high=1.0):
+        self.target = target
+        self.value = start
+        self.low = low
+        self.high = high
+
+    # time a preview took at the current detail, the time grows about with the square of the detail
+    def took(self, seconds):
+        ratio = np.sqrt(self.target / max(seconds, 1e-6))
+        self.value = float(np.clip(self.value * np.clip(ratio, 0.5, 2.0), self.low, self.high))
+
+    # keep every stride-th sample
+    def stride(self):
+        return int(np.ceil(1.0 / self.value))
+
+
+# rotation matrices of maya xyz euler angles in degrees, for row vectors: p' = p . R
+def eulerMatrices(rotates):
+    x, y, z = np.radians(np.asarray(rotates, dtype=np.float64)).T
+    count = len(x)
+    matrices = np.zeros((3, count, 3, 3))
+    for axis, angle in enumerate((x, y, z)):
+        cos, sin = np.cos(angle), np.sin(angle)
+        a, b = [i for i in range(3) if i != axis]
+        # y turns the other way round in row vector form
+        sign = -1.0 if axis == 1 else 1.0
+        matrices[axis, :, axis, axis] = 1.0
+        matrices[axis, :, a, a] = cos
+        matrices[axis, :, b, b] = cos
+        matrices[axis, :, a, b] = sin * sign
+        matrices[axis, :, b, a] = -sin * sign
+    return np.einsum("nij,njk,nkl->nil", matrices[0], matrices[1], matrices[2])
+
+
+# one mesh of boxes: bounds (n, 6) min xyz then max xyz in object space, placed by the copy transforms
+# returns points, face vertex counts and face vertex ids, ready for a single mesh create
+def boxMesh(bounds, translates, rotates, scales):
+    bounds = np.asarray(bounds, dtype=np.float64)
+    count = len(bounds)
+    corners = bounds[:, None, :3] + BOX_CORNERS[None] * (bounds[:, 3:] - bounds[:, :3])[:, None]
+    corners = corners * np.asarray(scales, dtype=np.float64)[:, None]
+    corners = np.einsum("nci,nij->ncj", corners, eulerMatrices(rotates))
+    corners += np.asarray(translates, dtype=np.float64)[:, None]
+    quads = BOX_QUADS[None] + 8 * np.arange(count)[:, None, None]
+    return corners.reshape(-1, 3), np.full(count * 6, 4), quads.ravel()
@@ -0,0 +1,152 @@
+'''
+Environment Generator Project
+Profiling: wall time per stage, maya command calls and created nodes, reported as json
+'''
+
+from __future__ import division
+import functools
+import json
+import time
+from collections import OrderedDict
+
+# stage that commands run outside any stage are counted against
+OUTSIDE = "outside stages"
+
+
+class Profiler(object):
+    # stages nest, commands and nodes count against the innermost running stage
+    # and the time of a stage includes the stages it runs
+    def __init__(self, clock=time.time):
+        self.clock = clock
+        self.active = False
+        # called when an outermost stage has finished
+        self.listener = None
+        self.reset()
+
+    def reset(self):
+        self.stages = OrderedDict()
+        self.running = []
+
+    def record(self, stage):
+        if stage not in self.stages:
+            self.stages[stage] = dict(calls=0, seconds=0.0, commands={}, nodes={})
+        return self.stages[stage]
+
+    def current(self):
+        return self.record(self.running[-1] if self.running else OUTSIDE)
+
+    def enter(self, stage):
+        self.running.append(stage)
+        return self.clock()
+
+    def leave(self, stage, started):
+        record = self.record(stage)
+        record["calls"] += 1
+        record["seconds"] += self.clock() - started
+        self.running.pop()
+        if not self.running and self.listener:
+            # whatever the listener does is not part of the stage
+            self.active = False
+            try:
+                self.listener()
+            finally:
+                self.active = True
+
+    def command(self, name, seconds):
+        commands = self.current()["commands"]
+        count, total = commands.get(name, (0, 0.0))
+        commands[name] = (count + 1, total + seconds)
+
+    def nodeAdded(self, nodeType):
+        if not self.active:
+            return
+        nodes = self.current()["nodes"]
+        nodes[nodeType] = nodes.get(nodeType, 0) + 1
+
+    # a function that counts its calls and their time while profiling is on
+    def counted(self, name, function):
+        def call(*args, **kwargs):
+            if not self.active:
+                return function(*args, **kwargs)
+            # mel.eval is counted by the command it runs
+            label = name
+            if name.endswith(".eval") and args:
+                words = str(args[0]).replace(";", " ").split()
+                label = "%s %s" % (name, words[0]) if words else name
+            started = self.clock()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.command(label, self.clock() - started)
+        return call
+
+    # a stand-in for a module such as maya.cmds whose functions are counted
+    def wrap(self, module, prefix):
+        return CountedModule(self, module, prefix)
+
+    # decorator timing a stage method while profiling is on
+    def stage(self, name):
+        def decorate(function):
+            @functools.wraps(function)
+            def run(*args, **kwargs):
+                if not self.active:
+                    return function(*args, **kwargs)
+                started = self.enter(name)
+                try:
+                    return function(*args, **kwargs)
+                finally:
+                    self.leave(name, started)
+            return run
+        return decorate
+
+    # everything recorded, commands and node types sorted by time and count
+    def report(self):
+        stages = OrderedDict()
+        for name, record in self.stages.items():
+            commands = sorted(record["commands"].items(), key=lambda item: -item[1][1])
+            nodes = sorted(record["nodes"].items(), key=lambda item: -item[1])
+            stages[name] = OrderedDict([
+                ("calls", record["calls"]),
+                ("seconds", record["seconds"]),
+                ("commandCalls", sum(count for count, seconds in record["commands"].values())),
+                ("commandSeconds", sum(seconds for count, seconds in record["commands"].values())),
+                ("nodesCreated", sum(record["nodes"].values())),
+                ("commands", OrderedDict((command, OrderedDict([("count", count), ("seconds", seconds)]))
+                                         for command, (count, seconds) in commands)),
+                ("nodes", OrderedDict(nodes))])
+        return OrderedDict([("time", time.strftime("%Y-%m-%dT%H:%M:%S")), ("stages", stages)])
+
+    def writeReport(self, path):
+        with open(path, "w") as handle:
+            json.dump(self.report(), handle, indent=2)
+
+    # a few lines per stage for the ui: time, command calls, nodes and the slowest commands
+    def summary(self, top=3):
+        lines = []
+        for name, record in self.report()["stages"].items():
+            lines.append("%s: %d calls, %.3f s, %d commands (%.3f s), %d nodes" % (
+                name, record["calls"], record["seconds"], record["commandCalls"], 
+                record["commandSeconds"], record["nodesCreated"]))
+            for command, counts in list(record["commands"].items())[:top]:
+                lines.append("    %s x%d %.3f s" % (command, counts["count"], counts["seconds"]))
+        return "\n".join(lines)
+
+
+class CountedModule(object):
+    # functions are wrapped on first use and kept, so later lookups cost no more than on the module
+    def __init__(self, profiler, module, prefix):
+        self._profiler = profiler
+        self._module = module
+        self._prefix = prefix
+
+    def __getattr__(self, name):
+        value = getattr(self._module, name)
+        if callable(value):
+            value = self._profiler.counted("%s.%s" % (self._prefix, name), value)
+        setattr(self, name, value)
+        return value
+
+
+# the profiler all stages report to
+profiler = Profiler()
+stage = profiler.stage
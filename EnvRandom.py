@@ -0,0 +1,34 @@
+'''
+Environment Generator Project
+Random streams: every stage, tile and curve draws from its own seeded generator
+'''
+
+from __future__ import division
+import hashlib
+import numpy as np
+
+# largest seed the seed fields take
+MAX_SEED = 2 ** 31 - 1
+
+
+# seed words of a named stream, depending only on the master seed and the names
+# so a stream gives the same numbers whichever worker asks for it and in whatever order
+def streamSeed(seed, *names):
+    key = u"/".join([u"%d" % int(seed)] + [u"%s" % (name,) for name in names])
+    digest = hashlib.sha256(key.encode("utf-8")).digest()
+    return np.frombuffer(digest[:16], dtype="<u4").astype(np.uint32)
+
+
+# generator of a named stream, e.g. stream(seed, "terrain") or stream(seed, "building", curve)
+def stream(seed, *names):
+    return np.random.RandomState(streamSeed(seed, *names))
+
+
+# generator of one tile of a tiled stage
+def tileStream(seed, stage, row, column):
+    return stream(seed, stage, "tile", row, column)
+
+
+# a fresh master seed for when the user wants something new
+def newSeed():
+    return int(np.random.randint(1, MAX_SEED))
@@ -0,0 +1,301 @@
+'''
+Environment Generator Project
+Road network: one graph and one clean mesh from many road curves
+'''
+
+from __future__ import division
+import numpy as np
+
+# distance under which two road points count as the same junction
+SNAP = 1e-3
+
+
+# all crossings between 2d segments, bucketed on a uniform grid so only neighbours are tested
+# segments: (m, 4) x0 z0 x1 z1, returns segment a, segment b and the position along each
+def segmentCrossings(segments):
+    segments = np.asarray(segments, dtype=np.float64)
+    count = len(segments)
+    if count < 2:
+        empty = np.zeros(0)
+        return empty.astype(int), empty.astype(int), empty, empty
+    start = segments[:, :2]
+    end = segments[:, 2:]
+    # cells the size of a typical segment, longer segments cut into pieces no longer than a cell
+    # so a piece touches at most 2x2 cells and one long road cannot put everything in the same cells
+    lengths = np.sqrt(((end - start) ** 2).sum(axis=1))
+    cellSize = max(np.median(lengths), SNAP)
+    pieces = np.maximum(np.ceil(lengths / cellSize), 1).astype(np.int64)
+    owner = np.repeat(np.arange(count), pieces)
+    first = np.arange(len(owner)) - np.repeat(np.cumsum(pieces) - pieces, pieces)
+    step = (end - start)[owner] / pieces[owner][:, None]
+    pieceStart = start[owner] + step * first[:, None]
+    pieceEnd = pieceStart + step
+    low = np.floor(np.minimum(pieceStart, pieceEnd) / cellSize).astype(np.int64)
+    high = np.floor(np.maximum(pieceStart, pieceEnd) / cellSize).astype(np.int64)
+    ids = []
+    cells = []
+    for dx in (0, 1):
+        for dz in (0, 1):
+            cell = low + (dx, dz)
+            inside = (cell[:, 0] <= high[:, 0]) & (cell[:, 1] <= high[:, 1])
+            ids.append(owner[inside])
+            cells.append(cell[inside])
+    ids = np.concatenate(ids)
+    cells = np.concatenate(cells)
+    cellKey = cells[:, 0] * 73856093 ^ cells[:, 1] * 19349663
+    order = np.lexsort((ids, cellKey))
+    ids = ids[order]
+    cellKey = cellKey[order]
+    # candidate pairs: every two segments sharing a cell
+    bounds = np.nonzero(np.diff(cellKey))[0] + 1
+    groups = np.split(ids, bounds)
+    pairA = []
+    pairB = []
+    for group in groups:
+        if len(group) > 1:
+            a, b = np.triu_indices(len(group), 1)
+            pairA.append(group[a])
+            pairB.append(group[b])
+    if not pairA:
+        empty = np.zeros(0)
+        return empty.astype(int), empty.astype(int), empty, empty
+    pairs = np.sort(np.column_stack([np.concatenate(pairA), np.concatenate(pairB)]), axis=1)
+    # pieces of one segment share cells with each other, and two segments can share many cells
+    pairs = np.unique(pairs[pairs[:, 0] != pairs[:, 1]], axis=0)
+    if not len(pairs):
+        empty = np.zeros(0)
+        return empty.astype(int), empty.astype(int), empty, empty
+    a, b = pairs[:, 0], pairs[:, 1]
+    # exact test of the candidates all at once
+    dirA = end[a] - start[a]
+    dirB = end[b] - start[b]
+    gap = start[b] - start[a]
+    denom = dirA[:, 0] * dirB[:, 1] - dirA[:, 1] * dirB[:, 0]
+    parallel = np.abs(denom) < 1e-12
+    safe = np.where(parallel, 1.0, denom)
+    alongA = (gap[:, 0] * dirB[:, 1] - gap[:, 1] * dirB[:, 0]) / safe
+    alongB = (gap[:, 0] * dirA[:, 1] - gap[:, 1] * dirA[:, 0]) / safe
+    eps = 1e-9
+    hit = ~parallel & (alongA >= -eps) & (alongA <= 1 + eps) & (alongB >= -eps) & (alongB <= 1 + eps)
+    return a[hit], b[hit], np.clip(alongA[hit], 0, 1), np.clip(alongB[hit], 0, 1)
+
+
+# cut polylines at every crossing and merge shared points into graph nodes
+# polylines: list of (k, 3) xyz arrays, returns node xyz (n, 3) and edges (e, 2)
+def planarGraph(polylines, snap=SNAP):
+    segments = []
+    for line in polylines:
+        line = np.asarray(line, dtype=np.float64)
+        segments.append(np.column_stack([line[:-1], line[1:]]))
+    segments = np.concatenate(segments) if segments else np.zeros((0, 6))
+    a, b, alongA, alongB = segmentCrossings(segments[:, [0, 2, 3, 5]])
+    # every segment keeps its ends plus the crossings on it
+    segIds = np.concatenate([np.arange(len(segments)), np.arange(len(segments)), a, b])
+    along = np.concatenate([np.zeros(len(segments)), np.ones(len(segments)), alongA, alongB])
+    order = np.lexsort((along, segIds))
+    segIds = segIds[order]
+    along = along[order]
+    points = segments[segIds, :3] + along[:, None] * (segments[segIds, 3:] - segments[segIds, :3])
+    # snap points together so crossings and shared ends become one node
+    keys = np.round(points[:, [0, 2]] / snap).astype(np.int64)
+    _, node, counts = np.unique(keys, axis=0, return_inverse=True, return_counts=True)
+    node = node.ravel()
+    nodes = np.zeros((len(counts), 3))
+    np.add.at(nodes, node, points)
+    nodes /= counts[:, None]
+    # consecutive points on the same segment make the edges
+    sameSeg = segIds[1:] == segIds[:-1]
+    edges = np.column_stack([node[:-1], node[1:]])[sameSeg]
+    edges = edges[edges[:, 0] != edges[:, 1]]
+    edges = np.unique(np.sort(edges, axis=1), axis=0)
+    return nodes, edges
+
+
+# remove dead ends so only edges that can bound a region remain
+def pruneDangling(nodeCount, edges):
+    while len(edges):
+        degree = np.bincount(edges.ravel(), minlength=nodeCount)
+        dangling = (degree[edges[:, 0]] == 1) | (degree[edges[:, 1]] == 1)
+        if not dangling.any():
+            break
+        edges = edges[~dangling]
+    return edges
+
+
+
+# walk the graph into roads: runs of edges between junctions and dead ends
+# returns lists of node ids, a closed loop starts and ends on the same node
+def graphRoads(nodeCount, edges):
+    neighbours = [[] for node in range(nodeCount)]
+    for edge, (a, b) in enumerate(edges.tolist()):
+        neighbours[a].append((b, edge))
+        neighbours[b].append((a, edge))
+    used = np.zeros(len(edges), dtype=bool)
+    roads = []
+    # start from every end that is not a plain bend, then pick up the loops left over
+    starts = [node for node in range(nodeCount) if len(neighbours[node]) not in (0, 2)]
+    starts += [node for node in range(nodeCount) if len(neighbours[node]) == 2]
+    for start in starts:
+        for nextNode, edge in neighbours[start]:
+            if used[edge]:
+                continue
+            road = [start]
+            node = start
+            while True:
+                used[edge] = True
+                road.append(nextNode)
+                node = nextNode
+                if len(neighbours[node]) != 2 or node == start:
+                    break
+                nextNode, edge = [item for item in neighbours[node] if item[1] != edge][0]
+                if used[edge]:
+                    break
+            roads.append(road)
+    return roads
+
+
+# cut the first stretch off a polyline, measured along it
+def trimStart(points, distance):
+    if distance <= 0:
+        return points
+    lengths = np.concatenate([[0.0], np.cumsum(np.sqrt(((points[1:] - points[:-1]) ** 2).sum(axis=1)))])
+    if distance >= lengths[-1]:
+        return None
+    cut = np.searchsorted(lengths, distance, side="right")
+    t = (distance - lengths[cut - 1]) / (lengths[cut] - lengths[cut - 1])
+    first = points[cut - 1] + (points[cut] - points[cut - 1]) * t
+    return np.vstack([first, points[cut:]])
+
+
+# direction a road leaves a node, looking a short way down the road so tiny segments do not matter
+def leavingDirection(points, reach):
+    lengths = np.sqrt(((points[1:] - points[:-1]) ** 2).sum(axis=1))
+    far = min(np.searchsorted(np.cumsum(lengths), reach) + 1, len(points) - 1)
+    direction = points[far, [0, 2]] - points[0, [0, 2]]
+    return direction / max(np.hypot(*direction), 1e-12)
+
+
+# left normal of a direction on the xz plane
+def leftOf(direction):
+    return np.array([-direction[1], direction[0]])
+
+
+# where the left edge of one road meets the right edge of the next road round a junction
+def junctionCorner(centre, first, second, half, miterLimit=4.0):
+    sideA = centre + leftOf(first) * half
+    sideB = centre - leftOf(second) * half
+    denom = first[0] * second[1] - first[1] * second[0]
+    if abs(denom) > 1e-9:
+        gap = sideB - sideA
+        t = (gap[0] * second[1] - gap[1] * second[0]) / denom
+        corner = sideA + first * t
+        if np.hypot(*(corner - centre)) <= half * miterLimit:
+            return corner
+    # roads nearly in line, keep the corner close to the junction
+    between = leftOf(first) - leftOf(second)
+    if np.hypot(*between) < 1e-9:
+        return sideA
+    return centre + between / np.hypot(*between) * half
+
+
+# both road edges of a polyline with mitred bends, (k, 2, 3) as right then left point
+# a closed polyline, ending where it starts, is mitred at that point too
+def roadEdges(points, half, miterLimit=4.0, closed=False):
+    flat = points[:, [0, 2]]
+    segDir = flat[1:] - flat[:-1]
+    segDir /= np.maximum(np.sqrt((segDir ** 2).sum(axis=1)), 1e-12)[:, None]
+    normals = np.column_stack([-segDir[:, 1], segDir[:, 0]])
+    before = np.vstack([normals[-1:] if closed else normals[:1], normals])
+    after = np.vstack([normals, normals[:1] if closed else normals[-1:]])
+    bisector = before + after
+    scale = 1.0 / np.maximum(1.0 + (before * after).sum(axis=1), 2.0 / miterLimit ** 2)
+    offset = bisector * (scale * half)[:, None]
+    left = points.copy()
+    right = points.copy()
+    left[:, [0, 2]] += offset
+    right[:, [0, 2]] -= offset
+    return np.stack([right, left], axis=1)
+
+
+# a quad strip along a polyline, vertex ids starting at start
+# returns the edge points (2k, 3) and the quads (k - 1, 4)
+def stripMesh(points, half, start=0, closed=False):
+    edgePoints = roadEdges(points, half, closed=closed).reshape(-1, 3)
+    # right, left, next left, next right, so the face points up
+    quads = start + np.arange(len(points) - 1)[:, None] * 2 + np.array([0, 1, 3, 2])
+    return edgePoints, quads
+
+
+# merge vertices that sit on the same spot, renumber the faces and drop the repeats that leaves
+def weldVertices(points, faceCounts, faceConnects, snap=SNAP):
+    keys = np.round(points / snap).astype(np.int64)
+    _, first, remap = np.unique(keys, axis=0, return_index=True, return_inverse=True)
+    faceConnects = remap.ravel()[faceConnects]
+    # a face corner repeating the one before it (going round the face) is dropped
+    face = np.repeat(np.arange(len(faceCounts)), faceCounts)
+    faceStart = np.concatenate([[0], np.cumsum(faceCounts)[:-1]])
+    previous = np.arange(len(faceConnects)) - 1
+    previous[faceStart] = faceStart + faceCounts - 1
+    keep = faceConnects != faceConnects[previous]
+    faceCounts = np.bincount(face[keep], minlength=len(faceCounts))
+    faceConnects = faceConnects[keep]
+    # faces squashed to a line go altogether
+    face = np.repeat(np.arange(len(faceCounts)), faceCounts)
+    solid = faceCounts >= 3
+    return points[first], faceCounts[solid], faceConnects[solid[face]]
+
+
+# one mesh for the whole network: a strip per road and a polygon per junction
+# returns points (v, 3), face vertex counts (f,) and face vertex ids, ready for a single mesh create
+def networkMesh(polylines, width, snap=SNAP):
+    nodes, edges = planarGraph(polylines, snap)
+    half = width * 0.5
+    roads = graphRoads(len(nodes), edges)
+    degree = np.bincount(edges.ravel(), minlength=len(nodes))
+    # every road end that sits on a junction, with the way the road leaves it
+    ends = {}
+    for index, road in enumerate(roads):
+        points = nodes[road]
+        for atEnd, line in ((0, points), (1, points[::-1])):
+            if degree[road[-atEnd]] > 2:
+                ends.setdefault(road[-atEnd], []).append((index, atEnd, leavingDirection(line, width)))
+    setback = np.zeros((len(roads), 2))
+    points = []
+    counts = []
+    connects = []
+    # junction polygons, going round the junction from road to road
+    for node, leaving in ends.items():
+        centre = nodes[node, [0, 2]]
+        leaving.sort(key=lambda item: np.arctan2(item[2][1], item[2][0]))
+        corners = [junctionCorner(centre, leaving[i][2], leaving[(i + 1) % len(leaving)][2], half)
+                   for i in range(len(leaving))]
+        # each road stops where its corners are, so the strip meets the junction cleanly
+        outline = []
+        for i, (index, atEnd, direction) in enumerate(leaving):
+            back = max((corners[i - 1] - centre).dot(direction), (corners[i] - centre).dot(direction), 0.0)
+            setback[index, atEnd] = max(setback[index, atEnd], back)
+            outline.append(centre + direction * back - leftOf(direction) * half)
+            outline.append(centre + direction * back + leftOf(direction) * half)
+            outline.append(corners[i])
+        outline = np.array(outline)
+        start = sum(len(p) for p in points)
+        points.append(np.column_stack([outline[:, 0], np.full(len(outline), nodes[node, 1]), outline[:, 1]]))
+        counts.append(len(outline))
+        # wound so the face points up
+        connects.append(np.arange(start + len(outline) - 1, start - 1, -1))
+    # road strips between the junctions
+    for index, road in enumerate(roads):
+        line = trimStart(nodes[road], setback[index, 0])
+        line = None if line is None else trimStart(line[::-1], setback[index, 1])
+        if line is None or len(line) < 2:
+            continue
+        # a loop with no junction on it goes all the way round and meets itself
+        closed = road[0] == road[-1] and degree[road[0]] <= 2
+        edgePoints, quads = stripMesh(line[::-1], half, sum(len(p) for p in points), closed)
+        points.append(edgePoints)
+        counts.append(np.full(len(quads), 4))
+        connects.append(quads.ravel())
+    if not points:
+        return np.zeros((0, 3)), np.zeros(0, dtype=int), np.zeros(0, dtype=int)
+    counts = np.hstack([np.atleast_1d(count) for count in counts]).astype(int)
+    return weldVertices(np.vstack(points), counts, np.concatenate(connects), snap)
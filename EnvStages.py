@@ -0,0 +1,143 @@
+'''
+Environment Generator Project
+Stage graph: generation stages and their items, rebuilt only when something they depend on changed
+'''
+
+from __future__ import division
+from collections import OrderedDict
+import numpy as np
+
+# change flag of an item whose upstream was rebuilt
+UPSTREAM = "upstream"
+
+
+# parameter values compared the same way whether they are numbers, strings or arrays
+def sameValue(a, b):
+    try:
+        return bool(a == b)
+    except ValueError:
+        return np.array_equal(a, b)
+
+
+class StageGraph(object):
+    # stages run in the order they are added, so upstream stages go first
+    # every stage holds items, e.g. one per curve, each with its own parameters and result
+    def __init__(self):
+        self.stages = OrderedDict()
+        self.items = OrderedDict()
+
+    # build(item, params, old) makes the result, old being the previous result already undone or None
+    # undo(item, result) takes it down; parameters listed in updatable are applied by
+    # update(item, result, params, changed) without building again
+    def addStage(self, name, build, undo, update=None, updatable=()):
+        self.stages[name] = dict(build=build, undo=undo, update=update, updatable=set(updatable))
+
+    # give an item its parameters, flagging the ones that changed
+    # after: the (stage, item) keys it depends on; watch: values that only decide if it is stale, such as curve hashes
+    def set(self, stage, item, params, after=(), watch=None):
+        key = (stage, item)
+        values = dict(params)
+        values.update(("watch:%s" % name, value) for name, value in (watch or {}).items())
+        entry = self.items.get(key)
+        if entry is None:
+            entry = self.items[key] = dict(params={}, values={}, result=None, changed=set(values), after=[])
+        else:
+            names = set(values) | set(entry["values"])
+            missing = object()
+            entry["changed"] |= set(name for name in names 
+                                    if not sameValue(values.get(name, missing), entry["values"].get(name, missing)))
+        entry["params"] = dict(params)
+        entry["values"] = values
+        entry["after"] = list(after)
+        return bool(entry["changed"]) or entry["result"] is None
+
+    def result(self, stage, item):
+        entry = self.items.get((stage, item))
+        return entry["result"] if entry else None
+
+    # every item that depends on key, directly or further down, in graph order
+    def dependents(self, key):
+        found = set([key])
+        order = []
+        for other in self.ordered():
+            if any(dependency in found for dependency in self.items[other]["after"]):
+                found.add(other)
+                order.append(other)
+        return order
+
+    # items of a stage that depend on key, in the order they were first set
+    # with before given, only the ones set before that item
+    def users(self, stage, key, before=None):
+        found = []
+        for other, entry in self.items.items():
+            if other == before:
+                break
+            if other[0] == stage and key in entry["after"]:
+                found.append(other)
+        return found
+
+    # item keys stage by stage, in the order the items were first set within a stage
+    def ordered(self):
+        return [key for stage in self.stages for key in self.items if key[0] == stage]
+
+    # take an item down and drop it; whatever depends on it is taken down too and waits until it is back
+    def remove(self, stage, item):
+        key = (stage, item)
+        if key not in self.items:
+            return
+        for other in reversed(self.dependents(key)):
+            self.takeDown(other)
+            self.items[other]["changed"].add(UPSTREAM)
+        self.takeDown(key)
+        del self.items[key]
+
+    # make an item wait for one more, it is built again on the next run
+    def addDependency(self, key, dependency):
+        entry = self.items[key]
+        if dependency not in entry["after"]:
+            entry["after"].append(dependency)
+            entry["changed"].add(UPSTREAM)
+
+    # items no longer wait for a removed item, the next run builds them without it
+    def dropDependency(self, stage, item):
+        for entry in self.items.values():
+            if (stage, item) in entry["after"]:
+                entry["after"].remove((stage, item))
+                entry["changed"].add(UPSTREAM)
+
+    def takeDown(self, key):
+        entry = self.items[key]
+        if entry["result"] is not None:
+            self.stages[key[0]]["undo"](key[1], entry["result"])
+            entry["old"] = entry["result"]
+            entry["result"] = None
+
+    # bring every item up to date, returns the keys that were built again or updated in place
+    def run(self):
+        rebuild = OrderedDict()
+        inPlace = []
+        for key in self.ordered():
+            entry = self.items[key]
+            stage = self.stages[key[0]]
+            # an item waiting for something that is not there stays down
+            if any(dependency not in self.items for dependency in entry["after"]):
+                continue
+            if any(self.items[dependency]["result"] is None and dependency not in rebuild
+                   for dependency in entry["after"]):
+                continue
+            upstream = any(dependency in rebuild for dependency in entry["after"])
+            if entry["result"] is None or upstream or entry["changed"] - stage["updatable"]:
+                rebuild[key] = entry
+            elif entry["changed"]:
+                inPlace.append(key)
+        # downstream first, so nothing is left pointing at an upstream result that is gone
+        for key in reversed(list(rebuild)):
+            self.takeDown(key)
+        for key in inPlace:
+            entry = self.items[key]
+            self.stages[key[0]]["update"](key[1], entry["result"], entry["params"], entry["changed"])
+            entry["changed"] = set()
+        for key, entry in rebuild.items():
+            entry["result"] = self.stages[key[0]]["build"](key[1], entry["params"], entry.pop("old", None))
+            entry["changed"] = set()
+        return list(rebuild) + inPlace